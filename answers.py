@@ -0,0 +1,233 @@
+import ast
+import logging
+import operator
+import re
+import threading
+from collections import OrderedDict, deque
+from fractions import Fraction
+
+from hints import step_key
+from settings import get_settings
+
+settings = get_settings()
+ANSWER_CACHE_MAX_STEPS = settings.answer_cache_max_steps
+ANSWER_CACHE_MAX_PER_STEP = settings.answer_cache_max_per_step
+
+# LaTeX and unicode spellings rewritten to the plain form a student types
+_REWRITES = [
+    (re.compile(r"\\[dt]frac"), r"\\frac"),
+    (re.compile(r"\\(?:left|right|displaystyle|,|;|!| )"), ""),
+    # Escaped braces are literal ones, e.g. the set \{1, 2\}
+    (re.compile(r"\\([{}])"), r"\1"),
+    (re.compile(r"\\(?:cdot|times)|×|·"), "*"),
+    (re.compile(r"\\div|÷"), "/"),
+    (re.compile(r"−|–"), "-"),
+    (re.compile(r"\\pi|π"), "pi"),
+    (re.compile(r"\\sqrt|√"), "sqrt"),
+    (re.compile(r"\\(sin|cos|tan|ln|log)"), r"\1"),
+]
+_FRAC = re.compile(r"\\frac\{([^{}]*)\}\{([^{}]*)\}")
+# LaTeX grouping braces, e.g. x^{2} or \sqrt{2}; any other braces are kept, {1,2} is a set
+_GROUP = re.compile(r"(\^|_|sqrt)\{([^{}]*)\}")
+_SINGLE_ASSIGNMENT = re.compile(r"^[a-z]=(?!.*=)")
+# Parentheses around a lone number or name that aren't a function call or a product: an
+# operator or the end must follow, (2)3 is 2*3 and not 23
+_REDUNDANT_PARENS = re.compile(r"(?<![\w)])\(([a-z]+|\d+(?:\.\d+)?)\)(?=[-+*/^=,)]|$)")
+# Multiplication signs that implicit multiplication makes optional, e.g. 2*x and 2x
+_OPTIONAL_TIMES = re.compile(r"(?<=[\d)a-z])\*(?=[a-z(])")
+_ARITHMETIC = re.compile(r"^[\d.+\-*/^()]+$")
+
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+
+
+def _evaluate(node) -> Fraction:
+    """Exact value of a parsed arithmetic expression; raises ValueError for anything else."""
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return Fraction(str(node.value))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _evaluate(node.operand)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+        return _OPERATORS[type(node.op)](_evaluate(node.left), _evaluate(node.right))
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+        exponent = _evaluate(node.right)
+        # Whole, small exponents only: anything else may be irrational or enormous
+        if exponent.denominator != 1 or abs(exponent) > 64:
+            raise ValueError("Unsupported exponent")
+        return _evaluate(node.left) ** int(exponent)
+    raise ValueError("Not an arithmetic expression")
+
+
+def _exact_value(text: str):
+    """The exact rational value of a plain arithmetic answer like 1/2, 0.5 or 2^3, else None."""
+    if not _ARITHMETIC.match(text):
+        return None
+    try:
+        return _evaluate(ast.parse(text.replace("^", "**"), mode="eval"))
+    except (SyntaxError, ValueError, ZeroDivisionError, OverflowError, RecursionError):
+        return None
+
+
+def normalize_answer(text: str) -> str:
+    """
+    Canonical form of a step answer, so equivalent spellings compare equal as strings.
+
+    Whitespace, case, dollar signs and common LaTeX are dropped, a leading "x =" is
+    removed, and plain arithmetic is reduced to an exact fraction: "\\frac{1}{2}",
+    "0.5", "2/4" and "x = 1/2" all normalize to "1/2". Applying it twice changes nothing.
+    """
+    text = text.strip().lower().replace("$", "")
+    for pattern, replacement in _REWRITES:
+        text = pattern.sub(replacement, text)
+    text = re.sub(r"\s+", "", text).replace("**", "^")
+    while True:
+        # Innermost first, so x^{\frac{1}{2}} and \frac{x^{2}}{2} both unfold
+        rewritten = _GROUP.sub(r"\1(\2)", _FRAC.sub(r"(\1)/(\2)", text))
+        if rewritten == text:
+            break
+        text = rewritten
+    text = _SINGLE_ASSIGNMENT.sub("", text)
+    while True:
+        rewritten = _REDUNDANT_PARENS.sub(r"\1", text)
+        if rewritten == text:
+            break
+        text = rewritten
+    text = _OPTIONAL_TIMES.sub("", text)
+
+    value = _exact_value(text)
+    if value is not None:
+        return str(value)
+    return text
+
+
+def local_verdict(answer: str, expected: str):
+    """
+    What normalization alone can tell about an answer: True when it normalizes to the
+    expected answer, False when both are plain numbers with different values, else None.
+    """
+    normalized, expected = normalize_answer(answer), normalize_answer(expected)
+    if normalized == expected:
+        return True
+    if _exact_value(normalized) is not None and _exact_value(expected) is not None:
+        return False
+    return None
+
+
+class ValidationTiers:
+    """
+    Process-wide counts and latencies per validation tier (e.g. "fast" and "full" models),
+    plus why answers were escalated past the fast tier.
+    """
+
+    def __init__(self, samples: int = 1024):
+        self._lock = threading.Lock()
+        self._samples = samples
+        self._tiers = {}
+        self.escalations = {}
+
+    def record(self, tier: str, seconds: float):
+        with self._lock:
+            stats = self._tiers.get(tier)
+            if stats is None:
+                stats = self._tiers[tier] = {"count": 0, "seconds": 0.0, "recent": deque(maxlen=self._samples)}
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["recent"].append(seconds)
+
+    def escalate(self, reason: str):
+        with self._lock:
+            self.escalations[reason] = self.escalations.get(reason, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            report = {}
+            for tier, stats in self._tiers.items():
+                recent = sorted(stats["recent"])
+                report[tier] = {
+                    "count": stats["count"],
+                    "mean_seconds": stats["seconds"] / stats["count"],
+                    "p50_seconds": recent[len(recent) // 2],
+                    "p95_seconds": recent[min(len(recent) - 1, int(len(recent) * 0.95))],
+                }
+            return {"tiers": report, "escalations": dict(self.escalations)}
+
+    def reset(self):
+        with self._lock:
+            self._tiers.clear()
+            self.escalations.clear()
+
+
+class AnswerCache:
+    """
+    Process-wide record of answers the LLM judged correct that weren't in a step's accepted set.
+
+    StepContent is immutable and shared, so variants learned while students work a problem
+    are kept here, keyed by step content like hint_cache, and checked alongside the step's
+    own accepted answers. Steps are evicted least recently used.
+    """
+
+    def __init__(self, max_steps: int = ANSWER_CACHE_MAX_STEPS, max_per_step: int = ANSWER_CACHE_MAX_PER_STEP):
+        self.max_steps = max_steps
+        self.max_per_step = max_per_step
+        self._lock = threading.Lock()
+        self._learned = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def accepts(self, step, answer: str) -> bool:
+        """True if `answer` normalizes to one of the step's accepted or learned answers."""
+        normalized = normalize_answer(answer)
+        if normalized in step.accepted_answers:
+            with self._lock:
+                self.hits += 1
+            return True
+        key = step_key(step)
+        with self._lock:
+            learned = self._learned.get(key)
+            if learned is not None:
+                self._learned.move_to_end(key)
+                if normalized in learned:
+                    self.hits += 1
+                    return True
+            self.misses += 1
+        return False
+
+    def learn(self, step, answer: str):
+        """Accept `answer` for this step from now on, e.g. after the LLM judged it correct."""
+        normalized = normalize_answer(answer)
+        if not normalized or normalized in step.accepted_answers:
+            return
+        key = step_key(step)
+        with self._lock:
+            learned = self._learned.get(key)
+            if learned is None:
+                learned = self._learned[key] = set()
+                while len(self._learned) > self.max_steps:
+                    self._learned.popitem(last=False)
+            else:
+                self._learned.move_to_end(key)
+            if len(learned) < self.max_per_step:
+                learned.add(normalized)
+                logging.debug(f"Learned accepted answer {normalized!r} for: {step.question}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "steps": len(self._learned),
+                "learned": sum(len(learned) for learned in self._learned.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+answer_cache = AnswerCache()
+validation_tiers = ValidationTiers()
@@ -0,0 +1,522 @@
+"""
+Headless tutoring API: the same tutoring flow as the Streamlit app, over HTTP and SSE.
+
+A plain ASGI application with no framework dependency; run it under any ASGI server, e.g.
+
+    uvicorn api:app --workers 4
+
+Endpoints (JSON in and out):
+
+    POST /sessions                      {"problem": ...}   start a session and solve the problem in the background
+    POST /sessions/{id}/problems        {"problem": ...}   start another problem in the session
+    GET  /sessions/{id}                                    where the session stands
+    GET  /sessions/{id}/events?after=N                     chat messages as server-sent events, see below
+    POST /sessions/{id}/answers         {"answer": ...}    check an answer to the current step
+    POST /sessions/{id}/hints           {"question": ...}  next hint, or a hint for the student's own question
+    GET  /sessions/{id}/summary                            summary of a finished problem
+    GET  /health                                           circuit breakers, scheduler queues and rate limits
+
+The event stream sends every chat message from index `after` (or the Last-Event-ID header)
+on, with the message index as the event id and its "event" field (problem, step, verdict,
+hint, ...) as the event name, and ends once the problem's summary has been sent.
+
+Model calls go through the shared scheduler like the app's. With SESSION_STORE_URL set,
+sessions are saved to the store after every action and reloaded before the next one, so
+any worker can serve any request; the background solve of a new problem runs on the worker
+that accepted it, and event streams on other workers pick its result up by polling. Saves
+are compare-and-set: when two workers change the same session at once, the request that
+saves second changes nothing and gets a 409 to retry (the background solve retries itself).
+"""
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from scheduler import HINT, SOLVE, SUMMARY, VALIDATE, Overloaded, get_scheduler
+from session_store import SESSION_TTL_SECONDS, SessionPersistence, get_session_store, new_session_id
+from tutor import TutorError, TutorSession
+
+# How often an event stream checks the store for other workers' messages, and sends a keep-alive
+EVENT_POLL_SECONDS = 1.0
+KEEPALIVE_SECONDS = 15.0
+# Times the background solve reapplies its result when another worker saved the session first
+SOLVE_SAVE_ATTEMPTS = 3
+# Sessions kept loaded in a worker; with a store, the least recently used beyond this are
+# dropped from memory (and reloaded on their next request)
+MAX_LOADED_SESSIONS = 1024
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: dict = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class SessionChanged(HTTPError):
+    def __init__(self):
+        super().__init__(409, "The session was changed by another request, reload it and try again")
+
+
+class _Entry:
+    """A session loaded in this worker, with what serializes and announces changes to it."""
+
+    def __init__(self, session_id: str, session: TutorSession, persistence: SessionPersistence = None):
+        self.session_id = session_id
+        self.session = session
+        self.persistence = persistence
+        self.lock = asyncio.Lock()
+        self.changed = asyncio.Condition()
+        self.solving = None
+        self.streams = 0
+        self.used_at = time.monotonic()
+
+    @property
+    def busy(self) -> bool:
+        return (self.lock.locked() or self.streams > 0
+                or (self.solving is not None and not self.solving.done()))
+
+
+class SessionRegistry:
+    """
+    Sessions by id: in this worker's memory, backed by the session store when one is configured.
+
+    Sessions idle for SESSION_TTL_SECONDS are dropped, like the store expires them. With a
+    store, the least recently used beyond `max_loaded` are dropped too, since any request
+    can load them again; a session being worked on or streamed is never dropped.
+    """
+
+    def __init__(self, store=None, ttl: float = SESSION_TTL_SECONDS, max_loaded: int = MAX_LOADED_SESSIONS):
+        self.store = store
+        self.ttl = ttl
+        self.max_loaded = max_loaded
+        self._entries = OrderedDict()
+
+    def create(self) -> _Entry:
+        """A new session, not yet registered: see add(), once its first request is accepted."""
+        session_id = new_session_id()
+        persistence = SessionPersistence(self.store, session_id) if self.store is not None else None
+        return _Entry(session_id, TutorSession(), persistence)
+
+    def add(self, entry: _Entry):
+        self._entries[entry.session_id] = entry
+        self._touch(entry)
+
+    def get(self, session_id: str) -> _Entry:
+        entry = self._entries.get(session_id)
+        if entry is None and self.store is not None:
+            persistence = SessionPersistence(self.store, session_id)
+            session = TutorSession()
+            if persistence.restore(session):
+                entry = self._entries[session_id] = _Entry(session_id, session, persistence)
+        if entry is None:
+            raise HTTPError(404, f"No session {session_id}")
+        self._touch(entry)
+        return entry
+
+    def _touch(self, entry: _Entry):
+        entry.used_at = time.monotonic()
+        self._entries.move_to_end(entry.session_id)
+        self.evict()
+
+    def evict(self):
+        """Drop expired sessions, and with a store the least recently used over `max_loaded`."""
+        expired_before = time.monotonic() - self.ttl
+        over = len(self._entries) - self.max_loaded if self.store is not None else 0
+        for session_id, entry in list(self._entries.items()):
+            if entry.used_at >= expired_before and over <= 0:
+                # Ordered by last use, so the rest are newer still
+                break
+            if entry.busy:
+                continue
+            del self._entries[session_id]
+            over -= 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def refresh(self, entry: _Entry):
+        """Pick up changes another worker saved since this one last looked; a no-op when there are none."""
+        if entry.persistence is not None:
+            await asyncio.to_thread(entry.persistence.restore, entry.session)
+
+    async def commit(self, entry: _Entry):
+        """
+        Save the session, wake its event streams and log its pending Sheets rows.
+
+        Raises SessionChanged, with the session reloaded as the other worker saved it, when
+        that worker saved it since this one loaded it; nothing of this change is kept.
+        """
+        if entry.persistence is not None:
+            await asyncio.to_thread(entry.persistence.flush, entry.session)
+            if entry.persistence.conflict:
+                entry.session.take_sheet_rows()
+                await self.refresh(entry)
+                raise SessionChanged()
+        async with entry.changed:
+            entry.changed.notify_all()
+        rows = entry.session.take_sheet_rows()
+        if rows:
+            _background(asyncio.to_thread(_append_rows, rows))
+
+
+def _append_rows(rows: list):
+    from sheets import append_rows_to_sheet
+    append_rows_to_sheet([json.dumps(row) for row in rows])
+
+
+_tasks = set()
+
+
+def _background(coroutine):
+    # Keep a reference so the task isn't garbage collected before it finishes
+    task = asyncio.ensure_future(coroutine)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+_solver = None
+_solver_lock = threading.Lock()
+
+
+def get_solver():
+    """One MathSolver for the whole worker; its clients are safe to share across requests."""
+    global _solver
+    if _solver is None:
+        with _solver_lock:
+            if _solver is None:
+                from llm import API_KEY, MathSolver
+                _solver = MathSolver(API_KEY)
+    return _solver
+
+
+async def run_job(kind: str, fn, *args):
+    """Run fn on the shared scheduler and await its result, or answer 503 when it sheds the job."""
+    try:
+        ticket = get_scheduler().submit(kind, fn, *args)
+    except Overloaded as e:
+        raise HTTPError(503, str(e), {"retry-after": str(max(1, round(e.retry_after)))})
+    return await asyncio.wrap_future(ticket.future)
+
+
+registry = None
+
+
+def get_registry() -> SessionRegistry:
+    global registry
+    if registry is None:
+        registry = SessionRegistry(get_session_store())
+    return registry
+
+
+# Handlers
+
+
+def _problem(body: dict) -> str:
+    problem = str(body.get("problem") or "").strip()
+    if not problem:
+        raise HTTPError(400, "Missing problem")
+    return problem
+
+
+async def _start_problem(entry: _Entry, body: dict) -> dict:
+    problem = _problem(body)
+    if entry.solving is not None and not entry.solving.done():
+        raise HTTPError(409, "A problem is already being solved for this session")
+    try:
+        ticket = get_scheduler().submit(SOLVE, get_solver().get_math_solution, problem)
+    except Overloaded as e:
+        raise HTTPError(503, str(e), {"retry-after": str(max(1, round(e.retry_after)))})
+    entry.solving = _background(_finish_solve(entry, problem, ticket))
+    return {"session_id": entry.session_id, "status": "solving",
+            "events": f"/sessions/{entry.session_id}/events?after={len(entry.session.chat_history)}"}
+
+
+async def _finish_solve(entry: _Entry, problem: str, ticket):
+    try:
+        solution = await asyncio.wrap_future(ticket.future)
+    except Exception as e:
+        logging.error(f"Error solving {problem!r} for session {entry.session_id}: {str(e)}")
+        solution = None
+        error = str(e)
+    async with entry.lock:
+        for attempt in range(SOLVE_SAVE_ATTEMPTS):
+            await get_registry().refresh(entry)
+            if solution is not None:
+                entry.session.start(problem, solution)
+            else:
+                entry.session.solve_failed(problem, error)
+            try:
+                await get_registry().commit(entry)
+                return
+            except SessionChanged:
+                logging.warning(f"Session {entry.session_id} changed while solving {problem!r}, "
+                                f"attempt {attempt + 1}/{SOLVE_SAVE_ATTEMPTS}")
+        logging.error(f"Dropping the solution of {problem!r} for session {entry.session_id}: "
+                      f"it kept changing on other workers")
+
+
+async def create_session(request) -> tuple:
+    body = await request.json()
+    _problem(body)
+    registry = get_registry()
+    entry = registry.create()
+    # Held until the first save, so a quick solve can't commit before it
+    async with entry.lock:
+        response = await _start_problem(entry, body)
+        # Registered only once the solve is queued, a refused request leaves nothing behind
+        registry.add(entry)
+        # Saved right away so other workers know the session while it's being solved
+        await registry.commit(entry)
+    return 202, response
+
+
+async def start_problem(request, session_id: str) -> tuple:
+    entry = get_registry().get(session_id)
+    body = await request.json()
+    async with entry.lock:
+        await get_registry().refresh(entry)
+        if entry.session.status == "in_progress":
+            raise HTTPError(409, "Finish the current problem first")
+        return 202, await _start_problem(entry, body)
+
+
+async def get_session(request, session_id: str) -> tuple:
+    entry = get_registry().get(session_id)
+    await get_registry().refresh(entry)
+    snapshot = entry.session.snapshot()
+    snapshot["solving"] = entry.solving is not None and not entry.solving.done()
+    return 200, snapshot
+
+
+async def submit_answer(request, session_id: str) -> tuple:
+    entry = get_registry().get(session_id)
+    body = await request.json()
+    answer = str(body.get("answer") or "").strip()
+    if not answer:
+        raise HTTPError(400, "Missing answer")
+    solver = get_solver()
+    async with entry.lock:
+        await get_registry().refresh(entry)
+        session = entry.session
+        try:
+            step = session.answerable_step()
+        except TutorError as e:
+            raise HTTPError(409, str(e))
+        verdict = solver.match_accepted_answer(step, answer) or await run_job(VALIDATE, solver.validate_step, step, answer)
+        messages = session.answer(answer, *verdict)
+        try:
+            if session.needs_summary:
+                summary = await run_job(SUMMARY, solver.generate_problem_summary, session.problem_state['solution'])
+                messages += session.finish(summary)
+        except Exception as e:
+            # The answer counts either way, GET /summary retries
+            logging.error(f"Error summarizing session {session_id}: {str(e)}")
+        await get_registry().commit(entry)
+        return 200, {"messages": messages, "session": session.snapshot()}
+
+
+async def request_hint(request, session_id: str) -> tuple:
+    entry = get_registry().get(session_id)
+    body = await request.json()
+    question = str(body.get("question") or "").strip()
+    async with entry.lock:
+        await get_registry().refresh(entry)
+        session = entry.session
+        try:
+            if not question:
+                messages = session.hint()
+            else:
+                # Same checks as hint(), before spending a model call
+                step = session.hintable_step()
+                hint = await run_job(HINT, get_solver().generate_custom_hint, step, question,
+                                     session.previous_attempts())
+                messages = session.custom_hint(question, hint)
+        except TutorError as e:
+            raise HTTPError(409, str(e))
+        await get_registry().commit(entry)
+        return 200, {"messages": messages, "session": session.snapshot()}
+
+
+async def get_summary(request, session_id: str) -> tuple:
+    entry = get_registry().get(session_id)
+    async with entry.lock:
+        await get_registry().refresh(entry)
+        session = entry.session
+        if session.needs_summary:
+            summary = await run_job(SUMMARY, get_solver().generate_problem_summary, session.problem_state['solution'])
+            session.finish(summary)
+            await get_registry().commit(entry)
+        elif session.status != "complete":
+            raise HTTPError(409, "The problem isn't finished yet")
+        return 200, {"summary": session.problem_state['summary'], "final_answer": session.problem_state['final_answer']}
+
+
+async def health_check(request) -> tuple:
+    from ratelimit import rate_governor
+    from resilience import health
+    return 200, {"dependencies": health(), "scheduler": get_scheduler().snapshot(),
+                 "rate_limits": rate_governor.snapshot()}
+
+
+async def stream_events(request, session_id: str, send):
+    entry = get_registry().get(session_id)
+    after = request.header("last-event-id")
+    after = int(after) + 1 if after is not None and after.isdigit() else int(request.query.get("after", 0))
+
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no"),
+    ]})
+    entry.streams += 1
+    try:
+        await _send_events(entry, after, send)
+    finally:
+        entry.streams -= 1
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def _send_events(entry: _Entry, after: int, send):
+    waited = 0.0
+    while True:
+        history = entry.session.chat_history
+        if after < len(history):
+            chunk = "".join(
+                f"id: {index}\nevent: {message.get('event', 'message')}\ndata: {json.dumps(message)}\n\n"
+                for index, message in enumerate(history[after:], start=after)
+            )
+            after = len(history)
+            waited = 0.0
+            await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+        # Done once the problem is summarized (or failed to solve) and nothing is pending
+        last = history[-1] if history else None
+        solving = entry.solving is not None and not entry.solving.done()
+        if last is not None and last.get("event") in ("summary", "error") and not solving:
+            break
+        if waited >= KEEPALIVE_SECONDS:
+            await send({"type": "http.response.body", "body": b": keep-alive\n\n", "more_body": True})
+            waited = 0.0
+        async with entry.changed:
+            try:
+                await asyncio.wait_for(entry.changed.wait(), EVENT_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                waited += EVENT_POLL_SECONDS
+                if not entry.lock.locked():
+                    await get_registry().refresh(entry)
+
+
+ROUTES = [
+    ("POST", re.compile(r"^/sessions$"), create_session),
+    ("POST", re.compile(r"^/sessions/(\w+)/problems$"), start_problem),
+    ("GET", re.compile(r"^/sessions/(\w+)$"), get_session),
+    ("GET", re.compile(r"^/sessions/(\w+)/events$"), stream_events),
+    ("POST", re.compile(r"^/sessions/(\w+)/answers$"), submit_answer),
+    ("POST", re.compile(r"^/sessions/(\w+)/hints$"), request_hint),
+    ("GET", re.compile(r"^/sessions/(\w+)/summary$"), get_summary),
+    ("GET", re.compile(r"^/health$"), health_check),
+]
+STREAMING = {stream_events}
+
+
+# ASGI plumbing
+
+
+class Request:
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.query = {key: values[-1] for key, values in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        self._headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])}
+
+    def header(self, name: str, default: str = None) -> str:
+        return self._headers.get(name.lower(), default)
+
+    async def body(self) -> bytes:
+        chunks = []
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        return b"".join(chunks)
+
+    async def json(self) -> dict:
+        raw = await self.body()
+        if not raw:
+            return {}
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            raise HTTPError(400, "Request body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return data
+
+
+async def _send_json(send, status: int, payload, headers: dict = None):
+    body = json.dumps(payload).encode("utf-8")
+    raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("ascii"))]
+    raw_headers += [(name.encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items()]
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _until_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    request = Request(scope, receive)
+    allowed = []
+    for method, pattern, handler in ROUTES:
+        match = pattern.match(request.path)
+        if match is None:
+            continue
+        if method != request.method:
+            allowed.append(method)
+            continue
+        try:
+            if handler in STREAMING:
+                # Stop streaming as soon as the client goes away
+                stream = asyncio.ensure_future(handler(request, *match.groups(), send))
+                disconnect = asyncio.ensure_future(_until_disconnect(receive))
+                await asyncio.wait({stream, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                for task in (stream, disconnect):
+                    task.cancel()
+                if stream.done() and not stream.cancelled() and stream.exception() is not None:
+                    raise stream.exception()
+                return
+            status, payload = await handler(request, *match.groups())
+            return await _send_json(send, status, payload)
+        except HTTPError as e:
+            return await _send_json(send, e.status, {"error": str(e)}, e.headers)
+        except Exception as e:
+            logging.error(f"Error handling {request.method} {request.path}: {str(e)}")
+            return await _send_json(send, 500, {"error": str(e)})
+    if allowed:
+        return await _send_json(send, 405, {"error": "Method not allowed"}, {"allow": ", ".join(allowed)})
+    return await _send_json(send, 404, {"error": "Not found"})
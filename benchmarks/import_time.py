@@ -0,0 +1,112 @@
+"""
+Measure cold-start cost for a new worker: how long the app's modules take to import, and
+how long the first request takes after that (when the lazily imported clients load).
+
+Every sample runs in a fresh interpreter so nothing is already in sys.modules:
+
+    python -m benchmarks.import_time --repeat 5
+    python -m benchmarks.import_time --top 15   # also list the slowest imports (python -X importtime)
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+from benchmarks.report import print_table, summarize, write_json
+from benchmarks.stubs import StubServers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Module sets the app imports at startup; main's list mirrors main.py without running Streamlit
+TARGETS = {
+    "llm": ["llm"],
+    "sheets": ["sheets"],
+    "session_store": ["session_store"],
+    "app_modules": ["ui.sidebar", "ui.chat", "ui.feedback", "llm", "utils", "session_store"],
+}
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+print(json.dumps({{"seconds": time.perf_counter() - start, "modules": len(sys.modules)}}))
+"""
+
+_FIRST_REQUEST_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+from llm import API_KEY, MathSolver
+from sheets import append_data_to_sheet
+imported = time.perf_counter()
+solver = MathSolver(API_KEY)
+solution = solver.get_math_solution("Solve for x: 2x + 5 = 13")
+solved = time.perf_counter()
+append_data_to_sheet("import_time benchmark")
+logged = time.perf_counter()
+solver.validate_step_answer_llm(solution.steps[0].answer, solution.steps[0].answer, solution.steps[0].question)
+validated = time.perf_counter()
+print(json.dumps({{
+    "import": imported - start,
+    "first_solve": solved - imported,
+    "first_sheet_row": logged - solved,
+    "first_validation": validated - logged,
+}}))
+"""
+
+
+def _run(script: str, env: dict = None) -> dict:
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                            env=env, cwd=ROOT, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(modules, top: int):
+    """(cumulative seconds, module) for the slowest imports, from python -X importtime."""
+    script = f"import sys; sys.path.insert(0, {ROOT!r})\n" + "".join(f"import {name}\n" for name in modules)
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", script],
+                            capture_output=True, text=True, cwd=ROOT).stderr
+    rows = []
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|(\s*)(\S+)", line)
+        # Only top-level entries (two-space indent), nested imports are included in their parent
+        if match and len(match.group(2)) <= 2:
+            rows.append((int(match.group(1)) / 1e6, match.group(3)))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold import and first-request latency for a new worker")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=0, help="Also list the N slowest imports of the app modules")
+    parser.add_argument("--json", dest="json_path", default=None)
+    args = parser.parse_args(argv)
+
+    samples = {}
+    for name, modules in TARGETS.items():
+        script = _IMPORT_SCRIPT.format(root=ROOT, modules=modules)
+        samples[f"import:{name}"] = [_run(script)["seconds"] for _ in range(args.repeat)]
+
+    with StubServers() as servers:
+        env = dict(os.environ, **servers.environment())
+        for _ in range(args.repeat):
+            for stage, seconds in _run(_FIRST_REQUEST_SCRIPT.format(root=ROOT), env).items():
+                samples.setdefault(f"cold:{stage}", []).append(seconds)
+
+    report = {name: summarize(values) for name, values in samples.items()}
+    print_table(f"Cold start, {args.repeat} fresh interpreters each", report)
+    if args.top:
+        print(f"\nSlowest imports for {', '.join(TARGETS['app_modules'])}:")
+        for seconds, module in slowest_imports(TARGETS["app_modules"], args.top):
+            print(f"{seconds * 1000:>10.1f} ms  {module}")
+    if args.json_path:
+        write_json(args.json_path, report)
+    return report
+
+
+if __name__ == "__main__":
+    main()
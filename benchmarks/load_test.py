@@ -0,0 +1,314 @@
+"""
+Load test for the tutoring pipeline against local API stand-ins.
+
+Simulates N concurrent students, each solving problems step by step, either by calling
+MathSolver directly from threads (`--mode solver`) or by driving the Streamlit app headlessly
+through `streamlit.testing`, one process per student (`--mode app`, exercises ui/chat.py
+end to end). Reports
+time-to-first-step, validation latency, throughput and memory.
+
+Example:
+    python -m benchmarks.load_test --students 20 --problems 3 \
+        --llm-latency lognormal:-0.5,0.4 --wolfram-latency const:0.2
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+from benchmarks.report import print_table, summarize, write_json
+from benchmarks.stubs import LatencyModel, StubServers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_SCRIPT = os.path.join(ROOT, "main.py")
+PROBLEM = "Solve for x: 2x + 5 = 13"
+
+
+class Results:
+    """Thread-safe collection of latency samples by metric name."""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = []
+        self.completed = 0
+        # Full script runs per submitted answer in app mode, from the render profiler
+        self.runs_per_answer = {}
+        self._lock = threading.Lock()
+
+    def add(self, metric: str, seconds: float):
+        with self._lock:
+            self.samples.setdefault(metric, []).append(seconds)
+
+    def complete(self):
+        with self._lock:
+            self.completed += 1
+
+    def error(self, message: str):
+        with self._lock:
+            self.errors.append(message)
+
+    def count_runs(self, runs: int):
+        with self._lock:
+            self.runs_per_answer[runs] = self.runs_per_answer.get(runs, 0) + 1
+
+    def merge(self, samples: dict, errors: list, completed: int, runs_per_answer: dict = None):
+        with self._lock:
+            for metric, values in samples.items():
+                self.samples.setdefault(metric, []).extend(values)
+            self.errors.extend(errors)
+            self.completed += completed
+            for runs, count in (runs_per_answer or {}).items():
+                self.runs_per_answer[runs] = self.runs_per_answer.get(runs, 0) + count
+
+
+def simulated_answer(expected: str, wrong_rate: float) -> str:
+    return "not the answer" if random.random() < wrong_rate else expected
+
+
+def run_solver_student(student_id: int, args, results: Results):
+    """One student calling MathSolver directly: solve, then validate every step."""
+    from llm import MathSolver
+    solver = MathSolver(os.environ["OPENAI_API_KEY"])
+    for _ in range(args.problems):
+        try:
+            start = time.perf_counter()
+            solution = solver.get_math_solution(PROBLEM)
+            results.add("time_to_first_step", time.perf_counter() - start)
+
+            for step in solution.steps:
+                for _attempt in range(3):
+                    start = time.perf_counter()
+                    answer = simulated_answer(step.answer, args.wrong_rate)
+                    # Same path as the app: accepted-answer lookup first, the LLM only on a miss
+                    is_correct, _ = solver.match_accepted_answer(step, answer) or solver.validate_step(step, answer)
+                    results.add("validation", time.perf_counter() - start)
+                    if is_correct:
+                        break
+
+            start = time.perf_counter()
+            solver.generate_problem_summary(solution)
+            results.add("summary", time.perf_counter() - start)
+            results.complete()
+        except Exception as e:
+            results.error(f"student {student_id}: {e}")
+
+
+def _submit(at, text: str, timeout: float):
+    at.text_input(key="input_box").input(text)
+    submit = next(b for b in at.button if b.label == "Submit")
+    submit.click().run(timeout=timeout)
+
+
+def _wait_for_problem(at, timeout: float):
+    """Rerun until the background solve has started the problem (the poller does this in a live app)."""
+    deadline = time.perf_counter() + timeout
+    while at.session_state.problem_state["steps"] is None and at.session_state["solve_jobs"]:
+        if time.perf_counter() > deadline:
+            raise TimeoutError("Problem was not solved in time")
+        time.sleep(0.05)
+        at.run(timeout=timeout)
+
+
+def run_app_student(student_id: int, args, results: Results):
+    """One student driving main.py through the Streamlit test harness."""
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(MAIN_SCRIPT, default_timeout=args.timeout)
+    at.run()
+    for _ in range(args.problems):
+        try:
+            start = time.perf_counter()
+            _submit(at, PROBLEM, args.timeout)
+            _wait_for_problem(at, args.timeout)
+            results.add("time_to_first_step", time.perf_counter() - start)
+            if at.exception:
+                raise RuntimeError(at.exception[0].value)
+
+            steps = at.session_state.problem_state["steps"] or []
+            while at.session_state.problem_state["steps"] is not None \
+                    and at.session_state.problem_state["current_step"] < len(steps):
+                step = steps[at.session_state.problem_state["current_step"]]
+                start = time.perf_counter()
+                _submit(at, simulated_answer(step.answer, args.wrong_rate), args.timeout)
+                results.add("validation_rerun", time.perf_counter() - start)
+                if "last_render" in at.session_state:
+                    results.count_runs(at.session_state["last_render"]["action_runs"])
+
+            results.complete()
+            # Start the next problem from a clean slate
+            next(b for b in at.button if b.key == "reset_button").click().run(timeout=args.timeout)
+        except Exception as e:
+            results.error(f"student {student_id}: {e}")
+
+
+def _app_student_process(student_id: int, args, queue):
+    """
+    AppTest keeps a process-global runtime, so each simulated app student gets its own process.
+    """
+    results = Results()
+    run_app_student(student_id, args, results)
+    queue.put((results.samples, results.errors, results.completed, results.runs_per_answer))
+
+
+def run_students(args, results: Results):
+    if args.mode == "solver":
+        workers = [
+            threading.Thread(target=run_solver_student, args=(i, args, results), name=f"student-{i}")
+            for i in range(args.students)
+        ]
+    else:
+        queue = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=_app_student_process, args=(i, args, queue), name=f"student-{i}")
+            for i in range(args.students)
+        ]
+    for worker in workers:
+        worker.start()
+    if args.mode == "app":
+        for _ in workers:
+            results.merge(*queue.get())
+    for worker in workers:
+        worker.join()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the math tutor against local API stand-ins")
+    parser.add_argument("--mode", choices=("solver", "app"), default="solver")
+    parser.add_argument("--students", type=int, default=10, help="Concurrent simulated students")
+    parser.add_argument("--problems", type=int, default=2, help="Problems per student")
+    parser.add_argument("--wrong-rate", type=float, default=0.2, help="Probability a simulated answer is wrong")
+    parser.add_argument("--llm-latency", default="lognormal:-1.0,0.5", help="Latency for chat completions")
+    parser.add_argument("--reasoning-latency", default=None, help="Latency override for deepseek/deepseek-r1")
+    parser.add_argument("--wolfram-latency", default="const:0.1")
+    parser.add_argument("--sheets-latency", default="const:0.05")
+    parser.add_argument("--provider-rpm", type=int, default=0,
+                        help="Chat completions the stand-in allows per model and minute before answering 429")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-rerun timeout in app mode")
+    parser.add_argument("--tracemalloc", action="store_true", help="Track Python allocation peak (slows the run)")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    latencies = {
+        "chat_completions": LatencyModel(args.llm_latency),
+        "wolfram_query": LatencyModel(args.wolfram_latency),
+        "wolfram_image": LatencyModel(args.wolfram_latency),
+        "sheets_append": LatencyModel(args.sheets_latency),
+    }
+    if args.reasoning_latency:
+        latencies["chat_completions:deepseek/deepseek-r1"] = LatencyModel(args.reasoning_latency)
+
+    with StubServers(latencies, requests_per_minute=args.provider_rpm) as servers:
+        # Must happen before llm/graph/sheets are imported, they read the environment at import time
+        os.environ.update(servers.environment())
+        if args.mode == "app":
+            # Times every script run so the report can count runs per answer
+            os.environ.setdefault("RENDER_PROFILE", "1")
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        results = Results()
+        start = time.perf_counter()
+        run_students(args, results)
+        wall = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else 0
+        tracemalloc.stop()
+        counts = dict(servers.counts)
+
+    latency = {name: summarize(values) for name, values in results.samples.items()}
+    # Only meaningful in solver mode, app-mode students keep their counters in their own processes
+    prompt_tokens = sys.modules["prompts"].prompt_usage.snapshot() if "prompts" in sys.modules else {}
+    dependency_health = sys.modules["resilience"].health() if "resilience" in sys.modules else {}
+    scheduler = sys.modules["scheduler"].get_scheduler().snapshot() if "scheduler" in sys.modules else {}
+    answer_cache = sys.modules["answers"].answer_cache.stats() if "answers" in sys.modules else {}
+    validation_tiers = sys.modules["answers"].validation_tiers.snapshot() if "answers" in sys.modules else {}
+    templates = sys.modules["templates"].template_index.stats() if "templates" in sys.modules else {}
+    equivalence = sys.modules["equivalence"].equivalence_oracle.stats() if "equivalence" in sys.modules else {}
+    rate_limits = sys.modules["ratelimit"].rate_governor.snapshot() if "ratelimit" in sys.modules else {}
+    graphs = sys.modules["graph"].graph_pool.stats() if "graph" in sys.modules else {}
+    completed = results.completed
+    validations = len(results.samples.get("validation", results.samples.get("validation_rerun", [])))
+    report = {
+        "mode": args.mode,
+        "students": args.students,
+        "problems_per_student": args.problems,
+        "wall_seconds": wall,
+        "latency": latency,
+        "throughput": {
+            "problems_per_second": completed / wall if wall else 0.0,
+            "validations_per_second": validations / wall if wall else 0.0,
+        },
+        "memory": {
+            "traced_peak_mb": peak / 1e6,
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "max_student_process_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        },
+        "upstream_requests": counts,
+        "prompt_tokens": prompt_tokens,
+        "dependency_health": dependency_health,
+        "scheduler": scheduler,
+        "answer_cache": answer_cache,
+        "validation_tiers": validation_tiers,
+        "templates": templates,
+        "script_runs_per_answer": dict(sorted(results.runs_per_answer.items())),
+        "rate_limits": rate_limits,
+        "equivalence_oracle": equivalence,
+        "graph_prefetch": graphs,
+        "errors": results.errors,
+    }
+
+    print_table(f"{args.mode} mode, {args.students} students x {args.problems} problems", latency)
+    print(f"\nCompleted problems: {completed} in {wall:.1f}s "
+          f"({report['throughput']['problems_per_second']:.2f}/s, "
+          f"{report['throughput']['validations_per_second']:.2f} validations/s)")
+    memory = report["memory"]
+    print(f"Memory: max RSS {memory['max_rss_mb']:.1f} MB"
+          + (f", per student process {memory['max_student_process_rss_mb']:.1f} MB" if args.mode == "app" else "")
+          + (f", traced peak {memory['traced_peak_mb']:.1f} MB" if args.tracemalloc else ""))
+    print(f"Upstream requests: {counts}")
+    for name, stats in prompt_tokens.items():
+        print(f"Prompt tokens {name}: {stats['prompt_tokens']} total, {stats['cached_tokens']} cached "
+              f"({stats['cache_hit_rate']:.0%}), {stats['uncached_tokens']} uncached")
+    if answer_cache:
+        print(f"Accepted-answer lookups: {answer_cache['hits']} hits, {answer_cache['misses']} misses "
+              f"({answer_cache['hit_rate']:.0%}), {answer_cache['learned']} answers learned")
+    if templates:
+        print(f"Solution templates: {templates['hits']} problems solved from {templates['usable']} usable templates "
+              f"({templates['hit_rate']:.0%} of lookups), {templates['rejected']} rejected")
+    if results.runs_per_answer:
+        print("Script runs per answer: " + ", ".join(
+            f"{runs}: {count}" for runs, count in sorted(results.runs_per_answer.items())))
+    if equivalence.get("lookups"):
+        print(f"Equivalence oracle: {equivalence['queries']} Wolfram queries, {equivalence['cache_hits']} cached, "
+              f"{equivalence['equivalent']} equivalent, {equivalence['different']} different, "
+              f"{equivalence['unknown']} unknown, {equivalence['errors']} errors")
+    if graphs.get("started") or graphs.get("speculative"):
+        print(f"Graph prefetch: {graphs['started']} fetched for steps, {graphs['speculative']} guessed from reasoning "
+              f"({graphs['speculative_hits']} used, {graphs['speculative_unused']} unused)")
+    if rate_limits:
+        print(f"Rate limits: waited {rate_limits['waits']} times for {rate_limits['wait_seconds']:.1f}s, "
+              f"{rate_limits['overruns']} sent over the limit, {rate_limits['rate_limited']} answered 429")
+    for tier, stats in validation_tiers.get("tiers", {}).items():
+        print(f"Validation tier {tier}: {stats['count']} calls, p50 {stats['p50_seconds'] * 1000:.0f} ms")
+    if validation_tiers.get("escalations"):
+        print(f"Escalations: {validation_tiers['escalations']}")
+    for name, status in dependency_health.items():
+        if status["state"] != "closed":
+            print(f"Circuit {name} is {status['state']}: {status['last_error']}")
+    if results.errors:
+        print(f"\n{len(results.errors)} errors, first: {results.errors[0]}")
+    if args.json_path:
+        write_json(args.json_path, report)
+    return report
+
+
+if __name__ == "__main__":
+    main()
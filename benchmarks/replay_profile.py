@@ -0,0 +1,80 @@
+"""
+Profile the non-network parts of the solve pipeline by replaying a cassette.
+
+Record once (against the real APIs, or `--stubs` for the local stand-ins), then replay as
+often as needed; replays are deterministic and offline:
+
+    python -m benchmarks.replay_profile --record --cassette cassettes/linear.cassette
+    python -m benchmarks.replay_profile --cassette cassettes/linear.cassette --repeat 20
+"""
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_pipeline(problem: str):
+    from llm import API_KEY, MathSolver
+    solver = MathSolver(API_KEY)
+    solution = solver.get_math_solution(problem)
+    for step in solution.steps:
+        solver.validate_step_answer_llm(step.answer, step.answer, step.question)
+    solver.generate_problem_summary(solution)
+    return solution
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record or replay-profile the solve pipeline")
+    parser.add_argument("--cassette", default="cassettes/profile.cassette")
+    parser.add_argument("--problem", default="Solve for x: 2x + 5 = 13")
+    parser.add_argument("--record", action="store_true", help="Record a new cassette instead of replaying")
+    parser.add_argument("--stubs", action="store_true", help="Record against the local stand-in servers")
+    parser.add_argument("--realtime", action="store_true", help="Replay with the recorded latencies")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=25, help="Number of functions to print")
+    args = parser.parse_args(argv)
+
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import cassette
+
+    if args.record:
+        servers = None
+        if args.stubs:
+            from benchmarks.stubs import StubServers
+            servers = StubServers().start()
+            os.environ.update(servers.environment())
+            # cassette already parsed the settings, pick up the stand-in URLs
+            from settings import reload_settings
+            reload_settings()
+        if os.path.exists(args.cassette):
+            os.remove(args.cassette)
+        with cassette.use_cassette(args.cassette, "record"):
+            run_pipeline(args.problem)
+        if servers:
+            servers.stop()
+        print(f"Recorded {args.cassette} ({os.path.getsize(args.cassette)} bytes)")
+        return
+
+    # Keep import costs out of the profile: llm itself, and openai, which MathSolver only
+    # imports when the first one is built
+    import llm  # noqa: F401
+    import openai  # noqa: F401
+    profiler = cProfile.Profile()
+    with cassette.use_cassette(args.cassette, "replay", realtime=args.realtime):
+        start = time.perf_counter()
+        profiler.enable()
+        for _ in range(args.repeat):
+            run_pipeline(args.problem)
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+    print(f"{args.repeat} replays in {elapsed:.3f}s ({elapsed / args.repeat * 1000:.1f} ms each)")
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(args.top)
+
+
+if __name__ == "__main__":
+    main()
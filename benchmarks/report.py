@@ -0,0 +1,41 @@
+"""
+Small helpers for summarizing and printing benchmark measurements.
+"""
+import json
+import math
+
+
+def percentile(values, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def summarize(values) -> dict:
+    """Count, mean and p50/p95/p99/max of a list of latencies in seconds."""
+    values = list(values)
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+
+def print_table(title: str, rows: dict):
+    """Print latency summaries (name -> summarize() dict) as an aligned table in milliseconds."""
+    print(f"\n{title}")
+    print(f"{'metric':<28}{'count':>7}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, stats in rows.items():
+        print(f"{name:<28}{stats['count']:>7}"
+              + "".join(f"{stats[k] * 1000:>10.1f}" for k in ("mean", "p50", "p95", "p99", "max")))
+
+
+def write_json(path: str, report: dict):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
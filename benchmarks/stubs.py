@@ -0,0 +1,463 @@
+"""
+Local stand-in servers for the OpenAI/OpenRouter, Wolfram Alpha and Google Sheets APIs.
+
+The servers speak just enough of each wire format for MathSolver, graph.py and sheets.py
+to run unmodified against them, with a configurable latency distribution per endpoint.
+Point the app at them with:
+
+    OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+    OPENROUTER_BASE_URL=http://127.0.0.1:<port>/v1
+    WOLFRAM_BASE_URL=http://127.0.0.1:<port>/v2/query
+    SHEETS_EMULATOR_HOST=http://127.0.0.1:<port>
+
+Run standalone with `python -m benchmarks.stubs` to keep them up for manual testing.
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+import struct
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class LatencyModel:
+    """
+    Samples a response delay in seconds.
+
+    Specs look like `const:0.2`, `uniform:0.1,0.5`, `normal:1.0,0.3` or
+    `lognormal:0.0,0.5` (mu/sigma of the underlying normal, so the median is e^mu).
+    """
+
+    def __init__(self, spec: str = "const:0"):
+        kind, _, args = spec.partition(":")
+        self.spec = spec
+        self.kind = kind
+        self.args = [float(a) for a in args.split(",") if a]
+        if kind not in ("const", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "const":
+            return self.args[0] if self.args else 0.0
+        if self.kind == "uniform":
+            return random.uniform(self.args[0], self.args[1])
+        if self.kind == "normal":
+            return max(0.0, random.gauss(self.args[0], self.args[1]))
+        return random.lognormvariate(self.args[0], self.args[1])
+
+    def __repr__(self):
+        return f"LatencyModel({self.spec!r})"
+
+
+def _png_bytes(width: int = 64, height: int = 48) -> bytes:
+    """A small blank PNG, so the graph path downloads a real image."""
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+    raw = b"".join(b"\x00" + b"\xff" * (width * 3) for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw))
+            + chunk(b"IEND", b""))
+
+
+PLOT_PNG = _png_bytes()
+
+# Canned structured solution returned for every `get_math_solution` function call
+CANNED_SOLUTION = {
+    "steps": [
+        {
+            "instruction": "Isolate the term with $x$ by subtracting $5$ from both sides.",
+            "question": "What is $2x + 5 - 5$ equal to on the right-hand side?",
+            "answer": "8",
+            "accepted_answers": ["2x = 8", "8.0"],
+            "hints": ["What do you need to undo first to get $2x$ alone?", "Subtract $5$ from both sides of $2x + 5 = 13$.", "Work out $13 - 5$."],
+            "explanation": "Subtracting $5$ from $13$ gives $8$, so $2x = 8$.",
+            "graph_query": "plot y = 2x + 5"
+        },
+        {
+            "instruction": "Divide both sides by the coefficient of $x$.",
+            "question": "What is $x$ when $2x = 8$?",
+            "answer": "4",
+            "accepted_answers": ["x = 4", "4.0"],
+            "hints": ["Which operation undoes multiplying by $2$?", "Divide both sides of $2x = 8$ by $2$.", "Work out $8 / 2$."],
+            "explanation": "Dividing $8$ by $2$ gives $x = 4$.",
+            "graph_query": "plot y = 2x"
+        },
+        {
+            "instruction": "Check the solution by substituting back into the equation.",
+            "question": "What is $2(4) + 5$?",
+            "answer": "13",
+            "hints": ["Substitute your value of $x$ back into the left-hand side.", "Compute $2 \\cdot 4$ first, then add $5$.", "Work out $8 + 5$."],
+            "explanation": "$2(4) + 5 = 13$, which matches the right-hand side."
+        }
+    ],
+    "final_answer": "x = 4",
+    "original_problem": "Solve for x: 2x + 5 = 13"
+}
+
+REASONING_TEXT = (
+    "We subtract 5 from both sides to get 2x = 8, then divide by 2 to get x = 4. "
+    "Checking: 2(4) + 5 = 13."
+)
+
+
+def _answer_key(text: str) -> str:
+    return text.replace(" ", "").replace("$", "").lower()
+
+
+def _function_arguments(name: str, messages: list) -> dict:
+    """Build canned arguments for each function call the app makes."""
+    user_content = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    if name == "get_math_solution":
+        return CANNED_SOLUTION
+    if name == "validate_answer":
+        student = re.search(r"Student's Answer: (.*)", user_content)
+        expected = re.search(r"Expected Answer: (.*)", user_content)
+        is_correct = bool(student and expected and _answer_key(student.group(1)) == _answer_key(expected.group(1)))
+        return {
+            "is_correct": is_correct,
+            "explanation": "Nice work, that matches." if is_correct else "That doesn't quite match what this step asks for.",
+            # Less sure about rejections, so a cascaded validator escalates those
+            "confidence": 0.95 if is_correct else 0.7
+        }
+    if name == "grade_steps":
+        results = []
+        for number, student, expected in re.findall(
+                r"Step (\d+)\nQuestion: .*?\nStudent's Answer: (.*?)\nExpected Answer: (.*?)(?:\n|$)", user_content):
+            is_correct = _answer_key(student) == _answer_key(expected)
+            results.append({
+                "step": int(number),
+                "is_correct": is_correct,
+                "explanation": "Nice work, that matches." if is_correct else "That doesn't quite match what this step asks for."
+            })
+        return {"results": results}
+    if name == "generate_hint":
+        return {"hint": "Think about which operation undoes the one applied to $x$. What do you get if you apply it to both sides?"}
+    return {}
+
+
+def _estimate_tokens(payload) -> int:
+    return max(1, len(json.dumps(payload)) // 4)
+
+
+_MATH = {name: getattr(math, name) for name in ("sin", "cos", "tan", "sinh", "cosh", "tanh", "sqrt", "exp", "pi", "e")}
+_MATH.update(ln=math.log, log=math.log, arcsin=math.asin, arccos=math.acos, arctan=math.atan,
+             sec=lambda x: 1 / math.cos(x), csc=lambda x: 1 / math.sin(x), cot=lambda x: 1 / math.tan(x))
+
+
+def _simplify(expression: str) -> str:
+    """
+    Stand-in for Wolfram's simplify on the explicit expressions equivalence.py sends: "0"
+    when the expression vanishes at random points, the number when it's constant, else the
+    expression itself.
+    """
+    variables = set(re.findall(r"(?<![a-z])[a-z](?![a-z])", expression)) - {"e"}
+    values = []
+    for _ in range(3):
+        scope = dict(_MATH, **{name: random.uniform(0.5, 2.0) for name in variables})
+        try:
+            values.append(eval(expression.replace("^", "**"), {"__builtins__": {}}, scope))
+        except Exception:
+            return expression
+    if all(abs(value) < 1e-9 for value in values):
+        return "0"
+    if max(values) - min(values) < 1e-9:
+        return f"{values[0]:g}"
+    return expression
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "StubServer/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (timeout or deadline) while the simulated latency elapsed
+            self.close_connection = True
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json", headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_events(self, events, gap: float = 0.0, headers: dict = None):
+        """Send server-sent events with chunked encoding, like a streamed completion."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        for event in events + ["[DONE]"]:
+            data = f"data: {event if isinstance(event, str) else json.dumps(event)}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+            time.sleep(gap)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_json(self, payload, status: int = 200, headers: dict = None):
+        self._send(status, json.dumps(payload).encode("utf-8"), headers=headers)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        return json.loads(raw) if raw else {}
+
+    def _delay(self, endpoint: str, model: str = None):
+        self.server.stubs.record(endpoint)
+        time.sleep(self.server.stubs.latency_for(endpoint, model).sample())
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.endswith("/v2/query"):
+            query = parse_qs(urlparse(self.path).query).get("input", [""])[0]
+            if query.startswith("simplify "):
+                self._delay("wolfram_simplify")
+                self._send_json({
+                    "queryresult": {
+                        "success": True,
+                        "pods": [{"title": "Result", "id": "Result",
+                                  "subpods": [{"plaintext": _simplify(query[len("simplify "):])}]}]
+                    }
+                })
+                return
+            self._delay("wolfram_query")
+            host = self.headers.get("Host")
+            self._send_json({
+                "queryresult": {
+                    "success": True,
+                    "pods": [
+                        {"title": "Input interpretation", "subpods": [{"plaintext": "plot"}]},
+                        {"title": "Plot", "subpods": [{"img": {"src": f"http://{host}/img/plot.png"}}]}
+                    ]
+                }
+            })
+        elif path.startswith("/img/"):
+            self._delay("wolfram_image")
+            self._send(200, PLOT_PNG, "image/png")
+        else:
+            self._send_json({"error": f"No stub for GET {path}"}, 404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._read_json()
+        if path.endswith("/chat/completions"):
+            self._chat_completion(body)
+        elif ":append" in path:
+            self._delay("sheets_append")
+            rows = body.get("values", [])
+            self._send_json({
+                "spreadsheetId": path.split("/")[3] if path.count("/") >= 3 else "stub",
+                "updates": {"updatedRows": len(rows), "updatedCells": sum(len(r) for r in rows)}
+            })
+        else:
+            self._send_json({"error": f"No stub for POST {path}"}, 404)
+
+    def _chat_completion(self, body: dict):
+        model = body.get("model", "stub")
+        messages = body.get("messages", [])
+        admitted, headers = self.server.stubs.admit(model)
+        if not admitted:
+            self.server.stubs.record("chat_completions_429")
+            self._send_json({"error": {"message": f"Rate limit reached for {model}", "type": "requests",
+                                       "code": "rate_limit_exceeded"}}, 429, headers)
+            return
+        self._delay("chat_completions", model)
+
+        function_call = body.get("function_call")
+        if isinstance(function_call, dict) and function_call.get("name"):
+            name = function_call["name"]
+            message = {
+                "role": "assistant",
+                "content": None,
+                "function_call": {"name": name, "arguments": json.dumps(_function_arguments(name, messages))}
+            }
+            finish_reason = "function_call"
+        else:
+            content = REASONING_TEXT if "deepseek" in model else "Great job! You used inverse operations to isolate $x$. Keep practicing!"
+            message = {"role": "assistant", "content": content}
+            finish_reason = "stop"
+
+        completion_id = f"chatcmpl-stub-{random.getrandbits(32):08x}"
+        prompt_tokens = _estimate_tokens([body.get("functions"), messages])
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": _estimate_tokens(message),
+            "total_tokens": prompt_tokens + _estimate_tokens(message),
+            "prompt_tokens_details": {"cached_tokens": self.server.stubs.cached_prefix_tokens(body)}
+        }
+        if body.get("stream"):
+            chunks = self._stream_chunks(completion_id, model, message, finish_reason)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                # Like OpenAI, usage comes in a last chunk of its own with no choices
+                chunks.append({"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                               "model": model, "choices": [], "usage": usage})
+            self._send_events(chunks, self.server.stubs.stream_gap, headers)
+            return
+
+        self._send_json({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": usage
+        }, headers=headers)
+
+
+    @staticmethod
+    def _stream_chunks(completion_id: str, model: str, message: dict, finish_reason: str, size: int = 24) -> list:
+        """Split a message into chat.completion.chunk deltas of about `size` characters."""
+        if message.get("function_call"):
+            name = message["function_call"]["name"]
+            text = message["function_call"]["arguments"]
+            deltas = [{"role": "assistant", "function_call": {"name": name, "arguments": ""}}]
+            deltas += [{"function_call": {"arguments": text[i:i + size]}} for i in range(0, len(text), size)]
+        else:
+            text = message["content"]
+            deltas = [{"role": "assistant", "content": ""}]
+            deltas += [{"content": text[i:i + size]} for i in range(0, len(text), size)]
+        chunks = [{"index": 0, "delta": delta, "finish_reason": None} for delta in deltas]
+        chunks.append({"index": 0, "delta": {}, "finish_reason": finish_reason})
+        return [
+            {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+             "model": model, "choices": [choice]}
+            for choice in chunks
+        ]
+
+
+class StubServers:
+    """
+    Runs one threaded HTTP server that serves all three stand-in APIs.
+
+    Args:
+        latencies (dict): Maps an endpoint name (`chat_completions`, `wolfram_query`,
+            `wolfram_simplify`, `wolfram_image`, `sheets_append`) or `chat_completions:<model>` to a LatencyModel.
+        host (str): Interface to bind.
+        port (int): Port to bind, 0 picks a free one.
+        stream_gap (float): Seconds between chunks of a streamed completion.
+        requests_per_minute (int): Chat completions allowed per model in any 60 seconds, 0 for no
+            limit. Responses carry OpenAI's x-ratelimit-* headers and requests over the limit get a 429.
+    """
+
+    def __init__(self, latencies: dict = None, host: str = "127.0.0.1", port: int = 0, stream_gap: float = 0.0,
+                 requests_per_minute: int = 0):
+        self.latencies = latencies or {}
+        self.stream_gap = stream_gap
+        self.requests_per_minute = requests_per_minute
+        self._admitted = {}
+        self.counts = {}
+        self._prefixes = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stubs = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def latency_for(self, endpoint: str, model: str = None) -> LatencyModel:
+        if model and f"{endpoint}:{model}" in self.latencies:
+            return self.latencies[f"{endpoint}:{model}"]
+        return self.latencies.get(endpoint) or LatencyModel()
+
+    def record(self, endpoint: str):
+        with self._lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def admit(self, model: str):
+        """Count a completion against the model's sliding window: (allowed, rate-limit headers)."""
+        if not self.requests_per_minute:
+            return True, {}
+        now = time.time()
+        with self._lock:
+            window = self._admitted.setdefault(model, deque())
+            while window and now - window[0] >= 60:
+                window.popleft()
+            allowed = len(window) < self.requests_per_minute
+            if allowed:
+                window.append(now)
+            reset = 60 - (now - window[0]) if window else 0.0
+            remaining = self.requests_per_minute - len(window)
+        headers = {
+            "x-ratelimit-limit-requests": str(self.requests_per_minute),
+            "x-ratelimit-remaining-requests": str(remaining),
+            "x-ratelimit-reset-requests": f"{reset:.3f}s",
+        }
+        if not allowed:
+            headers["retry-after"] = f"{reset:.3f}"
+        return allowed, headers
+
+    def cached_prefix_tokens(self, body: dict) -> int:
+        """
+        Emulate provider prompt caching: a repeated prefix (functions + system message) of at
+        least 1024 tokens is reported as cached, in 128-token increments.
+        """
+        system = [m for m in body.get("messages", []) if m.get("role") == "system"]
+        prefix = json.dumps([body.get("model"), body.get("functions"), system], sort_keys=True)
+        tokens = _estimate_tokens(prefix)
+        with self._lock:
+            seen = prefix in self._prefixes
+            self._prefixes.add(prefix)
+        return tokens // 128 * 128 if seen and tokens >= 1024 else 0
+
+    def environment(self) -> dict:
+        """Environment variables that point the app at these servers."""
+        return {
+            "OPENAI_API_KEY": "stub-key",
+            "OPENAI_BASE_URL": f"{self.url}/v1",
+            "OPENROUTER_API_KEY": "stub-key",
+            "OPENROUTER_BASE_URL": f"{self.url}/v1",
+            "WOLFRAM_APP_ID": "stub-app-id",
+            "WOLFRAM_BASE_URL": f"{self.url}/v2/query",
+            "SHEETS_EMULATOR_HOST": self.url,
+        }
+
+    def start(self) -> "StubServers":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-servers", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the local API stand-ins")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--llm-latency", default="lognormal:0.0,0.4")
+    args = parser.parse_args()
+
+    servers = StubServers({"chat_completions": LatencyModel(args.llm_latency)}, port=args.port).start()
+    for key, value in servers.environment().items():
+        print(f"{key}={value}")
+    try:
+        servers._thread.join()
+    except KeyboardInterrupt:
+        servers.stop()
@@ -0,0 +1,188 @@
+"""
+Compare answer validators on a labeled dataset: accuracy, false accepts, latency and cost.
+
+Each case in the dataset (JSON lines with question, expected, answer, correct and category)
+is checked by every validator. A validator is either a local checker (`exact`, the old
+string comparison, or `normalized`, the accepted-answer lookup), `cascade` (the app's
+fast-model-then-full-model validation), `oracle` (the Wolfram equivalence oracle, with the
+cascade for whatever it can't settle) or a model name, which is run through
+MathSolver.validate_step_answer_llm with that model:
+
+    python -m benchmarks.validator_eval --validators normalized,cascade,oracle,gpt-4o,gpt-4o-mini
+    python -m benchmarks.validator_eval --stubs --by-category   # smoke test against the local stand-ins
+
+A false accept (a wrong answer marked correct) costs a student more than a false reject,
+so compare models on false_accept_rate as well as accuracy.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.report import summarize, write_json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "validator_cases.jsonl")
+LOCAL_CHECKERS = ("exact", "normalized")
+CASCADE = "cascade"
+ORACLE = "oracle"
+
+
+def load_cases(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def make_validator(name: str, solver):
+    """fn(case) -> bool for a local checker, the cascade or a model name."""
+    if name == "exact":
+        return lambda case: solver.validate_step_answer(case["answer"], case["expected"])
+    if name == "normalized":
+        from answers import normalize_answer
+        return lambda case: normalize_answer(case["answer"]) == normalize_answer(case["expected"])
+    if name == ORACLE:
+        from equivalence import EquivalenceOracle, VerdictCache
+        # Its own in-memory cache, so every case is really asked
+        oracle = EquivalenceOracle(enabled=True, cache=VerdictCache(path=""))
+
+        def validate(case):
+            verdict = oracle.check(case["answer"], case["expected"], case["question"])
+            if verdict is None:
+                verdict = solver.validate_step_answer_llm(case["answer"], case["expected"], case["question"])[0]
+            return bool(verdict)
+        return validate
+    model = None if name == CASCADE else name
+    return lambda case: bool(solver.validate_step_answer_llm(
+        case["answer"], case["expected"], case["question"], model=model
+    )[0])
+
+
+def evaluate(name: str, validator, cases: list, concurrency: int) -> dict:
+    """Run one validator over every case and score its verdicts against the labels."""
+    from answers import validation_tiers
+    from prompts import VALIDATE_ANSWER, estimate_cost, prompt_usage
+
+    verdicts = [None] * len(cases)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def check(index: int):
+        start = time.perf_counter()
+        try:
+            verdict = validator(cases[index])
+        except Exception as e:
+            with lock:
+                errors.append(f"case {index}: {e}")
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            verdicts[index] = verdict
+            latencies.append(elapsed)
+
+    prompt_usage.reset()
+    validation_tiers.reset()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(check, range(len(cases))))
+
+    scored = [(case, verdict) for case, verdict in zip(cases, verdicts) if verdict is not None]
+    right = [verdict for case, verdict in scored if case["correct"]]
+    wrong = [verdict for case, verdict in scored if not case["correct"]]
+    by_category = {}
+    for case, verdict in scored:
+        totals = by_category.setdefault(case.get("category", "uncategorized"), [0, 0])
+        totals[0] += verdict == case["correct"]
+        totals[1] += 1
+
+    cost = 0.0
+    if name not in LOCAL_CHECKERS:
+        usage = prompt_usage.snapshot().get(VALIDATE_ANSWER.name) or {}
+        for model, totals in usage.get("by_model", {}).items():
+            model_cost = estimate_cost(model, totals["prompt_tokens"], totals["cached_tokens"],
+                                       totals["completion_tokens"])
+            cost = cost + model_cost if cost is not None and model_cost is not None else None
+
+    return {
+        "cases": len(scored),
+        "errors": errors,
+        "accuracy": sum(verdict == case["correct"] for case, verdict in scored) / len(scored) if scored else 0.0,
+        "false_accept_rate": sum(wrong) / len(wrong) if wrong else 0.0,
+        "false_reject_rate": right.count(False) / len(right) if right else 0.0,
+        "latency": summarize(latencies),
+        "cost_per_1k": cost / len(scored) * 1000 if cost is not None and scored else None,
+        "by_category": {category: correct / total for category, (correct, total) in sorted(by_category.items())},
+        "tiers": validation_tiers.snapshot() if name == CASCADE else None,
+    }
+
+
+def print_report(report: dict, by_category: bool):
+    print(f"\n{'validator':<22}{'cases':>7}{'accuracy':>10}{'false acc':>11}{'false rej':>11}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'$/1k':>9}{'errors':>8}")
+    for name, result in report.items():
+        cost = f"{result['cost_per_1k']:.3f}" if result["cost_per_1k"] is not None else "?"
+        print(f"{name:<22}{result['cases']:>7}{result['accuracy']:>10.1%}{result['false_accept_rate']:>11.1%}"
+              f"{result['false_reject_rate']:>11.1%}{result['latency']['p50'] * 1000:>10.1f}"
+              f"{result['latency']['p95'] * 1000:>10.1f}{cost:>9}{len(result['errors']):>8}")
+    if by_category:
+        categories = sorted({category for result in report.values() for category in result["by_category"]})
+        print(f"\n{'accuracy by category':<22}" + "".join(f"{name[:14]:>16}" for name in report))
+        for category in categories:
+            print(f"{category:<22}" + "".join(
+                f"{result['by_category'][category]:>16.1%}" if category in result["by_category"] else f"{'-':>16}"
+                for result in report.values()
+            ))
+    for name, result in report.items():
+        if result["tiers"]:
+            tiers = ", ".join(f"{tier} {stats['count']} (p50 {stats['p50_seconds'] * 1000:.0f} ms)"
+                              for tier, stats in result["tiers"]["tiers"].items())
+            print(f"\n{name} tiers: {tiers}; escalations: {result['tiers']['escalations']}")
+    for name, result in report.items():
+        if result["errors"]:
+            print(f"\n{name}: {len(result['errors'])} errors, first: {result['errors'][0]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accuracy, latency and cost of answer validators")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="Labeled cases, one JSON object per line")
+    parser.add_argument("--validators", default="exact,normalized,cascade,gpt-4o,gpt-4o-mini",
+                        help=f"Comma-separated local checkers ({', '.join(LOCAL_CHECKERS)}), {CASCADE} and model names")
+    parser.add_argument("--concurrency", type=int, default=4, help="Cases checked in parallel per validator")
+    parser.add_argument("--stubs", action="store_true", help="Run the models against the local stand-in servers")
+    parser.add_argument("--by-category", action="store_true", help="Also print accuracy per case category")
+    parser.add_argument("--json", dest="json_path", default=None)
+    args = parser.parse_args(argv)
+
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    servers = None
+    if args.stubs:
+        from benchmarks.stubs import StubServers
+        servers = StubServers().start()
+        os.environ.update(servers.environment())
+        from settings import reload_settings
+        reload_settings()
+
+    try:
+        from llm import API_KEY, MathSolver
+        solver = MathSolver(API_KEY)
+        cases = load_cases(args.dataset)
+        report = {}
+        for name in (name.strip() for name in args.validators.split(",") if name.strip()):
+            report[name] = evaluate(name, make_validator(name, solver), cases,
+                                    1 if name in LOCAL_CHECKERS else args.concurrency)
+    finally:
+        if servers:
+            servers.stop()
+
+    print(f"\n{len(cases)} labeled cases from {args.dataset}")
+    print_report(report, args.by_category)
+    if args.json_path:
+        write_json(args.json_path, report)
+    return report
+
+
+if __name__ == "__main__":
+    main()
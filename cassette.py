@@ -0,0 +1,345 @@
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import httpx
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+
+from settings import get_settings
+
+settings = get_settings()
+# CASSETTE_MODE: "off" (default), "record" or "replay"
+CASSETTE_MODE = settings.cassette_mode
+CASSETTE_PATH = settings.cassette_path
+# When set, replayed responses wait for the recorded latency (and streaming chunk gaps)
+CASSETTE_REALTIME = settings.cassette_realtime
+
+# Query parameters and paths that carry credentials and must never reach a cassette file
+SECRET_PARAMS = {"appid", "key", "api_key", "access_token"}
+UNRECORDED_PATH_SUFFIXES = ("/token",)
+# Response headers worth keeping, everything else is dropped to keep cassettes small
+KEPT_HEADERS = {"content-type", "content-encoding"}
+KEPT_HEADER_PREFIXES = ("x-ratelimit-", "retry-after", "openai-processing-ms")
+_VERSION_SEGMENT = re.compile(r"/v\d+(?:beta\d*)?/")
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode when no recorded response matches a request."""
+
+
+def _scrub_url(url: str) -> str:
+    parts = urlsplit(str(url))
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in SECRET_PARAMS]
+    return parts._replace(query=urlencode(sorted(query))).geturl()
+
+
+def _canonical_body(body) -> bytes:
+    if not body:
+        return b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    try:
+        return json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    except ValueError:
+        return body
+
+
+def _api_path(path: str) -> str:
+    """Path from the API version segment on, so /api/v1/chat/completions and /v1/chat/completions match."""
+    match = None
+    for match in _VERSION_SEGMENT.finditer(path):
+        pass
+    return path[match.start():] if match else path
+
+
+def _body_signature(body) -> str:
+    """Coarse shape of a JSON body: its top-level keys plus the model and function being called."""
+    try:
+        payload = json.loads(body) if body else {}
+    except ValueError:
+        return ""
+    if not isinstance(payload, dict):
+        return ""
+    function_call = payload.get("function_call")
+    name = function_call.get("name") if isinstance(function_call, dict) else function_call
+    return f"{','.join(sorted(payload))}|{payload.get('model', '')}|{name or ''}"
+
+
+def _kept_headers(headers) -> dict:
+    return {
+        k.lower(): v for k, v in headers.items()
+        if k.lower() in KEPT_HEADERS or k.lower().startswith(KEPT_HEADER_PREFIXES)
+    }
+
+
+class Cassette:
+    """
+    A file of recorded request/response pairs.
+
+    Each record is one gzip member holding a JSON line, so recording only ever appends.
+    Requests are keyed by a hash of method, path, scrubbed query and canonical JSON body; replay
+    falls back to a "loose" key of method, path and body shape (model and function name for
+    completions) for requests with volatile bodies such as the timestamped Sheets rows. Responses are stored as the time to headers plus
+    (offset, bytes) chunks timed from there, so streamed completions replay delta by delta.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", realtime: bool = False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.realtime = realtime
+        self._exact = {}
+        self._loose = {}
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    @staticmethod
+    def keys(method: str, url: str, body=None):
+        # Host and base path are left out so cassettes recorded against the stand-ins replay anywhere
+        scrubbed = urlsplit(_scrub_url(url))
+        path = f"{method.upper()} {_api_path(scrubbed.path)}"
+        digest = hashlib.sha256(f"{path}?{scrubbed.query}\n".encode("utf-8") + _canonical_body(body))
+        return digest.hexdigest()[:32], f"{path} {_body_signature(body)}"
+
+    @staticmethod
+    def recordable(url: str) -> bool:
+        return not urlsplit(str(url)).path.endswith(UNRECORDED_PATH_SUFFIXES)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise CassetteMiss(f"Cassette file not found: {self.path}")
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._index(json.loads(line))
+        logging.debug(f"Loaded {sum(len(q) for q in self._exact.values())} cassette records from {self.path}")
+
+    def _index(self, record: dict):
+        self._exact.setdefault(record["key"], deque()).append(record)
+        self._loose.setdefault(record["loose"], deque()).append(record)
+
+    def lookup(self, key: str, loose: str) -> dict:
+        """Return the next recorded response for a request, cycling through repeats."""
+        with self._lock:
+            for index, name in ((self._exact, key), (self._loose, loose)):
+                records = index.get(name)
+                if records:
+                    record = records[0]
+                    records.rotate(-1)
+                    return record
+        raise CassetteMiss(f"No recorded response for {loose} ({key})")
+
+    def record(self, key: str, loose: str, status: int, headers: dict, chunks: list, elapsed: float):
+        record = {
+            "key": key,
+            "loose": loose,
+            "status": status,
+            "headers": _kept_headers(headers),
+            "elapsed": round(elapsed, 4),
+            "chunks": [[round(offset, 4), base64.b64encode(data).decode("ascii")] for offset, data in chunks],
+        }
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(gzip.compress(line))
+
+    def replay_chunks(self, record: dict):
+        """Yield the recorded body chunks, honouring recorded timing in realtime mode."""
+        start = time.perf_counter()
+        for offset, data in record["chunks"]:
+            if self.realtime:
+                delay = offset - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            yield base64.b64decode(data)
+
+    def wait_for_headers(self, record: dict):
+        if self.realtime:
+            time.sleep(record["elapsed"])
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    def __init__(self, cassette: Cassette, keys, response: httpx.Response, elapsed: float):
+        self.cassette = cassette
+        self.keys = keys
+        self.response = response
+        self.elapsed = elapsed
+        self.start = time.perf_counter()
+        self.chunks = []
+
+    def __iter__(self):
+        for data in self.response.stream:
+            self.chunks.append((time.perf_counter() - self.start, data))
+            yield data
+
+    def close(self):
+        self.response.close()
+        self.cassette.record(*self.keys, self.response.status_code, self.response.headers, self.chunks, self.elapsed)
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    def __init__(self, cassette: Cassette, record: dict):
+        self.cassette = cassette
+        self.record = record
+
+    def __iter__(self):
+        yield from self.cassette.replay_chunks(self.record)
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """httpx transport used by the OpenAI clients; records or replays at the HTTP level."""
+
+    def __init__(self, cassette: Cassette, wrapped: httpx.BaseTransport = None):
+        self.cassette = cassette
+        self.wrapped = wrapped or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        keys = Cassette.keys(request.method, str(request.url), request.read())
+        if self.cassette.replaying:
+            record = self.cassette.lookup(*keys)
+            self.cassette.wait_for_headers(record)
+            return httpx.Response(record["status"], headers=record["headers"],
+                                  stream=_ReplayStream(self.cassette, record), request=request)
+
+        start = time.perf_counter()
+        response = self.wrapped.handle_request(request)
+        if not Cassette.recordable(request.url):
+            return response
+        stream = _RecordingStream(self.cassette, keys, response, time.perf_counter() - start)
+        return httpx.Response(response.status_code, headers=response.headers, stream=stream, request=request)
+
+    def close(self):
+        self.wrapped.close()
+
+
+class CassetteAdapter(HTTPAdapter):
+    """
+    requests adapter used by graph.py; records or replays whole responses.
+
+    Without an explicit cassette it follows whichever one is active at send time, so a
+    module-level session still honours `use_cassette` blocks.
+    """
+
+    def __init__(self, cassette: Cassette = None, **kwargs):
+        self.cassette = cassette
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        cassette = self.cassette or get_cassette()
+        if cassette is None:
+            return super().send(request, **kwargs)
+        keys = Cassette.keys(request.method, request.url, request.body)
+        if cassette.replaying:
+            record = cassette.lookup(*keys)
+            cassette.wait_for_headers(record)
+            response = requests.Response()
+            response.status_code = record["status"]
+            response.headers.update(record["headers"])
+            response.headers.pop("content-encoding", None)  # requests stores decoded content
+            response._content = b"".join(cassette.replay_chunks(record))
+            response.url = request.url
+            response.request = request
+            response.reason = "Replayed"
+            return response
+
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        content = response.content
+        if Cassette.recordable(request.url):
+            elapsed = time.perf_counter() - start
+            cassette.record(*keys, response.status_code, response.headers, [(0.0, content)], elapsed)
+        return response
+
+
+class CassetteHttp:
+    """httplib2-compatible wrapper used by the Sheets client."""
+
+    def __init__(self, cassette: Cassette, http: httplib2.Http = None):
+        self.cassette = cassette
+        self.http = http or httplib2.Http()
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        keys = Cassette.keys(method, uri, body)
+        if self.cassette.replaying:
+            record = self.cassette.lookup(*keys)
+            self.cassette.wait_for_headers(record)
+            content = b"".join(self.cassette.replay_chunks(record))
+            return httplib2.Response({"status": str(record["status"]), **record["headers"]}), content
+
+        start = time.perf_counter()
+        response, content = self.http.request(uri, method=method, body=body, headers=headers,
+                                              redirections=redirections, connection_type=connection_type)
+        if Cassette.recordable(uri):
+            elapsed = time.perf_counter() - start
+            headers = {k: v for k, v in response.items() if k != "status"}
+            self.cassette.record(*keys, response.status, headers, [(0.0, content)], elapsed)
+        return response, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def get_cassette():
+    """The process-wide cassette configured by CASSETTE_MODE, or None when disabled."""
+    global _active
+    if _active is None and CASSETTE_MODE != "off":
+        with _active_lock:
+            if _active is None:
+                _active = Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_REALTIME)
+    return _active
+
+
+@contextmanager
+def use_cassette(path: str, mode: str = "replay", realtime: bool = False):
+    """Activate a cassette for clients and sessions created inside the block."""
+    global _active
+    previous = _active
+    _active = Cassette(path, mode, realtime)
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+
+def httpx_client(**kwargs):
+    """An httpx client routed through the active cassette, or None to use the library default."""
+    cassette = get_cassette()
+    return httpx.Client(transport=CassetteTransport(cassette), **kwargs) if cassette else None
+
+
+def requests_session() -> requests.Session:
+    """A requests session, routed through whichever cassette is active when a request is sent."""
+    session = requests.Session()
+    adapter = CassetteAdapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def httplib2_http(http: httplib2.Http = None):
+    """An httplib2-compatible client for googleapiclient, routed through the active cassette."""
+    cassette = get_cassette()
+    return CassetteHttp(cassette, http) if cassette else (http or httplib2.Http())
@@ -0,0 +1,266 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from answers import normalize_answer
+from resilience import Deadline
+from settings import get_settings
+
+settings = get_settings()
+EQUIVALENCE_ORACLE = settings.equivalence_oracle
+EQUIVALENCE_CACHE_PATH = settings.equivalence_cache_path
+EQUIVALENCE_TIMEOUT = settings.equivalence_timeout
+
+_FUNCTIONS = ("arcsin", "arccos", "arctan", "sqrt", "sinh", "cosh", "tanh", "sin", "cos", "tan", "sec", "csc",
+              "cot", "exp", "ln", "log")
+_CONSTANTS = ("pi", "e")
+_TOKEN = re.compile(r"\d+(?:\.\d+)?|[a-z]+|[-+*/^()]")
+# An antiderivative's arbitrary constant as a term of its own, dropped before comparing
+_CONSTANT_OF_INTEGRATION = re.compile(r"(?:^|\+)(?:c|k|constant)(?=\+|-|$)")
+# Steps that ask for a particular form, where an equivalent answer isn't necessarily right
+_FORM = re.compile(r"factor|simplif|simplest|expand|lowest terms|radical form|standard form|vertex form|"
+                   r"slope-intercept|reduce|rationali[sz]|complet\w* the square")
+
+
+def to_expression(text: str):
+    """
+    A normalized answer (see answers.normalize_answer) spelled out with explicit
+    multiplication, e.g. "2x^2sin(x)" -> "2*x^2*sin(x)", and its variables. None for
+    anything that isn't a single expression: equations, lists, unknown words, unbalanced
+    parentheses or a function without its parenthesized argument.
+    """
+    tokens = _TOKEN.findall(text)
+    if not tokens or "".join(tokens) != text:
+        return None
+    # Split runs of letters into function names, constants and one-letter variables
+    split = []
+    for token in tokens:
+        if not token.isalpha():
+            split.append(token)
+            continue
+        letters = 0
+        while token:
+            name = next((name for name in _FUNCTIONS + _CONSTANTS if len(name) > 1 and token.startswith(name)),
+                        token[0])
+            letters += len(name) == 1
+            split.append(name)
+            token = token[len(name):]
+        if letters > 1:
+            # More likely a word ("one") than a product of variables; "2xy" is left to the LLM too
+            return None
+
+    out = []
+    variables = set()
+    depth = 0
+    previous = None
+    for i, token in enumerate(split):
+        operand_start = token == "(" or token[0].isalnum()
+        if operand_start and previous is not None and (previous == ")" or previous[0].isalnum()) \
+                and previous not in _FUNCTIONS:
+            out.append("*")
+        if token in _FUNCTIONS and (i + 1 == len(split) or split[i + 1] != "("):
+            return None
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+            if depth < 0:
+                return None
+        elif token.isalpha() and token not in _FUNCTIONS and token not in _CONSTANTS:
+            variables.add(token)
+        out.append(token)
+        previous = token
+    if depth != 0:
+        return None
+    return "".join(out), variables
+
+
+def is_antiderivative(expected: str) -> bool:
+    """
+    True when the expected answer carries a constant of integration, so answers may differ
+    by a constant. The question isn't consulted: steps of an integration problem ("what
+    should u be?") ask for exact expressions too.
+    """
+    return bool(_CONSTANT_OF_INTEGRATION.search(normalize_answer(expected)))
+
+
+class VerdictCache:
+    """
+    Oracle verdicts by kind and normalized answer pair, in a SQLite file shared by every
+    process on the host (or in memory when `path` is empty). A verdict of None is kept too,
+    so expressions Wolfram can't settle aren't asked about again.
+    """
+
+    def __init__(self, path: str = EQUIVALENCE_CACHE_PATH, max_entries: int = 4096):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        if path:
+            with self._connection() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS verdicts (
+                        kind TEXT,
+                        answer TEXT,
+                        expected TEXT,
+                        verdict INTEGER,
+                        result TEXT,
+                        created_at REAL,
+                        PRIMARY KEY (kind, answer, expected)
+                    )
+                """)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, like session_store.SQLiteSessionStore
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: tuple):
+        """(True, verdict) for a cached pair, (False, None) otherwise."""
+        if not self.path:
+            with self._lock:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    return True, self._memory[key]
+            return False, None
+        row = self._connection().execute(
+            "SELECT verdict FROM verdicts WHERE kind = ? AND answer = ? AND expected = ?", key
+        ).fetchone()
+        if row is None:
+            return False, None
+        return True, None if row[0] is None else bool(row[0])
+
+    def put(self, key: tuple, verdict, result: str = None):
+        if not self.path:
+            with self._lock:
+                self._memory[key] = verdict
+                while len(self._memory) > self.max_entries:
+                    self._memory.popitem(last=False)
+            return
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO verdicts (kind, answer, expected, verdict, result, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, None if verdict is None else int(verdict), result, time.time())
+            )
+
+
+class EquivalenceOracle:
+    """
+    Decides whether a symbolic answer is equivalent to the expected one by asking Wolfram
+    whether their difference simplifies to zero, or to a constant for an antiderivative.
+
+    Only single expressions are asked about (see to_expression); equations, lists and
+    prose are left to the LLM, and so is an equivalent answer to a step that asks for a
+    particular form (factored, simplest, ...). A different answer is wrong either way.
+    Verdicts are cached by normalized answer pair, so each spelling of an answer costs
+    one Wolfram query ever. check() returns None whenever
+    Wolfram can't settle it or can't be reached, and the caller falls back to the LLM.
+    """
+
+    def __init__(self, enabled: bool = EQUIVALENCE_ORACLE, cache: VerdictCache = None,
+                 timeout: float = EQUIVALENCE_TIMEOUT):
+        self.enabled = enabled
+        self.timeout = timeout
+        self._cache = cache
+        self._lock = threading.Lock()
+        self.counts = {"lookups": 0, "cache_hits": 0, "queries": 0, "equivalent": 0, "different": 0,
+                       "unknown": 0, "errors": 0}
+
+    @property
+    def cache(self) -> VerdictCache:
+        # The SQLite file is only opened once the oracle is first used
+        if self._cache is None:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = VerdictCache()
+        return self._cache
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def check(self, answer: str, expected: str, question: str = ""):
+        """True if equivalent, False if not, None if the oracle can't tell (or is off)."""
+        if not self.enabled:
+            return None
+        kind = "antiderivative" if is_antiderivative(expected) else "equivalent"
+        if kind == "antiderivative" and not _CONSTANT_OF_INTEGRATION.search(normalize_answer(answer)):
+            # A missing constant of integration is for the LLM to point out
+            return None
+        pair = [self._prepare(answer, kind), self._prepare(expected, kind)]
+        if None in pair:
+            return None
+        (answer_expression, answer_variables), (expected_expression, expected_variables) = pair
+        if not (answer_variables or expected_variables):
+            # Plain numbers are settled by answers.local_verdict
+            return None
+        if answer_expression == expected_expression:
+            return True
+
+        verdict = self._equivalent(kind, answer_expression, expected_expression)
+        if verdict and _FORM.search((question or "").lower()):
+            # Equivalent, but the step asks for a form ("factor", "simplest form"); the LLM judges that
+            return None
+        return verdict
+
+    def _equivalent(self, kind: str, answer: str, expected: str):
+        self._count("lookups")
+        # Equivalence is symmetric, so either order shares one cache entry
+        key = (kind, *sorted((answer, expected)))
+        found, verdict = self.cache.get(key)
+        if found:
+            self._count("cache_hits")
+            return verdict
+
+        from graph import simplify_with_wolfram
+        self._count("queries")
+        try:
+            result = simplify_with_wolfram(f"({answer})-({expected})", deadline=Deadline(self.timeout))
+        except Exception as e:
+            # Not cached: the next student may find Wolfram reachable again
+            self._count("errors")
+            logging.warning(f"Equivalence oracle failed for {answer!r} vs {expected!r}: {str(e)}")
+            return None
+        verdict = self.interpret(result, kind)
+        self._count({True: "equivalent", False: "different", None: "unknown"}[verdict])
+        logging.debug(f"Equivalence oracle: ({answer}) - ({expected}) = {result!r} -> {verdict}")
+        self.cache.put(key, verdict, result)
+        return verdict
+
+    @staticmethod
+    def _prepare(text: str, kind: str):
+        normalized = normalize_answer(text)
+        if kind == "antiderivative":
+            normalized = _CONSTANT_OF_INTEGRATION.sub("", normalized).lstrip("+")
+        return to_expression(normalized)
+
+    @staticmethod
+    def interpret(result: str, kind: str):
+        """Verdict from Wolfram's simplified difference: zero (or any constant for antiderivatives) means equivalent."""
+        if not result:
+            return None
+        parsed = to_expression(normalize_answer(result))
+        if parsed is None:
+            return None
+        expression, variables = parsed
+        if expression == "0":
+            return True
+        if not variables:
+            return kind == "antiderivative"
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+equivalence_oracle = EquivalenceOracle()
@@ -1,19 +1,85 @@
-import requests
-import os
-from dotenv import load_dotenv
+import json
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ratelimit import rate_governor
+from resilience import WOLFRAM, Deadline, TransientError
+from settings import get_settings
 from io import BytesIO
 
-# Load environment variables from .env file
-load_dotenv()
-APP_ID = os.getenv("WOLFRAM_APP_ID")  # Ensure this is set in your .env file
-BASE_URL = "http://api.wolframalpha.com/v2/query"
+settings = get_settings()
+APP_ID = settings.wolfram_app_id  # Ensure this is set in your .env file
+BASE_URL = settings.wolfram_base_url
+GRAPH_WORKERS = settings.graph_workers
+_http = None
+
+_PLOT_VERB = re.compile(r"^(?:plot|graph|draw|sketch)(?:of)?(?:the)?")
+# "y = ..." or "f(x) = ..." in the reasoning, with an expression a graphing calculator takes
+_FUNCTION = re.compile(r"(?<![a-z\\])(y|[fgh]\s*\(\s*x\s*\))\s*=\s*"
+                       r"((?:[\d.x+\-*/^() ]|sqrt|sin|cos|tan|exp|ln|log|pi|e(?![a-z]))+)")
+# A complete "graph_query" value in partially streamed function call arguments
+_STREAMED_QUERY = re.compile(r'"graph_query"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+def _session():
+    # Shared session: keeps connections alive and honours CASSETTE_MODE. Created (and requests
+    # imported) on the first graph rather than at import time.
+    global _http
+    if _http is None:
+        from cassette import requests_session
+        _http = requests_session()
+    return _http
+
+def _get(url: str, params: dict = None, deadline: Deadline = None):
+    """GET through the Wolfram circuit breaker, retrying timeouts, rate limits and server errors."""
+    def attempt(timeout: float = WOLFRAM.timeout):
+        rate_governor.acquire("wolfram")
+        response = _session().get(url, params=params, timeout=timeout)
+        rate_governor.observe("wolfram", None, response.status_code, response.headers)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientError(f"Wolfram returned {response.status_code}")
+        return response
+    return WOLFRAM.call(attempt, deadline=deadline)
+
+def simplify_with_wolfram(expression: str, deadline: Deadline = None):
+    """
+    Ask Wolfram Alpha to simplify an expression.
+
+    Args:
+        expression (str): The expression, e.g. "(x^2-1)-((x-1)*(x+1))".
+        deadline (Deadline): Optional budget for the request.
+
+    Returns:
+        str: The plaintext of the Result pod, or None if Wolfram gave no result.
+    """
+    params = {
+        "input": f"simplify {expression}",
+        "appid": APP_ID,
+        "output": "JSON",
+        "format": "plaintext",
+        "includepodid": "Result"
+    }
+    response = _get(BASE_URL, params=params, deadline=deadline)
+    if response.status_code != 200:
+        raise Exception(f"Error: {response.status_code}, {response.text}")
+    result = response.json().get("queryresult", {})
+    if not result.get("success"):
+        return None
+    for pod in result.get("pods", []):
+        if pod.get("id") == "Result" or pod.get("title", "").lower() == "result":
+            for subpod in pod.get("subpods", []):
+                if subpod.get("plaintext"):
+                    return subpod["plaintext"]
+    return None
 
-def generate_graph_from_query(query: str) -> BytesIO:
+def generate_graph_from_query(query: str, deadline: Deadline = None) -> BytesIO:
     """
     Generate a graph image from a natural language query using Wolfram Alpha API.
 
     Args:
         query (str): The natural language query to generate the graph.
+        deadline (Deadline): Optional budget; both requests are cut short to fit in it.
 
     Returns:
         BytesIO: The image data as a byte stream.
@@ -27,7 +93,7 @@ def generate_graph_from_query(query: str) -> BytesIO:
         }
         
         # Make the request to Wolfram Alpha
-        response = requests.get(BASE_URL, params=params)
+        response = _get(BASE_URL, params=params, deadline=deadline)
         
         if response.status_code == 200:
             # Parse JSON response
@@ -42,7 +108,7 @@ def generate_graph_from_query(query: str) -> BytesIO:
                         img_url = subpod.get("img", {}).get("src")
                         if img_url:
                             # Download the image and return as BytesIO
-                            img_response = requests.get(img_url)
+                            img_response = _get(img_url, deadline=deadline)
                             if img_response.status_code == 200:
                                 return BytesIO(img_response.content)
             raise Exception("No graph image found for the query.")
@@ -51,5 +117,126 @@ def generate_graph_from_query(query: str) -> BytesIO:
     except Exception as e:
         raise Exception(f"Failed to generate graph: {str(e)}")
 
-    
 
+def graph_key(query: str) -> str:
+    """
+    What a graph query plots, for matching queries worded differently: "plot y = 2x + 5",
+    "Graph y=2x+5" and "f(x) = 2x + 5" share "y=2x+5".
+    """
+    key = re.sub(r"[\s$]", "", query.lower())
+    key = _PLOT_VERB.sub("", key)
+    return re.sub(r"^(?:y|[fgh]\(x\))=", "y=", key)
+
+def candidate_graph_queries(text: str, limit: int) -> list:
+    """Up to `limit` plot queries for the functions of x defined in a worked solution, in order of appearance."""
+    queries = []
+    seen = set()
+    for match in _FUNCTION.finditer(text.lower()):
+        expression = " ".join(match.group(2).split()).strip(" .")
+        if "x" not in expression or expression.count("(") != expression.count(")"):
+            continue
+        query = f"plot y = {expression}"
+        if graph_key(query) not in seen:
+            seen.add(graph_key(query))
+            queries.append(query)
+        if len(queries) >= limit:
+            break
+    return queries
+
+def streamed_graph_queries(arguments: str, start: int = 0):
+    """
+    The graph queries completed in function call arguments streamed so far, from offset `start`
+    on, and the offset to continue from once more arguments have arrived.
+    """
+    queries = []
+    for match in _STREAMED_QUERY.finditer(arguments, start):
+        try:
+            queries.append(json.loads(match.group(1)))
+        except ValueError:
+            pass
+        start = match.end()
+    return queries, start
+
+
+class GraphPrefetch:
+    """
+    The graph fetches of one solution, started as soon as their queries are known and
+    collected when its steps are finalized. A fetch is shared by every query with the same
+    graph_key, so a plot guessed from the reasoning serves the step asking for it.
+    """
+
+    def __init__(self, pool: "GraphPool", deadline: Deadline, min_seconds: float):
+        self.pool = pool
+        self.deadline = deadline
+        self.min_seconds = min_seconds
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._speculative = set()
+        self._used = set()
+
+    def fetch(self, query: str, speculative: bool = False):
+        """
+        The fetch for `query`, started now unless one is already under way. None when less
+        than `min_seconds` of the budget is left to start it.
+        """
+        key = graph_key(query)
+        with self._lock:
+            future = self._futures.get(key)
+            if not speculative:
+                self._used.add(key)
+            if future is not None:
+                return future
+            if self.deadline.remaining() < self.min_seconds:
+                return None
+            future = self._futures[key] = self.pool.submit(query, self.deadline)
+            if speculative:
+                self._speculative.add(key)
+        self.pool.count("speculative" if speculative else "started")
+        return future
+
+    def close(self):
+        """Cancel guessed fetches no step asked for that haven't started yet; the rest finish on their own."""
+        with self._lock:
+            unused = [(key, self._futures[key]) for key in self._speculative - self._used]
+            hits = len(self._speculative & self._used)
+        for key, future in unused:
+            future.cancel()
+        for _ in range(hits):
+            self.pool.count("speculative_hits")
+        for _ in unused:
+            self.pool.count("speculative_unused")
+        if unused:
+            logging.debug(f"Unused graph guesses: {', '.join(key for key, _ in unused)}")
+
+
+class GraphPool:
+    """
+    Threads fetching graphs for every solve in the process, so a solution's graphs download
+    while its LLM calls are still running instead of one after another once they're done.
+    """
+
+    def __init__(self, workers: int = GRAPH_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self.counts = {"started": 0, "speculative": 0, "speculative_hits": 0, "speculative_unused": 0}
+
+    def submit(self, query: str, deadline: Deadline):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="graph")
+        return self._executor.submit(generate_graph_from_query, query, deadline)
+
+    def prefetch(self, deadline: Deadline, min_seconds: float = 0.0) -> GraphPrefetch:
+        return GraphPrefetch(self, deadline, min_seconds)
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+graph_pool = GraphPool()
@@ -0,0 +1,178 @@
+import hashlib
+import logging
+import math
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from settings import get_settings
+
+settings = get_settings()
+# Cosine similarity a new custom question needs with an earlier one to reuse its hint
+HINT_CACHE_THRESHOLD = settings.hint_cache_threshold
+HINT_CACHE_MAX_STEPS = settings.hint_cache_max_steps
+HINT_CACHE_MAX_PER_STEP = settings.hint_cache_max_per_step
+
+_TOKEN = re.compile(r"[a-z]+|\d+(?:\.\d+)?|[=+\-*/^()]")
+_STOP_WORDS = frozenset("""
+a an and are be can could do does for how i if in is it me my of on or should so that the this to
+what when which why with would you your
+""".split())
+
+
+def tokenize(text: str) -> list:
+    """Lowercased words, numbers and operators; filler words are dropped since every question has them."""
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOP_WORDS]
+
+
+def step_key(step, attempts=()) -> str:
+    """
+    Key for a step's content, shared by every student working the same solution, and the
+    wrong answers a hint was written for: the hint prompt explains the student's previous
+    attempts, so it only suits students who made the same ones. Pass the attempts
+    normalized (answers.normalize_answer); their order doesn't matter.
+    """
+    tried = "\x00".join(sorted(set(attempts)))
+    return hashlib.sha256(
+        f"{step.instruction}\x00{step.question}\x00{step.answer}\x01{tried}".encode("utf-8")
+    ).hexdigest()
+
+
+class StepHintIndex:
+    """
+    The custom questions asked about one step, with the hint each one got.
+
+    Questions are embedded as TF-IDF vectors (sublinear tf, smoothed idf, L2-normalized)
+    in a dense matrix that is rebuilt lazily after additions, so a lookup is one
+    matrix-vector product.
+    """
+
+    def __init__(self, max_entries: int = HINT_CACHE_MAX_PER_STEP):
+        self.max_entries = max_entries
+        self.questions = []
+        self.hints = []
+        self._documents = []
+        self._vocabulary = None
+        self._idf = None
+        self._matrix = None
+
+    def __len__(self):
+        return len(self.questions)
+
+    def add(self, question: str, hint: str):
+        if len(self.questions) >= self.max_entries:
+            del self.questions[0], self.hints[0], self._documents[0]
+        self.questions.append(question)
+        self.hints.append(hint)
+        self._documents.append(tokenize(question))
+        self._matrix = None
+
+    def _build(self):
+        vocabulary = {}
+        for tokens in self._documents:
+            for token in tokens:
+                vocabulary.setdefault(token, len(vocabulary))
+        counts = np.zeros((len(self._documents), len(vocabulary)))
+        for row, tokens in enumerate(self._documents):
+            for token in tokens:
+                counts[row, vocabulary[token]] += 1
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self._idf = np.log((1 + len(self._documents)) / (1 + document_frequency)) + 1
+        self._vocabulary = vocabulary
+        self._matrix = self._normalize(self._weigh(counts))
+
+    def _weigh(self, counts: np.ndarray) -> np.ndarray:
+        weights = np.zeros_like(counts)
+        np.log(counts, out=weights, where=counts > 0)
+        weights[counts > 0] += 1
+        return weights * self._idf
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    def search(self, question: str):
+        """The most similar earlier question as (similarity, hint), or None when the index is empty."""
+        if not self.questions:
+            return None
+        if self._matrix is None:
+            self._build()
+        counts = np.zeros(len(self._vocabulary))
+        unseen = 0
+        for token in tokenize(question):
+            column = self._vocabulary.get(token)
+            if column is None:
+                # Words the index has never seen still count toward the query's length
+                unseen += 1
+            else:
+                counts[column] += 1
+        query = self._weigh(counts)
+        norm = math.sqrt(float(query @ query) + unseen * (math.log(1 + len(self.questions)) + 1) ** 2)
+        if norm == 0:
+            return None
+        similarities = self._matrix @ (query / norm)
+        best = int(np.argmax(similarities))
+        return float(similarities[best]), self.hints[best]
+
+
+class HintCache:
+    """
+    Process-wide cache of custom hints, one StepHintIndex per step content and set of
+    previous attempts.
+
+    Students ask nearly the same things about the same step, so a new question close
+    enough to an earlier one is answered with that question's hint instead of a new
+    completion. Steps are evicted least recently used.
+    """
+
+    def __init__(self, threshold: float = HINT_CACHE_THRESHOLD, max_steps: int = HINT_CACHE_MAX_STEPS):
+        self.threshold = threshold
+        self.max_steps = max_steps
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, step, question: str, attempts=()):
+        """A cached hint for a question similar enough to `question` after the same `attempts`, or None."""
+        key = step_key(step, attempts)
+        with self._lock:
+            index = self._indexes.get(key)
+            match = index.search(question) if index is not None else None
+            if index is not None:
+                self._indexes.move_to_end(key)
+            if match is not None and match[0] >= self.threshold:
+                self.hits += 1
+                logging.debug(f"Hint cache hit ({match[0]:.2f}) for: {question}")
+                return match[1]
+            self.misses += 1
+        return None
+
+    def add(self, step, question: str, hint: str, attempts=()):
+        key = step_key(step, attempts)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._indexes[key] = StepHintIndex()
+                while len(self._indexes) > self.max_steps:
+                    self._indexes.popitem(last=False)
+            else:
+                self._indexes.move_to_end(key)
+            index.add(question, hint)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "steps": len(self._indexes),
+                "questions": sum(len(index) for index in self._indexes.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+hint_cache = HintCache()
@@ -1,20 +1,47 @@
-import openai
-from typing import List, Dict
-from pydantic import BaseModel
+from typing import List, Optional, Tuple
 import json
 import logging
+import time
 
-from dotenv import load_dotenv  # Import dotenv
-
-import os
-
-from graph import generate_graph_from_query  # Import the graph generation function
-
-# Load environment variables from .env file
-load_dotenv()
-API_KEY = os.getenv("OPENAI_API_KEY")  # Get the API key from the environment]
-DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+from graph import (  # Import the graph generation function
+    candidate_graph_queries, generate_graph_from_query, graph_pool, streamed_graph_queries
+)
+from answers import answer_cache, local_verdict, normalize_answer, validation_tiers
+from equivalence import equivalence_oracle
+from hints import hint_cache
+from ratelimit import rate_governor
+from resilience import OPENAI, OPENROUTER, Deadline, DeadlineExceeded
+from templates import template_index
+from solution import MathSolution, Step  # Solution content is immutable and shared, progress is per student
+from prompts import (
+    CUSTOM_HINT, PROBLEM_SUMMARY, SOLVE_PROBLEM, STRUCTURE_SOLUTION, VALIDATE_ANSWER, VALIDATE_EXAM, prompt_usage
+)
+from settings import get_settings
+
+settings = get_settings()
+API_KEY = settings.openai_api_key  # Get the API key from the environment
+DEEPSEEK_API_KEY = settings.deepseek_api_key
+OPENROUTER_API_KEY = settings.openrouter_api_key
+OPENROUTER_BASE_URL = settings.openrouter_base_url
+# End-to-end budget for turning a problem into a structured solution
+SOLVE_BUDGET_SECONDS = settings.solve_budget_seconds
+# Kept back from the reasoning call so the structuring call always gets to run
+STRUCTURE_RESERVE_SECONDS = settings.structure_reserve_seconds
+# A graph is only fetched with at least this much budget left
+GRAPH_MIN_SECONDS = settings.graph_min_seconds
+# Fetch graphs while the solution is still being structured, see MathSolver.get_math_solution
+GRAPH_PIPELINE = settings.graph_pipeline
+GRAPH_SPECULATIVE_LIMIT = settings.graph_speculative_limit
+# Model that checks step answers, pick one with benchmarks/validator_eval.py
+VALIDATE_MODEL = settings.validate_model or VALIDATE_ANSWER.model
+# Cheaper model asked first; VALIDATE_MODEL only sees answers it's unsure about (empty disables)
+VALIDATE_FAST_MODEL = settings.validate_fast_model
+VALIDATE_CONFIDENCE_THRESHOLD = settings.validate_confidence_threshold
+# Shown for answers accepted without asking the LLM, see MathSolver.match_accepted_answer
+ACCEPTED_ANSWER_EXPLANATION = "That's exactly right, nice work."
+# Shown for verdicts from the equivalence oracle, see MathSolver.validate_step
+EQUIVALENT_EXPLANATION = "That's equivalent to the expected answer, nice work."
+NOT_EQUIVALENT_EXPLANATION = "That isn't equivalent to what this step is looking for. Check your work and try again."
 # Set this up at the start of your program
 logging.basicConfig(
     filename='app.log',
@@ -22,172 +49,113 @@ logging.basicConfig(
     format='%(asctime)s - %(message)s'
 )
 
-class Step(BaseModel):
-    instruction: str
-    question: str
-    answer: str
-    explanation: str
-    hint_count: int = 0
-    graph_query: str = None  # Add this to store the graph query
-    graph_image: bytes = None  # Add this to store the graph image data
-    attempt_count: int = 0
-    user_attempts: List[Dict] = []
-    user_correct: bool = False
-
-
-class MathSolution(BaseModel):
-    steps: List[Step]
-    final_answer: str
-    original_problem: str
-
 class MathSolver:
     def __init__(self, api_key: str):
         """Initialize the OpenAI client"""
-        self.client = openai.OpenAI(api_key=api_key)
-        self.deepseek_client = openai.OpenAI(api_key=OPENROUTER_API_KEY, base_url="https://openrouter.ai/api/v1")
-
-    def format_prompt(self, problem: str) -> str:
-        return f"""You are an expert math teacher that helps college students understand how to solve problems that appear on their homework and exams. 
-You specialize in explaining math problems, but also have extreme expertise in other STEM fields like Computer Science, Statistics, Economics, Biology, Physics, and Chemistry. 
-You will generate explanations for math prompts tailored to the perceived skill level of the user; for instance, when solving a calculus Power Rule problem, explain it as if the student is enrolled in AP Calculus AB, using appropriate terminology and detail for that level. 
-Your main objective is to help students understand the concepts fully so that they can score better on their exams.
-
-To do this, break the problem down into steps. 
-Each step should explain a critical technique or concept that is necessary for reaching the final answer, be written concisely, and aim to enhance understanding. 
-The user workflow should be fast and effective, so do not include unnecessary steps that don't use an important concept. 
-A response will typically have between 3-6 steps. 
-Make sure each step logically flows from the last, and that there is a clear way to arrive at the answer. 
-Remember, your goal is to help guide students so that they can learn the concepts and score better on their exams.
-
-For each step, include:
-1. Clear instructions detailing the specific action or calculation required.
-2. A guiding question prompting the student to think about the relevant formula, concept, or calculation needed to complete this step.
-3. A concise review of the previous step, including the correct answer. This validates the student's solution, reinforces the critical concept or formula used, and ensures they understand how to apply it moving forward.
-
-IMPORTANT FORMATTING RULES:
-- ALL mathematical expressions MUST be enclosed in LaTeX delimiters ($...$)
-- For complex mathematical structures (matrices, aligned equations, etc.):
-    - Use \\begin{{...}} and \\end{{...}} environments inside LaTeX delimiters
-    - Example for matrices: $\\begin{{bmatrix}} a & b \\\\ c & d \\end{{bmatrix}}$
-    - Example for aligned equations: $\\begin{{align}} x &= 2 \\\\ y &= 3 \\end{{align}}$
-- For inline expressions:
-    - Single variables: $x$, $n$
-    - Powers: $x^2$, $n^3$
-    - Fractions: $\\frac{{dx}}{{dy}}$
-    - Integrals: $\\int x^2 dx$
-- NEVER mix plain text and mathematical symbols
-- NEVER leave LaTeX commands undelimited
-- For the final answer:
-    - Present it as a standalone LaTeX expression
-    - Remove any trailing punctuation
-    - If text is needed, keep it outside the LaTeX delimiters
-    - Example: The solution is $x = 5$ units
-
-GRAPH QUERY RULES:
-- For most steps, show a graph to help the user understand a concept. Show graphs for steps with equations that can be represented as a graph
-- Generate a simple query for each graph, focusing on a single mathematical concept or function.
-- Do not include constants of integration or multiple expressions in a single query.
-- Ensure the query is suitable for a basic graphing calculator, using only the core equation or function.
-
-Example response format:
-"To find the derivative of $x^2$, we use the power rule. What is $\\frac{{d}}{{dx}}(x^2)$?"
-
-Final answer format example:
-"Great job! The final answer is: \\frac{{x^3}}{{3}} + C"
-
-The problem to solve is: {problem}
-"""
-
-    def solve_problem(self, problem: str) -> str:
+        # openai (and httpx under it) is the slowest import in the app, so it loads with the first solver
+        import openai
+        from cassette import get_cassette, httpx_client
+
+        openrouter_api_key = OPENROUTER_API_KEY
+        recording = get_cassette()
+        if recording and recording.replaying:
+            # Replayed responses need no credentials, but the client refuses to start without a key
+            api_key = api_key or "cassette-replay"
+            openrouter_api_key = openrouter_api_key or "cassette-replay"
+        # Retries are left to the resilience layer so they share its backoff and circuit breaker, and
+        # every request first waits for its share of the provider's rate limit
+        def http_client(provider):
+            hooks = rate_governor.httpx_hooks(provider)
+            return httpx_client(event_hooks=hooks) or openai.DefaultHttpxClient(event_hooks=hooks)
+        self.client = openai.OpenAI(api_key=api_key, http_client=http_client("openai"),
+                                    timeout=OPENAI.timeout, max_retries=0)
+        self.deepseek_client = openai.OpenAI(api_key=openrouter_api_key, base_url=OPENROUTER_BASE_URL,
+                                             http_client=http_client("openrouter"), timeout=OPENROUTER.timeout,
+                                             max_retries=0)
+
+    def _reason(self, problem: str, deadline: Deadline = None, reserve: float = 0.0) -> str:
+        response = OPENROUTER.call(
+            self.deepseek_client.chat.completions.create,
+            model=SOLVE_PROBLEM.model,
+            messages=SOLVE_PROBLEM.messages(problem=problem),
+            stream=False,
+            deadline=deadline,
+            reserve=reserve
+        )
+        prompt_usage.record(SOLVE_PROBLEM.name, response.usage)
+        logging.debug(f"Reasoning: {response.choices[0].message.content}")
+        return response.choices[0].message.content
+
+    def solve_problem(self, problem: str, deadline: Deadline = None) -> str:
         """
         Solve the problem and return the full solution as a string.
         """
-        prompt = f"""
-        Solve the following math problem and provide a detailed solution of each step in the solution:
-        
-        Problem: {problem}
-        
-        """
-        
         try:
-            response = self.deepseek_client.chat.completions.create(
-                model="deepseek/deepseek-r1",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant"},
-                    {
-                        "role": "user",
-                        "content": prompt.strip(),
-                    },
-                ],
-                stream=False
-            )
-            print(response.choices[0].message.content)
-            return response.choices[0].message.content
+            return self._reason(problem, deadline)
 
         except Exception as e:
             return f"Error solving problem: {str(e)}"
 
-    def get_math_solution(self, problem: str) -> MathSolution:
+    def get_math_solution(self, problem: str, deadline: Deadline = None) -> MathSolution:
         """
         Send problem to the assistant and get structured solution steps back
-        """
-        try:
-            problem_solution = self.solve_problem(problem)
-            print("done0")
-            print(problem_solution)
-            print("done1")
-
-            print("Preparing function schema")
-
-            functions = [
-                {
-                    "name": "get_math_solution",
-                    "description": "Provide the solution steps for the math problem solution.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "steps": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "instruction": {"type": "string"},
-                                        "question": {"type": "string"},
-                                        "answer": {"type": "string"},
-                                        "explanation": {"type": "string"},
-                                        "graph_query": {"type": "string"}
-                                    },
-                                    "required": ["instruction", "question", "answer", "explanation"],
-                                    "additionalProperties": False
-                                }
-                            },
-                            "final_answer": {"type": "string"},
-                            "original_problem": {"type": "string"}
-                        },
-                        "required": ["steps", "final_answer", "original_problem"],
-                        "additionalProperties": False
-                    }
-                }
-            ]
-
-            print("Calling API for solution steps")
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a math teacher who takes a math problem and solution to that problem, and breaks down solution into clear steps."},
-                    {"role": "user", "content": self.format_prompt(problem_solution)}
-                ],
-                functions=functions,
-                function_call={"name": "get_math_solution"},
-                temperature=0.4,
-            )
 
-            print("API call completed")
-            message = response.choices[0].message
-            print("done")
+        Args:
+            problem (str): The problem as the student typed it
+            deadline (Deadline): Budget for the whole pipeline, SOLVE_BUDGET_SECONDS by default.
+                Reasoning must leave STRUCTURE_RESERVE_SECONDS for structuring, or the problem
+                is structured directly; graphs are skipped once the budget runs low. Skipped
+                work is listed in the solution's `dropped`.
+
+        A problem that differs only in its constants from ones solved before is answered from
+        templates.template_index, which only fetches its graphs.
+
+        With GRAPH_PIPELINE, graphs are fetched alongside the LLM calls rather than after them:
+        plots of functions the reasoning defines start before structuring does, and each
+        step's graph_query starts as soon as it has streamed in.
+        """
+        deadline = deadline or Deadline(SOLVE_BUDGET_SECONDS)
+        dropped = []
+        # The same problem with other constants as one solved before needs no LLM call
+        templated = template_index.lookup(problem)
+        prefetch = graph_pool.prefetch(deadline, GRAPH_MIN_SECONDS) if GRAPH_PIPELINE else None
 
-            if message.function_call is not None:
-                arguments = message.function_call.arguments
+        try:
+            if templated is not None:
+                logging.info(f"Solved {problem!r} from a solution template")
+                self._attach_graphs(templated, deadline, dropped, prefetch)
+                return MathSolution.from_dict(templated, dropped)
+
+            try:
+                problem_solution = self._reason(problem, deadline, reserve=STRUCTURE_RESERVE_SECONDS)
+            except Exception as e:
+                # The structuring model can still break the problem down, just with less to go on
+                logging.error(f"Reasoning skipped, structuring the problem directly: {str(e)}")
+                problem_solution = problem
+                dropped.append("reasoning")
+            logging.debug("Calling API for solution steps")
+            if prefetch is not None:
+                # Plots of the functions the reasoning works with, likely asked for by the steps too
+                for query in candidate_graph_queries(problem_solution, GRAPH_SPECULATIVE_LIMIT):
+                    prefetch.fetch(query, speculative=True)
+                arguments = self._structure_streamed(problem_solution, deadline, prefetch)
+            else:
+                response = OPENAI.call(
+                    self.client.chat.completions.create,
+                    model=STRUCTURE_SOLUTION.model,
+                    messages=STRUCTURE_SOLUTION.messages(problem=problem_solution),
+                    functions=STRUCTURE_SOLUTION.functions,
+                    function_call=STRUCTURE_SOLUTION.function_call,
+                    temperature=0.4,
+                    deadline=deadline
+                )
+                prompt_usage.record(STRUCTURE_SOLUTION.name, response.usage)
+                message = response.choices[0].message
+                arguments = message.function_call.arguments if message.function_call is not None else None
+
+            logging.debug("API call completed")
+
+            if arguments is not None:
                 solution = json.loads(arguments)
                 
                 final_answer = solution["final_answer"].strip('$')
@@ -195,30 +163,93 @@ The problem to solve is: {problem}
                     final_answer = final_answer.replace('^', '^{') + '}'
                 solution["final_answer"] = final_answer
 
-                for step in solution["steps"]:
-                    graph_query = step.get("graph_query")
-                    print(f"Graph Query for Step: {graph_query}")
-
-                    if graph_query:
-                        try:
-                            # Generate the graph image
-                            graph_image = generate_graph_from_query(graph_query)
-                            step["graph_image"] = graph_image.getvalue()  # Store the image data
-                            print(f"Graph Image Generated for Step: {step['graph_image'] is not None}")  # Debug: Check if image is generated
-                        except Exception as e:
-                            logging.error(f"Error generating graph for step: {str(e)}")
-                            step["graph_image"] = None  # Set graph_image to None if generation fails
-                            print(f"Error generating graph for step: {str(e)}")  # Debug: Print error message
-
-                math_solution = MathSolution(**solution)
+                self._attach_graphs(solution, deadline, dropped, prefetch)
+
+                math_solution = MathSolution.from_dict(solution, dropped)
+                if dropped:
+                    logging.warning(f"Solved in {deadline.elapsed():.1f}s without: {', '.join(dropped)}")
                 if len(math_solution.steps) > 10:
                     raise ValueError("Too many solution steps")
+                template_index.learn(problem, solution)
                 return math_solution
             else:
                 raise Exception("No function call in response")
 
         except Exception as e:
             raise Exception(f"Error getting math solution: {str(e)}")
+        finally:
+            if prefetch is not None:
+                prefetch.close()
+
+    def _structure_streamed(self, problem_solution: str, deadline: Deadline, prefetch) -> Optional[str]:
+        """
+        The structuring call, streamed so each step's graph_query is handed to `prefetch` as
+        soon as it's complete. Returns the function call arguments, None if there was no call.
+        """
+        stream = OPENAI.call(
+            self.client.chat.completions.create,
+            model=STRUCTURE_SOLUTION.model,
+            messages=STRUCTURE_SOLUTION.messages(problem=problem_solution),
+            functions=STRUCTURE_SOLUTION.functions,
+            function_call=STRUCTURE_SOLUTION.function_call,
+            temperature=0.4,
+            stream=True,
+            stream_options={"include_usage": True},
+            deadline=deadline
+        )
+        called = False
+        arguments = ""
+        scanned = 0
+        usage = None
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices or chunk.choices[0].delta.function_call is None:
+                    continue
+                called = True
+                arguments += chunk.choices[0].delta.function_call.arguments or ""
+                queries, scanned = streamed_graph_queries(arguments, scanned)
+                for query in queries:
+                    prefetch.fetch(query)
+                if deadline.expired:
+                    # The timeout only bounds each read, not the whole stream
+                    raise DeadlineExceeded(f"Structuring ran out of budget after {deadline.elapsed():.1f}s")
+        finally:
+            stream.close()
+        prompt_usage.record(STRUCTURE_SOLUTION.name, usage)
+        return arguments if called else None
+
+    def _attach_graphs(self, solution: dict, deadline: Deadline, dropped: list, prefetch=None):
+        """
+        Fetch each step's graph into its `graph_image` while the budget allows, noting skipped
+        ones in `dropped`. With a graph.GraphPrefetch the fetches run concurrently, reusing any
+        it already started.
+        """
+        futures = {}
+        if prefetch is not None:
+            # Start every fetch before waiting on the first
+            for step_number, step in enumerate(solution["steps"], 1):
+                if step.get("graph_query"):
+                    futures[step_number] = prefetch.fetch(step["graph_query"])
+
+        for step_number, step in enumerate(solution["steps"], 1):
+            graph_query = step.get("graph_query")
+            logging.debug(f"Graph query for step {step_number}: {graph_query}")
+            future = futures.get(step_number)
+
+            if graph_query and future is None and deadline.remaining() < GRAPH_MIN_SECONDS:
+                # Graphs are optional, the student gets their steps on time instead
+                dropped.append(f"graph:{step_number}")
+            elif graph_query:
+                try:
+                    # Generate the graph image
+                    graph_image = future.result() if future is not None else generate_graph_from_query(graph_query, deadline)
+                    step["graph_image"] = graph_image.getvalue()  # Store the image data
+                except Exception as e:
+                    logging.error(f"Error generating graph for step: {str(e)}")
+                    step["graph_image"] = None  # Set graph_image to None if generation fails
+                    dropped.append(f"graph:{step_number}")
 
     def validate_step_answer(self, user_answer: str, correct_answer: str) -> bool:
         """
@@ -255,136 +286,218 @@ The problem to solve is: {problem}
         except Exception as e:
             logging.error(f"Error dumping variable to file: {str(e)}")
     
-    def validate_step_answer_llm(self, user_answer: str, correct_answer: str, step_question: str) -> bool:
+    def validate_step_answer_llm(self, user_answer: str, correct_answer: str, step_question: str,
+                                 model: str = None) -> Tuple[bool, str]:
         """
         Use the LLM to compare the user's answer and the expected answer.
+
+        Validation is cascaded: VALIDATE_FAST_MODEL answers first, and its verdict stands when
+        its confidence reaches VALIDATE_CONFIDENCE_THRESHOLD and doesn't contradict what
+        normalization alone can tell (answers.local_verdict). Otherwise VALIDATE_MODEL decides.
+        `model` skips the cascade and asks only that model, e.g. to compare models offline.
         """
         try:
-            functions = [
-                {
-                    "name": "validate_answer",
-                    "description": "Validate if the student's answer matches the expected answer.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "is_correct": {
-                                "type": "boolean",
-                                "description": "Whether the student's answer is correct or equivalent to the expected answer"
-                            },
-                            "explanation": {
-                                "type": "string",
-                                "description": "Explain to the student why the answer is correct or incorrect. Do not include any math terms in the answer just plain english Make sure its brief. Also do not reveal the correct answer, only explain why the answer is correct or incorrect. Make sure to address the student directly like youre speaking to them"
-                            }
-                        },
-                        "required": ["is_correct", "explanation"],
-                        "additionalProperties": False
-                    }
-                }
-            ]
-
-            # Add logging to see the actual API response
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are a helpful assistant that checks if the student's answer is correct. The answer doesnt have to match the expected answer exactly, but it should be relatively equivalent."
-                    },
-                    {
-                        "role": "user", 
-                        "content": f"Determine if these answers are equivalent based on this question: {step_question}:\nStudent's Answer: {user_answer}\nExpected Answer: {correct_answer}"
-                    }
-                ],
-                functions=functions,
-                function_call={"name": "validate_answer"},
-                temperature=0.0
-            )
-            
-            # Log the full response for debugging
-            logging.debug(f"API Response: {response}")
-            
-            if response.choices[0].message.function_call is not None:
-                result = json.loads(response.choices[0].message.function_call.arguments)
-                logging.debug(f"Parsed result: {result}")  # Log the parsed result
-                
-                # Ensure both values are returned
-                if "is_correct" not in result or "explanation" not in result:
-                    raise ValueError("Missing required fields in response")
-                    
+            if model is not None or not VALIDATE_FAST_MODEL or VALIDATE_FAST_MODEL == VALIDATE_MODEL:
+                result = self._check_answer(model or VALIDATE_MODEL, user_answer, correct_answer, step_question)
                 return result["is_correct"], result["explanation"]
+
+            start = time.perf_counter()
+            try:
+                fast = self._check_answer(VALIDATE_FAST_MODEL, user_answer, correct_answer, step_question)
+            except Exception as e:
+                logging.warning(f"Fast validation failed, escalating: {str(e)}")
+                fast = None
+            validation_tiers.record("fast", time.perf_counter() - start)
+
+            if fast is None:
+                reason = "fast_error"
+            elif local_verdict(user_answer, correct_answer) not in (None, fast["is_correct"]):
+                reason = "disagrees_with_local"
+            elif fast["confidence"] < VALIDATE_CONFIDENCE_THRESHOLD:
+                reason = "low_confidence"
             else:
-                raise Exception("No function call in response")
+                return fast["is_correct"], fast["explanation"]
+
+            validation_tiers.escalate(reason)
+            start = time.perf_counter()
+            result = self._check_answer(VALIDATE_MODEL, user_answer, correct_answer, step_question)
+            validation_tiers.record("full", time.perf_counter() - start)
+            return result["is_correct"], result["explanation"]
 
         except Exception as e:
             logging.error(f"Error validating answer with LLM: {str(e)}")
             raise Exception(f"Error validating answer with LLM: {str(e)}")
 
+    def _check_answer(self, model: str, user_answer: str, correct_answer: str, step_question: str) -> dict:
+        """One validate_answer call: is_correct, explanation and confidence (1.0 if the model left it out)."""
+        # Add logging to see the actual API response
+        response = OPENAI.call(
+            self.client.chat.completions.create,
+            model=model,
+            messages=VALIDATE_ANSWER.messages(
+                question=step_question, user_answer=user_answer, expected_answer=correct_answer
+            ),
+            functions=VALIDATE_ANSWER.functions,
+            function_call=VALIDATE_ANSWER.function_call,
+            temperature=0.0
+        )
+        prompt_usage.record(VALIDATE_ANSWER.name, response.usage, model)
+
+        # Log the full response for debugging
+        logging.debug(f"API Response: {response}")
+
+        if response.choices[0].message.function_call is None:
+            raise Exception("No function call in response")
+        result = json.loads(response.choices[0].message.function_call.arguments)
+        logging.debug(f"Parsed result: {result}")  # Log the parsed result
+
+        # Ensure both values are returned
+        if "is_correct" not in result or "explanation" not in result:
+            raise ValueError("Missing required fields in response")
+        return {
+            "is_correct": bool(result["is_correct"]),
+            "explanation": result["explanation"],
+            "confidence": float(result.get("confidence", 1.0)),
+        }
+
+    def match_accepted_answer(self, step: Step, user_answer: str) -> Optional[Tuple[bool, str]]:
+        """
+        Check the answer against the step's accepted answers without calling the API.
+
+        Args:
+            step (Step): The step being answered
+            user_answer (str): The answer provided by the user
+
+        Returns:
+            Optional[Tuple[bool, str]]: (True, explanation) if the answer normalizes to an accepted
+            or previously learned form, None if the LLM has to decide
+        """
+        if answer_cache.accepts(step, user_answer):
+            return True, ACCEPTED_ANSWER_EXPLANATION
+        return None
+
+    def validate_step(self, step: Step, user_answer: str) -> Tuple[bool, str]:
+        """
+        Validation for an answer match_accepted_answer missed. Symbolic answers go to the
+        equivalence oracle first when EQUIVALENCE_ORACLE is on, anything it can't settle to
+        the LLM. Accepted answers are learned, so the next student who writes them the same
+        way skips both.
+        """
+        start = time.perf_counter()
+        verdict = equivalence_oracle.check(user_answer, step.answer, step.question)
+        if verdict is not None:
+            validation_tiers.record("oracle", time.perf_counter() - start)
+            if verdict:
+                answer_cache.learn(step, user_answer)
+            return verdict, EQUIVALENT_EXPLANATION if verdict else NOT_EQUIVALENT_EXPLANATION
+
+        is_correct, explanation = self.validate_step_answer_llm(user_answer, step.answer, step.question)
+        if is_correct:
+            answer_cache.learn(step, user_answer)
+        return is_correct, explanation
+
+    def validate_exam_answers(self, solution: MathSolution, user_answers: List[str]) -> List[Tuple[bool, str]]:
+        """
+        Check the student's answers to every step of a solution in one structured call.
+        Answers matching a step's accepted answers, or settled by the equivalence oracle, are
+        graded without the LLM and left out of the call.
+
+        Args:
+            solution (MathSolution): The solution whose steps were answered
+            user_answers (List[str]): One answer per step, in step order
+
+        Returns:
+            List[Tuple[bool, str]]: (is_correct, explanation) for each step, in step order
+        """
+        if len(user_answers) != len(solution.steps):
+            raise ValueError("Expected one answer per solution step")
+        verdicts = [self.match_accepted_answer(step, user_answer) if user_answer else None
+                    for step, user_answer in zip(solution.steps, user_answers)]
+        for i, (step, user_answer) in enumerate(zip(solution.steps, user_answers)):
+            if verdicts[i] is None and user_answer:
+                # Symbolic answers the oracle settles are left out of the call too
+                verdict = equivalence_oracle.check(user_answer, step.answer, step.question)
+                if verdict is not None:
+                    verdicts[i] = (verdict, EQUIVALENT_EXPLANATION if verdict else NOT_EQUIVALENT_EXPLANATION)
+                    if verdict:
+                        answer_cache.learn(step, user_answer)
+        unmatched = [i for i, verdict in enumerate(verdicts) if verdict is None]
+        if not unmatched:
+            return verdicts
+        try:
+            answers = "\n\n".join(
+                f"Step {i + 1}\nQuestion: {solution.steps[i].question}\n"
+                f"Student's Answer: {user_answers[i] or '(no answer)'}\nExpected Answer: {solution.steps[i].answer}"
+                for i in unmatched
+            )
+            response = OPENAI.call(
+                self.client.chat.completions.create,
+                model=VALIDATE_EXAM.model,
+                messages=VALIDATE_EXAM.messages(problem=solution.original_problem, answers=answers),
+                functions=VALIDATE_EXAM.functions,
+                function_call=VALIDATE_EXAM.function_call,
+                temperature=0.0
+            )
+            prompt_usage.record(VALIDATE_EXAM.name, response.usage)
+            logging.debug(f"API Response: {response}")
+
+            if response.choices[0].message.function_call is None:
+                raise Exception("No function call in response")
+            results = json.loads(response.choices[0].message.function_call.arguments)["results"]
+            by_step = {int(result["step"]): result for result in results}
+            missing = [i + 1 for i in unmatched if i + 1 not in by_step]
+            if missing:
+                raise ValueError(f"Missing verdicts for steps {missing}")
+            for i in unmatched:
+                is_correct = bool(by_step[i + 1]["is_correct"])
+                verdicts[i] = (is_correct, by_step[i + 1]["explanation"])
+                if is_correct and user_answers[i]:
+                    answer_cache.learn(solution.steps[i], user_answers[i])
+            return verdicts
+
+        except Exception as e:
+            logging.error(f"Error validating exam answers with LLM: {str(e)}")
+            raise Exception(f"Error validating exam answers with LLM: {str(e)}")
+
     def generate_custom_hint(self, step: Step, user_question: str, previous_attempts: List[str] = None) -> str:
         """
         Generate a custom hint based on the user's question about a specific step.
+
+        Questions close to one already asked about the same step, after the same previous
+        attempts, reuse that hint from hint_cache without calling the API.
         """
         try:
             if step.hint_count >= 3:
                 return "You've reached the maximum number of hints for this step. Try reviewing the previous hints and attempts."
 
-            functions = [
-                {
-                    "name": "generate_hint",
-                    "description": "Generate a helpful hint that addresses the student's question.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "hint": {
-                                "type": "string",
-                                "description": "A helpful hint that guides without revealing the answer"
-                            }
-                        },
-                        "required": ["hint"]
-                    }
-                }
-            ]
+            # A hint explains the student's own wrong answers, so it's only shared after the same ones
+            attempts = [normalize_answer(attempt) for attempt in previous_attempts or () if attempt.strip()]
+            cached_hint = hint_cache.lookup(step, user_question, attempts)
+            if cached_hint is not None:
+                step.hint_count += 1
+                return cached_hint
 
             previous_attempts_text = "\n".join([f"- {attempt}" for attempt in (previous_attempts or [])])
-            
-            prompt = f"""
-            Current step instruction: {step.instruction}
-            Current step question: {step.question}
-            
-            Student's question: {user_question}
-            
-            Previous attempts:
-            {previous_attempts_text if previous_attempts else "No previous attempts"}
-            
-            Provide a helpful hint that:
-            1. Addresses the specific step.
-            2. States the specific idea or formula needed to solve this step, and includes any relevant numbers from the problem.
-            3. If they had previous attempts, explain why they were incorrect
-            4. Gives a high-level overview of how to solve the step.
-            5. Asks the user a guiding question to help them solve the step.
-            6. Does NOT give them the final answer. Never give the answer in the hint, only guide the student in the right direction.
-            7. Use proper LaTeX formatting for ALL mathematical expressions ($...$)
-            """
-
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are a math tutor who NEVER reveals answers directly. Your role is to guide students to understanding through hints and explanations. Under NO circumstances should you provide the actual answer or a direct solution. If a student asks for the answer directly, redirect them to think about the process."
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                functions=functions,
-                function_call={"name": "generate_hint"},
+
+            response = OPENAI.call(
+                self.client.chat.completions.create,
+                model=CUSTOM_HINT.model,
+                messages=CUSTOM_HINT.messages(
+                    instruction=step.instruction,
+                    question=step.question,
+                    user_question=user_question,
+                    previous_attempts=previous_attempts_text if previous_attempts else "No previous attempts"
+                ),
+                functions=CUSTOM_HINT.functions,
+                function_call=CUSTOM_HINT.function_call,
                 temperature=0.7
             )
+            prompt_usage.record(CUSTOM_HINT.name, response.usage)
 
             if response.choices[0].message.function_call is not None:
                 result = json.loads(response.choices[0].message.function_call.arguments)
                 step.hint_count += 1
+                hint_cache.add(step, user_question, result["hint"], attempts)
                 return result["hint"]
             else:
                 raise Exception("No hint generated")
@@ -414,43 +527,13 @@ Your Attempts:
 Performance: {performance}
 """
 
-            prompt = f"""
-The student has completed solving the following problem:
-Problem: {solution.original_problem}
-Here is their performance on each step:
-{steps_info}
-
-Provide a summary that:
-
-1. Starts with a brief pleasantry that is a maximum of 4 words. (e.g. "Great job!")
-2. States the important concepts, formulas, or topics that were used to arrive at the solution.
-3. Points out the specific step(s) where the student made a mistake, and briefly explain what the mistake was. (e.g. "On Step 3, you made a small mistake while applying the power rule. The exponent should be reduced by 1.")
-4. Gives the student 1-2 recommendations for topics to study further based on the mistakes made in the previous problem. These recommendations should be on topics that are likely to appear on their exams.
-5. Ends with another brief pleasantry that motivates the student to keep studying and improving.
-
-Make sure the problem summary:
--Gives the student relevant recommendations about what to study next based on their mistakes in the previous problem, with the objective that these topics will help them score better on their exams. If no mistakes were made, recommend that they keep studying the same or similar topic.
--Is written concisely. It should follow the given structure while also not being too verbose.
--Is written in an encouraging and patient tone. Be empathetic, but do NOT be overly pleasant or motivational. Don't include pleasantries anywhere in the middle of the response.
--Does not reveal any additional answers or solutions.
--NEVER shows unrendered LaTeX.
--Use proper LaTeX formatting for ALL mathematical expressions ($...$)
-"""
-
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an encouraging math tutor providing a summary of the student's performance."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+            response = OPENAI.call(
+                self.client.chat.completions.create,
+                model=PROBLEM_SUMMARY.model,
+                messages=PROBLEM_SUMMARY.messages(problem=solution.original_problem, steps_info=steps_info),
                 temperature=0.7
             )
+            prompt_usage.record(PROBLEM_SUMMARY.name, response.usage)
 
             summary = response.choices[0].message.content
             return summary
@@ -1,11 +1,20 @@
 from ui.sidebar import create_calculator_sidebar
-from ui.chat import display_chat_history, handle_user_input
+from ui.chat import display_chat_history, display_exam_form, display_solve_queue, flush_sheet_log, handle_user_input
 from ui.feedback import display_feedback_form
+from ui.admin import display_admin_panel, is_admin, sample_session_memory
 from llm import MathSolver
 from utils import load_environment_variables
+from session_store import restore_session
+from tutor import new_problem_state
+from profiler import render_profiler
 import streamlit as st
+from streamlit.runtime.scriptrunner import RerunException
 
 def main():
+    # Opt-in per-section timing, see profiler.RenderProfiler
+    render_profiler.start_run(st.session_state)
+    rerun = False
+
     # Load environment variables
     API_KEY = load_environment_variables()
 
@@ -22,38 +31,56 @@ def main():
         st.session_state.input_buffer = ''
     if 'input_box' not in st.session_state:
         st.session_state.input_box = ''
-    if 'user_input_submitted' not in st.session_state:
-        st.session_state.user_input_submitted = False
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
     if 'problem_state' not in st.session_state:
-        st.session_state.problem_state = {
-            'original_problem': None,
-            'steps': None,
-            'current_step': 0,
-            'expected_answer': None,
-            'variables': set(),
-            'awaiting_answer': False,
-            'final_answer': None,
-            'solution': None
-        }
+        st.session_state.problem_state = new_problem_state()
+
+    # Restore a persisted session on reconnect (no-op unless SESSION_STORE_URL is set)
+    persistence = restore_session(st.session_state, st.query_params)
 
     # Configure the Streamlit layout
     st.set_page_config(layout="wide", page_title="Interactive Math Solver")
 
-    # Create calculator sidebar
-    create_calculator_sidebar()
+    try:
+        if persistence and persistence.error:
+            st.warning("Your progress couldn't be saved, so it may be lost if you reload this page.")
+
+        # Create calculator sidebar
+        with render_profiler.section("sidebar"):
+            create_calculator_sidebar()
+
+        # Main chat container
+        chat_container = st.container()
 
-    # Main chat container
-    chat_container = st.container()
+        # Handle user input and display chat history
+        with render_profiler.section("handle_user_input"):
+            handle_user_input()
+        with render_profiler.section("chat_history"):
+            display_chat_history(chat_container)
+        with render_profiler.section("solve_queue"):
+            display_solve_queue()
+        with render_profiler.section("exam_form"):
+            display_exam_form()
 
-    # Handle user input and display chat history
-    handle_user_input()
-    display_chat_history(chat_container)
+        # Display feedback form after problem completion
+        with render_profiler.section("feedback_form"):
+            display_feedback_form()
 
-    # Display feedback form after problem completion
-    if st.session_state.show_feedback_form:
-        display_feedback_form()
+        if is_admin():
+            display_admin_panel()
+    except RerunException:
+        rerun = True
+        raise
+    finally:
+        # st.rerun() unwinds through here too, so every script run flushes what it changed
+        with render_profiler.section("persist"):
+            if persistence:
+                persistence.flush(st.session_state)
+            # Everything the run's action logged, in one Sheets request
+            flush_sheet_log()
+            sample_session_memory()
+        render_profiler.end_run(rerun)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
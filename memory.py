@@ -0,0 +1,245 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from types import BuiltinFunctionType, CodeType, FrameType, FunctionType, MethodType, ModuleType
+
+from settings import get_settings
+
+settings = get_settings()
+MEMORY_SAMPLE_SECONDS = settings.memory_sample_seconds
+MEMORY_TRACEMALLOC_FRAMES = settings.memory_tracemalloc_frames
+MEMORY_REPORT_TOP = settings.memory_report_top
+
+# Shared by everything and not owned by any one session
+_OPAQUE = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType, CodeType, FrameType,
+           threading.Thread, logging.Logger)
+_ATOMS = (str, bytes, bytearray, int, float, complex, bool, type(None))
+# Keys generated per step or message, e.g. show_question_input_3, reported together as show_question_input_*
+_NUMBERED_KEY = re.compile(r"^(.*?)\d+$")
+
+
+def deep_size(obj, seen: set = None, max_objects: int = 200_000) -> int:
+    """
+    Approximate bytes held by obj and everything it references: containers, instance
+    __dict__s and __slots__. Classes, modules, functions, threads and loggers are not
+    followed. Objects whose ids are in `seen` are skipped and new ones are added to it, so
+    passing the same set across calls counts shared objects once. Stops counting after
+    max_objects objects.
+    """
+    seen = set() if seen is None else seen
+    stack = [obj]
+    size = 0
+    counted = 0
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _OPAQUE):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current, 0)
+        counted += 1
+        if counted >= max_objects:
+            logging.debug(f"deep_size stopped after {max_objects} objects under {type(obj).__name__}")
+            break
+        if isinstance(current, _ATOMS):
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+            continue
+        if isinstance(current, (list, tuple, set, frozenset, deque)):
+            stack.extend(current)
+            continue
+        try:
+            attributes = object.__getattribute__(current, "__dict__")
+        except AttributeError:
+            attributes = None
+        if isinstance(attributes, dict):
+            stack.append(attributes)
+        for cls in type(current).__mro__:
+            for slot in cls.__dict__.get("__slots__", ()):
+                try:
+                    stack.append(object.__getattribute__(current, slot))
+                except AttributeError:
+                    pass
+    return size
+
+
+def key_family(key: str) -> str:
+    match = _NUMBERED_KEY.match(str(key))
+    return f"{match.group(1)}*" if match and match.group(1) else str(key)
+
+
+def measure_session(session_state) -> dict:
+    """
+    Bytes per session-state key, numbered keys grouped into families, plus the session's
+    total. Each key is measured on its own, so an object two keys share counts toward both;
+    the total counts it once.
+    """
+    keys = {}
+    counts = {}
+    seen = set()
+    total = 0
+    for key in list(session_state.keys()):
+        try:
+            value = session_state[key]
+        except KeyError:
+            continue
+        family = key_family(key)
+        keys[family] = keys.get(family, 0) + deep_size(value)
+        counts[family] = counts.get(family, 0) + 1
+        total += deep_size(value, seen)
+    return {"keys": keys, "counts": counts, "total": total}
+
+
+def process_rss() -> int:
+    """Resident set size of this process in bytes, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryMonitor:
+    """
+    Process-wide memory accounting for Streamlit sessions.
+
+    Each session is measured at most once per `interval` seconds from the end of its script
+    run, and its last few totals are kept to show growth. Once per interval the largest
+    sessions and keys are logged, and, when `tracemalloc_frames` is set, a tracemalloc
+    snapshot is diffed against the previous one to log the lines whose allocations grew
+    most since. Sessions not seen for `stale_after` seconds are dropped.
+    """
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_SECONDS, top: int = MEMORY_REPORT_TOP,
+                 tracemalloc_frames: int = MEMORY_TRACEMALLOC_FRAMES, history: int = 60, stale_after: float = None):
+        self.interval = interval
+        self.top = top
+        self.history = history
+        self.stale_after = stale_after if stale_after is not None else max(3600.0, 10 * interval)
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._last_report = time.monotonic()
+        self._last_snapshot = None
+        self.allocation_growth = []
+        self.tracemalloc_frames = tracemalloc_frames
+        if tracemalloc_frames > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(tracemalloc_frames)
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def sample(self, session_id: str, session_state, force: bool = False):
+        """Measure the session if it's due (or `force`), returning the measurement or None."""
+        if not (self.enabled or force) or session_id is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry["last_seen"] = now
+                self._sessions.move_to_end(session_id)
+            if not force and entry is not None and now - entry["measured_at"] < self.interval:
+                return None
+        try:
+            start = time.perf_counter()
+            measurement = measure_session(session_state)
+            measurement["seconds"] = time.perf_counter() - start
+        except Exception as e:
+            # Instrumentation must never break the tutoring flow
+            logging.error(f"Error measuring session {session_id}: {str(e)}")
+            return None
+
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = self._sessions[session_id] = {"totals": deque(maxlen=self.history)}
+            entry.update(measurement, measured_at=now, last_seen=now)
+            entry["totals"].append((time.time(), measurement["total"]))
+            for stale in [sid for sid, e in self._sessions.items() if now - e["last_seen"] > self.stale_after]:
+                del self._sessions[stale]
+        logging.debug(f"Session {session_id} holds {format_bytes(measurement['total'])} "
+                      f"(measured in {measurement['seconds'] * 1000:.0f} ms): {self._top_keys(measurement['keys'])}")
+        self._maybe_report(now)
+        return measurement
+
+    def _top_keys(self, keys: dict) -> str:
+        largest = sorted(keys.items(), key=lambda item: item[1], reverse=True)[:self.top]
+        return ", ".join(f"{key} {format_bytes(size)}" for key, size in largest)
+
+    def _maybe_report(self, now: float):
+        with self._lock:
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+        report = self.snapshot()
+        logging.info(f"Memory: {len(report['sessions'])} sessions hold {format_bytes(report['tracked_bytes'])}"
+                     + (f", process RSS {format_bytes(report['rss'])}" if report["rss"] else ""))
+        for session in report["sessions"][:self.top]:
+            logging.info(f"  session {session['session_id']}: {format_bytes(session['total'])} "
+                         f"({session['growth']:+,} bytes over {session['samples']} samples), {self._top_keys(session['keys'])}")
+        if tracemalloc.is_tracing():
+            self.diff_allocations()
+            for line in self.allocation_growth:
+                logging.info(f"  {line['size_diff']:+,} bytes ({line['count_diff']:+,} blocks) at {line['location']}")
+
+    def diff_allocations(self) -> list:
+        """Take a tracemalloc snapshot and keep the `top` lines that grew most since the last one."""
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        with self._lock:
+            previous, self._last_snapshot = self._last_snapshot, snapshot
+        if previous is None:
+            return []
+        growth = [
+            {"location": str(stat.traceback[0]), "size_diff": stat.size_diff, "count_diff": stat.count_diff,
+             "size": stat.size}
+            for stat in snapshot.compare_to(previous, "lineno")[:self.top]
+            if stat.size_diff > 0
+        ]
+        with self._lock:
+            self.allocation_growth = growth
+        return growth
+
+    def snapshot(self) -> dict:
+        """Sessions by size with their largest keys and growth, for logging or an admin view."""
+        with self._lock:
+            sessions = [
+                {
+                    "session_id": session_id,
+                    "total": entry["total"],
+                    "keys": dict(entry["keys"]),
+                    "counts": dict(entry["counts"]),
+                    "growth": entry["totals"][-1][1] - entry["totals"][0][1],
+                    "samples": len(entry["totals"]),
+                    "measured_seconds_ago": time.monotonic() - entry["measured_at"],
+                }
+                for session_id, entry in self._sessions.items()
+            ]
+            allocation_growth = list(self.allocation_growth)
+        sessions.sort(key=lambda session: session["total"], reverse=True)
+        return {
+            "sessions": sessions,
+            "tracked_bytes": sum(session["total"] for session in sessions),
+            "rss": process_rss(),
+            "allocation_growth": allocation_growth,
+        }
+
+
+def format_bytes(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+memory_monitor = MemoryMonitor()
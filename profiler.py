@@ -0,0 +1,236 @@
+import cProfile
+import heapq
+import io
+import itertools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+
+from settings import get_settings
+
+settings = get_settings()
+RENDER_PROFILE = settings.render_profile
+RENDER_PROFILE_CAPTURE = settings.render_profile_capture
+RENDER_PROFILE_SLOW_MS = settings.render_profile_slow_ms
+RENDER_PROFILE_KEEP = settings.render_profile_keep
+
+CAPTURE_MODES = ("off", "cprofile", "sample")
+# How often the sampling profiler looks at the script thread's stack
+SAMPLE_INTERVAL_SECONDS = 0.005
+# Functions or stacks kept from a captured profile
+PROFILE_TOP = 30
+
+
+class _StackSampler:
+    """Samples one thread's Python stack on a background thread; cheap enough to leave on for every run."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="render-profile-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> str:
+        """Stop sampling and return the most common stacks, root first, in folded (flame graph) format."""
+        self._stop.set()
+        self._thread.join()
+        return "\n".join(f"{count} {stack}" for stack, count in self.stacks.most_common(PROFILE_TOP))
+
+
+class _Run:
+    """Timings of one script run."""
+
+    def __init__(self, capture: str):
+        self.started = time.perf_counter()
+        self.sections = {}
+        self.messages = []
+        self.rerun = False
+        self._profile = None
+        self._sampler = None
+        if capture == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif capture == "sample":
+            self._sampler = _StackSampler(threading.get_ident())
+
+    def finish(self, keep_profile) -> dict:
+        seconds = time.perf_counter() - self.started
+        profile = None
+        if self._profile is not None:
+            self._profile.disable()
+            if keep_profile(seconds):
+                out = io.StringIO()
+                pstats.Stats(self._profile, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+                profile = out.getvalue()
+        elif self._sampler is not None:
+            stacks = self._sampler.stop()
+            profile = stacks if keep_profile(seconds) else None
+        slowest = sorted(self.messages, key=lambda message: message[2], reverse=True)[:3]
+        return {
+            "seconds": seconds,
+            "sections": dict(self.sections),
+            "messages": len(self.messages),
+            "messages_seconds": sum(message[2] for message in self.messages),
+            "slowest_messages": [{"index": index, "kind": kind, "seconds": s} for index, kind, s in slowest],
+            "rerun": self.rerun,
+            "profile": profile,
+        }
+
+
+class RenderProfiler:
+    """
+    Opt-in timing of the Streamlit script: each top-level section and chat message per run,
+    and how many st.rerun() calls one user action set off.
+
+    A run starts at the top of main.main and ends in its `finally`. A run that ends in
+    st.rerun() continues the same action in the next run, so an action is every run from a
+    user interaction to the first run that doesn't request another. With `capture` set to
+    "cprofile" or "sample", every run is profiled and the profiles of the `keep` slowest
+    runs over `slow_seconds` are kept. Runs of a fragment alone (the input panel) don't go
+    through main and aren't timed.
+    """
+
+    def __init__(self, enabled: bool = RENDER_PROFILE, capture: str = RENDER_PROFILE_CAPTURE,
+                 slow_seconds: float = RENDER_PROFILE_SLOW_MS / 1000, keep: int = RENDER_PROFILE_KEEP,
+                 samples: int = 512):
+        if capture not in CAPTURE_MODES:
+            raise ValueError(f"RENDER_PROFILE_CAPTURE must be one of {', '.join(CAPTURE_MODES)}, not {capture!r}")
+        self.enabled = enabled
+        self.capture = capture
+        self.slow_seconds = slow_seconds
+        self.keep = keep
+        self._samples = samples
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._sections = {}
+            self._runs = deque(maxlen=self._samples)
+            self._reruns_per_action = Counter()
+            self._slowest = []
+
+    @property
+    def current(self):
+        return getattr(self._local, "run", None)
+
+    def start_run(self, session_state):
+        if not self.enabled:
+            return
+        self._local.run = _Run(self.capture)
+        self._local.session_state = session_state
+
+    @contextmanager
+    def _timed(self, record):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record(time.perf_counter() - start)
+
+    def section(self, name: str):
+        """Time a top-level part of the script run, e.g. `with render_profiler.section("sidebar"):`."""
+        run = self.current
+        if run is None:
+            return nullcontext()
+        return self._timed(lambda seconds: run.sections.__setitem__(name, run.sections.get(name, 0.0) + seconds))
+
+    def message(self, index: int, kind: str):
+        """Time rendering one chat message."""
+        run = self.current
+        if run is None:
+            return nullcontext()
+        return self._timed(lambda seconds: run.messages.append((index, kind, seconds)))
+
+    def end_run(self, rerun: bool = False):
+        """Finish the current run; `rerun` when it ended by requesting another run."""
+        run = self.current
+        if run is None:
+            return None
+        self._local.run = None
+        session_state = self._local.session_state
+        self._local.session_state = None
+        run.rerun = rerun
+
+        def keep_profile(seconds):
+            with self._lock:
+                return seconds >= self.slow_seconds and (
+                    len(self._slowest) < self.keep or seconds > self._slowest[0][0])
+        result = run.finish(keep_profile)
+
+        # Reruns of one action, carried across its runs in the session
+        action = session_state.get("render_action") or {"runs": 0, "seconds": 0.0}
+        action["runs"] += 1
+        action["seconds"] += result["seconds"]
+        result["action_runs"] = action["runs"]
+        session_state["render_action"] = action if rerun else None
+        session_state["last_render"] = result
+
+        with self._lock:
+            for name, seconds in result["sections"].items():
+                self._sections.setdefault(name, deque(maxlen=self._samples)).append(seconds)
+            self._runs.append(result["seconds"])
+            if not rerun:
+                self._reruns_per_action[action["runs"] - 1] += 1
+            if result["profile"] is not None:
+                entry = (result["seconds"], next(self._sequence), {
+                    "seconds": result["seconds"], "sections": result["sections"], "at": time.strftime("%H:%M:%S"),
+                    "profile": result["profile"],
+                })
+                if len(self._slowest) < self.keep:
+                    heapq.heappush(self._slowest, entry)
+                else:
+                    heapq.heappushpop(self._slowest, entry)
+
+        sections = ", ".join(f"{name} {seconds * 1000:.0f}" for name, seconds in result["sections"].items())
+        line = (f"run {result['seconds'] * 1000:.0f} ms ({sections}; {result['messages']} messages "
+                f"{result['messages_seconds'] * 1000:.0f} ms)"
+                + (", requested another run" if rerun else f", action done in {action['runs']} runs "
+                   f"{action['seconds'] * 1000:.0f} ms"))
+        if result["seconds"] >= self.slow_seconds:
+            logging.info(f"Slow script {line}")
+        else:
+            logging.debug(f"Script {line}")
+        return result
+
+    def snapshot(self) -> dict:
+        """Per-section and per-run latencies, reruns per action and the slowest profiles, for an admin view."""
+        def summary(values):
+            ordered = sorted(values)
+            return {
+                "count": len(ordered),
+                "mean_ms": sum(ordered) / len(ordered) * 1000,
+                "p50_ms": ordered[len(ordered) // 2] * 1000,
+                "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+            } if ordered else None
+
+        with self._lock:
+            return {
+                "runs": summary(self._runs),
+                "sections": {name: summary(values) for name, values in self._sections.items()},
+                "reruns_per_action": dict(sorted(self._reruns_per_action.items())),
+                "slowest": [entry for _, _, entry in sorted(self._slowest, reverse=True)],
+            }
+
+
+render_profiler = RenderProfiler()
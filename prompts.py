@@ -0,0 +1,407 @@
+import json
+import logging
+import string
+import threading
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Token count with tiktoken when it is installed, otherwise the ~4 characters per token rule."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4) if text else 0
+    return len(encoding.encode(text))
+
+
+class PromptTemplate:
+    """
+    A chat prompt split into a static system prefix and a variable user message.
+
+    Everything that never changes lives in `system` and the function schema sent with it,
+    so consecutive calls share an identical prefix that provider-side prompt caching can
+    reuse. The user template is parsed once into literal/field pairs and rendered by joining.
+    """
+
+    def __init__(self, name: str, system: str, user: str, model: str = "gpt-4o", functions: list = None):
+        self.name = name
+        self.system = system
+        self.user = user
+        self.model = model
+        self.functions = functions
+        # Forced call of the template's (only) function, as every structured call does
+        self.function_call = {"name": functions[0]["name"]} if functions else None
+        self._parts = [
+            (literal, field) for literal, field, _, _ in string.Formatter().parse(user)
+        ]
+        self.fields = tuple(field for _, field in self._parts if field)
+        self.static_tokens = count_tokens(system, model) + count_tokens(
+            "".join(literal for literal, _ in self._parts), model
+        ) + (count_tokens(json.dumps(functions), model) if functions else 0)
+
+    def render(self, **values) -> str:
+        return "".join(literal + (str(values[field]) if field else "") for literal, field in self._parts)
+
+    def messages(self, **values) -> list:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.render(**values)},
+        ]
+
+    def __repr__(self):
+        return f"PromptTemplate({self.name!r}, static_tokens={self.static_tokens})"
+
+
+_registry = {}
+
+
+def register(template: PromptTemplate) -> PromptTemplate:
+    _registry[template.name] = template
+    return template
+
+
+def get_template(name: str) -> PromptTemplate:
+    return _registry[name]
+
+
+def templates() -> dict:
+    return dict(_registry)
+
+
+class PromptUsage:
+    """Process-wide prompt token accounting per template, from the API usage fields."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, template_name: str, usage, model: str = None):
+        """Add a response's token usage to the template's totals, and to the model's when given."""
+        if usage is None:
+            return
+        prompt_tokens = _field(usage, "prompt_tokens") or 0
+        details = _field(usage, "prompt_tokens_details")
+        cached_tokens = (_field(details, "cached_tokens") if details is not None else None) or 0
+        completion_tokens = _field(usage, "completion_tokens") or 0
+        with self._lock:
+            stats = self._stats.setdefault(template_name, {
+                "calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0
+            })
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["cached_tokens"] += cached_tokens
+            stats["completion_tokens"] += completion_tokens
+            if model is not None:
+                # Kept per model too where one template is sent to several, see MathSolver.validate_step_answer_llm
+                by_model = stats.setdefault("by_model", {}).setdefault(model, {
+                    "calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0
+                })
+                by_model["calls"] += 1
+                by_model["prompt_tokens"] += prompt_tokens
+                by_model["cached_tokens"] += cached_tokens
+                by_model["completion_tokens"] += completion_tokens
+        logging.debug(f"Prompt usage for {template_name}: {prompt_tokens} prompt tokens "
+                      f"({cached_tokens} cached), {completion_tokens} completion tokens")
+
+    def snapshot(self) -> dict:
+        """Per-template totals with uncached tokens and cache hit rate filled in."""
+        with self._lock:
+            report = {name: dict(stats) for name, stats in self._stats.items()}
+            for stats in report.values():
+                if "by_model" in stats:
+                    stats["by_model"] = {model: dict(totals) for model, totals in stats["by_model"].items()}
+        for stats in report.values():
+            stats["uncached_tokens"] = stats["prompt_tokens"] - stats["cached_tokens"]
+            stats["cache_hit_rate"] = stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def _field(obj, name):
+    # openai's usage models are objects, cassettes and older SDKs may hand back plain dicts
+    if isinstance(obj, dict):
+        return obj.get(name)
+    value = getattr(obj, name, None)
+    if value is None and hasattr(obj, "model_extra"):
+        value = (obj.model_extra or {}).get(name)
+    return value
+
+
+prompt_usage = PromptUsage()
+
+# USD per million tokens: (input, cached input, output), for comparing models in benchmarks
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+}
+
+
+def estimate_cost(model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int):
+    """Cost in USD of the given token counts on `model`, or None when its prices aren't known."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1e6
+
+
+STRUCTURE_SOLUTION = register(PromptTemplate(
+    "structure_solution",
+    system="""You are a math teacher who takes a math problem and solution to that problem, and breaks down solution into clear steps.
+
+You are an expert math teacher that helps college students understand how to solve problems that appear on their homework and exams.
+You specialize in explaining math problems, but also have extreme expertise in other STEM fields like Computer Science, Statistics, Economics, Biology, Physics, and Chemistry.
+You will generate explanations for math prompts tailored to the perceived skill level of the user; for instance, when solving a calculus Power Rule problem, explain it as if the student is enrolled in AP Calculus AB, using appropriate terminology and detail for that level.
+Your main objective is to help students understand the concepts fully so that they can score better on their exams.
+
+To do this, break the problem down into steps.
+Each step should explain a critical technique or concept that is necessary for reaching the final answer, be written concisely, and aim to enhance understanding.
+The user workflow should be fast and effective, so do not include unnecessary steps that don't use an important concept.
+A response will typically have between 3-6 steps.
+Make sure each step logically flows from the last, and that there is a clear way to arrive at the answer.
+Remember, your goal is to help guide students so that they can learn the concepts and score better on their exams.
+
+For each step, include:
+1. Clear instructions detailing the specific action or calculation required.
+2. A guiding question prompting the student to think about the relevant formula, concept, or calculation needed to complete this step.
+3. A concise review of the previous step, including the correct answer. This validates the student's solution, reinforces the critical concept or formula used, and ensures they understand how to apply it moving forward.
+4. Three hints of increasing strength, none of which reveals the answer: first a nudge toward the relevant idea, then the formula or method with the numbers from this step, then a worked setup that stops just short of the answer.
+5. Other ways a student might correctly write the answer (for example $\\frac{1}{2}$, 1/2 and 0.5, or x = 4 and 4).
+
+IMPORTANT FORMATTING RULES:
+- ALL mathematical expressions MUST be enclosed in LaTeX delimiters ($...$)
+- For complex mathematical structures (matrices, aligned equations, etc.):
+    - Use \\begin{...} and \\end{...} environments inside LaTeX delimiters
+    - Example for matrices: $\\begin{bmatrix} a & b \\\\ c & d \\end{bmatrix}$
+    - Example for aligned equations: $\\begin{align} x &= 2 \\\\ y &= 3 \\end{align}$
+- For inline expressions:
+    - Single variables: $x$, $n$
+    - Powers: $x^2$, $n^3$
+    - Fractions: $\\frac{dx}{dy}$
+    - Integrals: $\\int x^2 dx$
+- NEVER mix plain text and mathematical symbols
+- NEVER leave LaTeX commands undelimited
+- For the final answer:
+    - Present it as a standalone LaTeX expression
+    - Remove any trailing punctuation
+    - If text is needed, keep it outside the LaTeX delimiters
+    - Example: The solution is $x = 5$ units
+
+GRAPH QUERY RULES:
+- For most steps, show a graph to help the user understand a concept. Show graphs for steps with equations that can be represented as a graph
+- Generate a simple query for each graph, focusing on a single mathematical concept or function.
+- Do not include constants of integration or multiple expressions in a single query.
+- Ensure the query is suitable for a basic graphing calculator, using only the core equation or function.
+
+Example response format:
+"To find the derivative of $x^2$, we use the power rule. What is $\\frac{d}{dx}(x^2)$?"
+
+Final answer format example:
+"Great job! The final answer is: \\frac{x^3}{3} + C"
+""",
+    user="The problem to solve is: {problem}",
+    functions=[
+        {
+            "name": "get_math_solution",
+            "description": "Provide the solution steps for the math problem solution.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "steps": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "instruction": {"type": "string"},
+                                "question": {"type": "string"},
+                                "answer": {"type": "string"},
+                                "explanation": {"type": "string"},
+                                "graph_query": {"type": "string"},
+                                "hints": {
+                                    "type": "array",
+                                    "items": {"type": "string"},
+                                    "description": "Three progressively stronger hints for this step, none revealing the answer"
+                                },
+                                "accepted_answers": {
+                                    "type": "array",
+                                    "items": {"type": "string"},
+                                    "description": "Equivalent forms of the answer a student might type, e.g. 1/2 and 0.5"
+                                }
+                            },
+                            "required": ["instruction", "question", "answer", "explanation"],
+                            "additionalProperties": False
+                        }
+                    },
+                    "final_answer": {"type": "string"},
+                    "original_problem": {"type": "string"}
+                },
+                "required": ["steps", "final_answer", "original_problem"],
+                "additionalProperties": False
+            }
+        }
+    ],
+))
+
+SOLVE_PROBLEM = register(PromptTemplate(
+    "solve_problem",
+    system="You are a helpful assistant",
+    user="""Solve the following math problem and provide a detailed solution of each step in the solution:
+
+Problem: {problem}""",
+    model="deepseek/deepseek-r1",
+))
+
+VALIDATE_ANSWER = register(PromptTemplate(
+    "validate_answer",
+    system="You are a helpful assistant that checks if the student's answer is correct. The answer doesnt have to match the expected answer exactly, but it should be relatively equivalent.",
+    user="Determine if these answers are equivalent based on this question: {question}:\nStudent's Answer: {user_answer}\nExpected Answer: {expected_answer}",
+    functions=[
+        {
+            "name": "validate_answer",
+            "description": "Validate if the student's answer matches the expected answer.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "is_correct": {
+                        "type": "boolean",
+                        "description": "Whether the student's answer is correct or equivalent to the expected answer"
+                    },
+                    "explanation": {
+                        "type": "string",
+                        "description": "Explain to the student why the answer is correct or incorrect. Do not include any math terms in the answer just plain english Make sure its brief. Also do not reveal the correct answer, only explain why the answer is correct or incorrect. Make sure to address the student directly like youre speaking to them"
+                    },
+                    "confidence": {
+                        "type": "number",
+                        "description": "How sure you are that is_correct is right, from 0 (guessing) to 1 (certain)"
+                    }
+                },
+                "required": ["is_correct", "explanation", "confidence"],
+                "additionalProperties": False
+            }
+        }
+    ],
+))
+
+CUSTOM_HINT = register(PromptTemplate(
+    "custom_hint",
+    system="""You are a math tutor who NEVER reveals answers directly. Your role is to guide students to understanding through hints and explanations. Under NO circumstances should you provide the actual answer or a direct solution. If a student asks for the answer directly, redirect them to think about the process.
+
+For the student's current step, provide a helpful hint that:
+1. Addresses the specific step.
+2. States the specific idea or formula needed to solve this step, and includes any relevant numbers from the problem.
+3. If they had previous attempts, explain why they were incorrect
+4. Gives a high-level overview of how to solve the step.
+5. Asks the user a guiding question to help them solve the step.
+6. Does NOT give them the final answer. Never give the answer in the hint, only guide the student in the right direction.
+7. Use proper LaTeX formatting for ALL mathematical expressions ($...$)""",
+    user="""Current step instruction: {instruction}
+Current step question: {question}
+
+Student's question: {user_question}
+
+Previous attempts:
+{previous_attempts}""",
+    functions=[
+        {
+            "name": "generate_hint",
+            "description": "Generate a helpful hint that addresses the student's question.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "hint": {
+                        "type": "string",
+                        "description": "A helpful hint that guides without revealing the answer"
+                    }
+                },
+                "required": ["hint"]
+            }
+        }
+    ],
+))
+
+PROBLEM_SUMMARY = register(PromptTemplate(
+    "problem_summary",
+    system="""You are an encouraging math tutor providing a summary of the student's performance.
+
+You will be given a problem the student has completed and their performance on each step. Provide a summary that:
+
+1. Starts with a brief pleasantry that is a maximum of 4 words. (e.g. "Great job!")
+2. States the important concepts, formulas, or topics that were used to arrive at the solution.
+3. Points out the specific step(s) where the student made a mistake, and briefly explain what the mistake was. (e.g. "On Step 3, you made a small mistake while applying the power rule. The exponent should be reduced by 1.")
+4. Gives the student 1-2 recommendations for topics to study further based on the mistakes made in the previous problem. These recommendations should be on topics that are likely to appear on their exams.
+5. Ends with another brief pleasantry that motivates the student to keep studying and improving.
+
+Make sure the problem summary:
+-Gives the student relevant recommendations about what to study next based on their mistakes in the previous problem, with the objective that these topics will help them score better on their exams. If no mistakes were made, recommend that they keep studying the same or similar topic.
+-Is written concisely. It should follow the given structure while also not being too verbose.
+-Is written in an encouraging and patient tone. Be empathetic, but do NOT be overly pleasant or motivational. Don't include pleasantries anywhere in the middle of the response.
+-Does not reveal any additional answers or solutions.
+-NEVER shows unrendered LaTeX.
+-Use proper LaTeX formatting for ALL mathematical expressions ($...$)""",
+    user="""The student has completed solving the following problem:
+Problem: {problem}
+Here is their performance on each step:
+{steps_info}""",
+    model="gpt-4o-mini",
+))
+
+VALIDATE_EXAM = register(PromptTemplate(
+    "validate_exam",
+    system="You are a helpful assistant that grades all of a student's step answers for a math problem at once. Judge each step independently: the answer doesnt have to match the expected answer exactly, but it should be relatively equivalent.",
+    user="""Problem: {problem}
+
+{answers}""",
+    functions=[
+        {
+            "name": "grade_steps",
+            "description": "Grade the student's answer to every step of the problem.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "results": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "step": {
+                                    "type": "integer",
+                                    "description": "The step number, starting at 1"
+                                },
+                                "is_correct": {
+                                    "type": "boolean",
+                                    "description": "Whether the student's answer is correct or equivalent to the expected answer"
+                                },
+                                "explanation": {
+                                    "type": "string",
+                                    "description": "Explain to the student why the answer is correct or incorrect. Do not include any math terms in the answer just plain english Make sure its brief. Also do not reveal the correct answer, only explain why the answer is correct or incorrect. Make sure to address the student directly like youre speaking to them"
+                                }
+                            },
+                            "required": ["step", "is_correct", "explanation"],
+                            "additionalProperties": False
+                        }
+                    }
+                },
+                "required": ["results"],
+                "additionalProperties": False
+            }
+        }
+    ],
+))
@@ -0,0 +1,318 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from settings import get_settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: buckets are shared within the process only
+    fcntl = None
+
+settings = get_settings()
+RATE_LIMIT_DIR = settings.rate_limit_dir
+RATE_LIMIT_MAX_WAIT = settings.rate_limit_max_wait
+RATE_LIMITS = settings.rate_limits
+# Tokens a completion is assumed to produce when the request doesn't cap it
+COMPLETION_TOKEN_ESTIMATE = 512
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset(value: str, now: float = None):
+    """
+    Seconds until a rate limit resets, from OpenAI's "6m0s" / "20ms" durations, a plain
+    number of seconds, or OpenRouter's epoch milliseconds. None if it can't be read.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        parts = _DURATION.findall(value)
+        return sum(float(amount) * _UNITS[unit] for amount, unit in parts) if parts else None
+    if number > 1e11:
+        return max(0.0, number / 1000 - (now or time.time()))
+    return number
+
+
+def estimate_tokens(body: bytes) -> int:
+    """Rough token cost of a chat completion request: its text at ~4 characters a token, plus the reply."""
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        return COMPLETION_TOKEN_ESTIMATE
+    prompt = len(json.dumps([payload.get("messages"), payload.get("functions"), payload.get("tools")])) // 4
+    return prompt + int(payload.get("max_tokens") or COMPLETION_TOKEN_ESTIMATE)
+
+
+class _Bucket:
+    """
+    Request and token allowances of one provider and model, refilling continuously up to a
+    per-minute limit. Levels may go negative when a request is let through without
+    capacity; later requests then wait for the debt to refill.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests = requests_per_minute
+        self.tokens = tokens_per_minute
+        self.blocked_until = 0.0
+        self.updated = time.time()
+
+    def refill(self, now: float):
+        elapsed = max(0.0, now - self.updated)
+        if self.requests_per_minute:
+            self.requests = min(self.requests_per_minute, self.requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self.tokens = min(self.tokens_per_minute, self.tokens + elapsed * self.tokens_per_minute / 60)
+        self.updated = now
+
+    def wait_for(self, tokens: int, now: float) -> float:
+        """Seconds until a request of `tokens` fits, 0 if it does now."""
+        wait = max(0.0, self.blocked_until - now)
+        if self.requests_per_minute and self.requests < 1:
+            wait = max(wait, (1 - self.requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute:
+            # A request bigger than the whole allowance only waits for a full bucket
+            tokens = min(tokens, self.tokens_per_minute)
+            if self.tokens < tokens:
+                wait = max(wait, (tokens - self.tokens) * 60 / self.tokens_per_minute)
+        return wait
+
+    def take(self, tokens: int):
+        # An unlimited dimension (0) keeps no level, or it would pile up debt for a limit set later
+        if self.requests_per_minute:
+            self.requests -= 1
+        if self.tokens_per_minute:
+            self.tokens -= tokens
+
+    def set_limits(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        """Resize to limits a provider reported; a dimension that was unlimited starts out full."""
+        if requests_per_minute is not None:
+            self.requests = requests_per_minute if not self.requests_per_minute \
+                else min(self.requests, requests_per_minute)
+            self.requests_per_minute = requests_per_minute
+        if tokens_per_minute is not None:
+            self.tokens = tokens_per_minute if not self.tokens_per_minute \
+                else min(self.tokens, tokens_per_minute)
+            self.tokens_per_minute = tokens_per_minute
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "_Bucket":
+        bucket = cls.__new__(cls)
+        bucket.__dict__.update(data)
+        return bucket
+
+
+class _MemoryBuckets:
+    """Buckets shared by the threads of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def update(self, key: str, default, fn):
+        """Run fn(bucket) atomically, creating the bucket with default() first, and return its result."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = default()
+            return fn(bucket)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: bucket.to_dict() for key, bucket in self._buckets.items()}
+
+
+class _FileBuckets:
+    """Buckets shared by every process on the host, one JSON file per bucket, updated under flock."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", key) + ".json")
+
+    def update(self, key: str, default, fn):
+        # flock is per open file description, so threads of this process also take the thread lock
+        with self._lock:
+            fd = os.open(self._path(key), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                raw = b""
+                while True:
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        break
+                    raw += chunk
+                try:
+                    bucket = _Bucket.from_dict(json.loads(raw)) if raw else default()
+                except ValueError:
+                    bucket = default()
+                result = fn(bucket)
+                data = json.dumps(bucket.to_dict()).encode("utf-8")
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, data)
+                return result
+            finally:
+                os.close(fd)
+
+    def snapshot(self) -> dict:
+        buckets = {}
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        buckets[name[:-len(".json")]] = json.load(f)
+                except (OSError, ValueError):
+                    continue
+        return buckets
+
+
+class RateGovernor:
+    """
+    Token buckets per provider and model, so requests wait briefly for capacity instead of
+    running into 429s.
+
+    Limits start from settings (RATE_LIMIT_<PROVIDER>_RPM / _TPM, 0 for none) and follow the
+    x-ratelimit-* headers providers send back: the limit resizes the bucket and the
+    remaining count lowers it. A 429 empties it until the provider's reset time. Buckets live
+    in files under RATE_LIMIT_DIR, shared by every worker process on the host, or in this
+    process only when it's empty. A request waits at most `max_wait` seconds and is then sent
+    anyway, leaving the bucket in debt, so the provider has the final say.
+    """
+
+    def __init__(self, directory: str = RATE_LIMIT_DIR, max_wait: float = RATE_LIMIT_MAX_WAIT):
+        self.max_wait = max_wait
+        self._buckets = _FileBuckets(directory) if directory and fcntl is not None else _MemoryBuckets()
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.overruns = 0
+        self.rate_limited = 0
+
+    @staticmethod
+    def key(provider: str, model: str = None) -> str:
+        return f"{provider}:{model}" if model else provider
+
+    @staticmethod
+    def _default(provider: str):
+        requests_per_minute, tokens_per_minute = RATE_LIMITS.get(provider, (0, 0))
+        return lambda: _Bucket(requests_per_minute, tokens_per_minute)
+
+    def acquire(self, provider: str, model: str = None, tokens: int = 0) -> float:
+        """Wait until the bucket has room for one request of `tokens`, and take it. Returns the seconds waited."""
+        key = self.key(provider, model)
+        default = self._default(provider)
+        start = time.monotonic()
+        while True:
+            waited = time.monotonic() - start
+
+            def attempt(bucket):
+                now = time.time()
+                bucket.refill(now)
+                wait = bucket.wait_for(tokens, now)
+                if wait <= 0 or waited >= self.max_wait:
+                    bucket.take(tokens)
+                    return 0.0 if wait <= 0 else -wait
+                return wait
+            wait = self._buckets.update(key, default, attempt)
+            if wait <= 0:
+                break
+            time.sleep(min(wait, self.max_wait - waited, 1.0))
+
+        waited = time.monotonic() - start
+        with self._lock:
+            if waited > 0.001:
+                self.waits += 1
+                self.wait_seconds += waited
+            if wait < 0:
+                self.overruns += 1
+        if wait < 0:
+            logging.warning(f"Rate limit for {key} still {-wait:.1f}s away after waiting {waited:.1f}s, sending anyway")
+        elif waited > 0.001:
+            logging.debug(f"Waited {waited:.2f}s for {key} rate limit")
+        return waited
+
+    def observe(self, provider: str, model: str, status: int, headers):
+        """Adapt the bucket to a response's rate-limit headers, and to a 429."""
+        get = lambda name: headers.get(name) or headers.get(name.title())
+        limit_requests = get("x-ratelimit-limit-requests") or get("x-ratelimit-limit")
+        remaining_requests = get("x-ratelimit-remaining-requests") or get("x-ratelimit-remaining")
+        limit_tokens = get("x-ratelimit-limit-tokens")
+        remaining_tokens = get("x-ratelimit-remaining-tokens")
+        reset = parse_reset(get("retry-after") or get("x-ratelimit-reset-requests") or get("x-ratelimit-reset")
+                            or get("x-ratelimit-reset-tokens") or "")
+        if status != 429 and not any((limit_requests, remaining_requests, limit_tokens, remaining_tokens)):
+            return
+
+        def adapt(bucket):
+            now = time.time()
+            bucket.refill(now)
+            try:
+                bucket.set_limits(float(limit_requests) if limit_requests else None,
+                                  float(limit_tokens) if limit_tokens else None)
+                if remaining_requests and bucket.requests_per_minute:
+                    bucket.requests = min(bucket.requests, float(remaining_requests))
+                if remaining_tokens and bucket.tokens_per_minute:
+                    bucket.tokens = min(bucket.tokens, float(remaining_tokens))
+            except ValueError:
+                pass
+            if status == 429:
+                bucket.requests = min(bucket.requests, 0.0)
+                bucket.blocked_until = max(bucket.blocked_until, now + (reset if reset is not None else 1.0))
+        self._buckets.update(self.key(provider, model), self._default(provider), adapt)
+        if status == 429:
+            with self._lock:
+                self.rate_limited += 1
+            logging.warning(f"{self.key(provider, model)} rate limited, holding requests for "
+                            f"{reset if reset is not None else 1.0:.1f}s")
+
+    def httpx_hooks(self, provider: str) -> dict:
+        """
+        event_hooks for an httpx.Client (e.g. the one under an OpenAI client): each request
+        waits for its provider and model's bucket, each response adapts it.
+        """
+        def model_of(request) -> str:
+            try:
+                return json.loads(request.content or b"{}").get("model")
+            except (ValueError, AttributeError):
+                return None
+
+        def on_request(request):
+            request.extensions["rate_limit_model"] = model = model_of(request)
+            self.acquire(provider, model, estimate_tokens(request.content) if request.content else 0)
+
+        def on_response(response):
+            self.observe(provider, response.request.extensions.get("rate_limit_model"),
+                         response.status_code, response.headers)
+
+        return {"request": [on_request], "response": [on_response]}
+
+    def snapshot(self) -> dict:
+        """Waits, overruns and 429s so far, and every bucket's current level."""
+        with self._lock:
+            totals = {
+                "waits": self.waits,
+                "wait_seconds": self.wait_seconds,
+                "overruns": self.overruns,
+                "rate_limited": self.rate_limited,
+            }
+        totals["buckets"] = self._buckets.snapshot()
+        return totals
+
+
+rate_governor = RateGovernor()
@@ -0,0 +1,276 @@
+import logging
+import random
+import threading
+import time
+
+from settings import get_settings
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+
+class TransientError(Exception):
+    """A failure worth retrying, e.g. an HTTP 429 or 5xx from a client that doesn't raise on status."""
+
+
+class DeadlineExceeded(Exception):
+    """The end-to-end budget ran out before (or while) a call could be made."""
+
+
+class Deadline:
+    """
+    An end-to-end time budget, passed down through every stage of a request.
+
+    Each stage asks `timeout(cap, reserve)` for its own timeout: the stage's usual cap,
+    shortened to what is left after keeping `reserve` seconds for the stages after it.
+    """
+
+    def __init__(self, seconds: float, minimum: float = 0.5):
+        self.budget = seconds
+        self.minimum = minimum
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() < self.minimum
+
+    def timeout(self, cap: float, reserve: float = 0.0) -> float:
+        """Timeout for the next call, raising DeadlineExceeded when less than `minimum` is left."""
+        timeout = min(cap, self.remaining() - reserve)
+        if timeout < self.minimum:
+            raise DeadlineExceeded(f"{self.remaining():.1f}s of {self.budget:.0f}s budget left, "
+                                   f"{reserve:.0f}s reserved for later stages")
+        return timeout
+
+    def __repr__(self):
+        return f"Deadline(remaining={self.remaining():.1f}s of {self.budget:.0f}s)"
+
+
+_RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+
+def _status_code(exc: Exception):
+    # openai.APIStatusError and requests.HTTPError carry a status code, googleapiclient's HttpError a response
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        if response is None:
+            response = getattr(exc, "resp", None)
+        status = getattr(response, "status_code", None)
+        if status is None:
+            status = getattr(response, "status", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Timeouts, dropped connections, rate limits and server errors; never client errors or cassette misses."""
+    if isinstance(exc, TransientError):
+        return True
+    status = _status_code(exc)
+    if status is not None:
+        return status in _RETRYABLE_STATUS
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    # Matched by name so this module doesn't have to import openai, httpx, requests or httplib2
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    return bool(names & {
+        "APITimeoutError", "APIConnectionError",                  # openai
+        "TimeoutException", "NetworkError", "RemoteProtocolError",  # httpx
+        "Timeout", "ConnectionError", "ChunkedEncodingError",       # requests
+        "ServerNotFoundError", "HttpLib2Error",                     # httplib2
+    })
+
+
+def is_not_applied(exc: Exception) -> bool:
+    """
+    Failures that mean the request never took effect: a rate limit, or a connection that was
+    never made. The only ones safe to retry for requests that aren't idempotent, like a
+    Sheets append, where a timed-out request may still have written its rows.
+    """
+    if _status_code(exc) == 429:
+        return True
+    if isinstance(exc, ConnectionRefusedError):
+        return True
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    return bool(names & {"ConnectError", "ConnectTimeout", "ServerNotFoundError"})
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls fail fast
+    with CircuitOpenError. Once `reset_timeout` seconds have passed, a single trial call
+    is let through: success closes the circuit, failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self.last_error = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # Half-open: one trial call at a time
+            if self._trial_running:
+                return False
+            self._state = self.HALF_OPEN
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logging.info(f"Circuit {self.name} closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self, exc: Exception):
+        with self._lock:
+            self._failures += 1
+            self.last_error = f"{type(exc).__name__}: {exc}"
+            self._trial_running = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logging.warning(f"Circuit {self.name} opened after {self._failures} failures: {self.last_error}")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """End a call that says nothing about the dependency's health, leaving the state as it is."""
+        with self._lock:
+            self._trial_running = False
+
+    def snapshot(self) -> dict:
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "retry_in": max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+                if state == self.OPEN else 0.0,
+                "last_error": self.last_error,
+            }
+
+
+class Dependency:
+    """
+    One outbound dependency: its timeout, retry policy and circuit breaker.
+
+    `call(fn, ...)` runs fn, retrying retryable failures up to `attempts` times in total
+    with full-jitter exponential backoff, and fails fast while the circuit is open. Only
+    failures that `retry_if` accepts are retried, is_retryable by default.
+    Without a deadline the timeout is not applied here, callers pass `dependency.timeout`
+    to their client. With `deadline=`, fn must take a `timeout` keyword: each attempt gets
+    the dependency's timeout cut down to the remaining budget (minus `reserve`), and no
+    retry is started that could not finish in time.
+    """
+
+    def __init__(self, name: str, timeout: float, attempts: int = 3, base_delay: float = 0.5,
+                 max_delay: float = 8.0, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 retry_if=is_retryable):
+        self.name = name
+        self.retry_if = retry_if
+        self.timeout = timeout
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, *args, deadline: Deadline = None, reserve: float = 0.0, **kwargs):
+        for attempt in range(self.attempts):
+            if deadline is not None:
+                kwargs["timeout"] = deadline.timeout(self.timeout, reserve)
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit open): {self.breaker.last_error}")
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable and deadline is not None and kwargs["timeout"] < self.timeout and deadline.expired:
+                    # We cut this call short ourselves, that says nothing about the provider's health,
+                    # but a half-open circuit's trial has to end so the next call can try again
+                    self.breaker.release()
+                    raise DeadlineExceeded(f"{self.name} call ran out of budget: {e}") from e
+                if retryable:
+                    self.breaker.record_failure(e)
+                else:
+                    # The dependency answered, the request was bad: not a sign of an unhealthy provider
+                    self.breaker.record_success()
+                if not (retryable and self.retry_if(e)) or attempt == self.attempts - 1:
+                    raise
+                delay = self.backoff(attempt)
+                if deadline is not None and deadline.remaining() - reserve - delay < deadline.minimum:
+                    raise DeadlineExceeded(f"{self.name} call failed with no budget left to retry: {e}") from e
+                logging.warning(f"{self.name} call failed ({type(e).__name__}: {e}), "
+                                f"retry {attempt + 1}/{self.attempts - 1} in {delay:.2f}s")
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+
+def _dependency(name: str, timeout: float, attempts: int, **kwargs) -> Dependency:
+    prefix = name.upper()
+    settings = get_settings()
+    return Dependency(
+        name,
+        timeout=settings.get_float(f"{prefix}_TIMEOUT", timeout),
+        attempts=settings.get_int(f"{prefix}_ATTEMPTS", attempts),
+        failure_threshold=settings.get_int(f"{prefix}_BREAKER_FAILURES", 5),
+        reset_timeout=settings.get_float(f"{prefix}_BREAKER_RESET", 30),
+        **kwargs
+    )
+
+
+# Reasoning models think for a long time before answering, everything else should be quick
+OPENAI = _dependency("openai", timeout=60, attempts=3)
+OPENROUTER = _dependency("openrouter", timeout=180, attempts=2)
+WOLFRAM = _dependency("wolfram", timeout=10, attempts=2, max_delay=2.0)
+# Appends aren't idempotent: a retried timeout could log the same rows twice
+SHEETS = _dependency("sheets", timeout=5, attempts=2, max_delay=1.0, retry_if=is_not_applied)
+
+dependencies = {dependency.name: dependency for dependency in (OPENAI, OPENROUTER, WOLFRAM, SHEETS)}
+
+
+def health() -> dict:
+    """Circuit state per dependency, e.g. for a status panel or the load-test report."""
+    return {name: dependency.breaker.snapshot() for name, dependency in dependencies.items()}
+
+
+def is_available(name: str) -> bool:
+    return dependencies[name].breaker.state != CircuitBreaker.OPEN
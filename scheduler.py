@@ -0,0 +1,236 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from settings import get_settings
+
+settings = get_settings()
+
+# Job kinds, most urgent first. Validation and hints are what a student mid-problem is
+# waiting on; summaries close a problem; solves are long and start something new.
+VALIDATE = "validate"
+HINT = "hint"
+SUMMARY = "summary"
+SOLVE = "solve"
+PRIORITIES = {VALIDATE: 0, HINT: 0, SUMMARY: 1, SOLVE: 2}
+INTERACTIVE = frozenset({VALIDATE, HINT, SUMMARY})
+
+# Starting guesses for the service time per kind, refined as jobs finish
+_INITIAL_SERVICE_SECONDS = {VALIDATE: 1.5, HINT: 3.0, SUMMARY: 4.0, SOLVE: 45.0}
+
+
+class Overloaded(Exception):
+    """Raised by submit() when admitting the job would only make it, and everyone behind it, wait too long."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Handle for an admitted job: a Future plus where the job stands in the queue."""
+
+    def __init__(self, scheduler, kind: str, key: tuple):
+        self.scheduler = scheduler
+        self.kind = kind
+        self.key = key
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def wait(self, timeout: float = None) -> bool:
+        """True once the job has finished (or failed)."""
+        try:
+            self.future.exception(timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    def result(self, timeout: float = None):
+        return self.future.result(timeout)
+
+    def cancel(self) -> bool:
+        """Drop the job if it hasn't started yet. A running job can't be stopped; returns False for it."""
+        return self.future.cancel()
+
+    def position(self) -> int:
+        """Jobs that will start before this one (0 once it is running)."""
+        return self.scheduler.position(self)
+
+    def estimated_wait(self) -> float:
+        """Seconds until this job is expected to start."""
+        return self.scheduler.estimated_wait(self)
+
+
+class Scheduler:
+    """
+    Process-wide admission control for model calls.
+
+    Jobs wait in one priority queue served by two bounded worker pools. Interactive workers
+    only take validation, hint and summary jobs, so a burst of new solves can never hold up a
+    student in the middle of a problem; solve workers take the most urgent job of any kind,
+    which is a solve only when no interactive job is waiting. Submissions are refused with
+    Overloaded when their lane's queue is full or the expected wait is too long.
+    """
+
+    def __init__(self, solve_workers: int = 4, interactive_workers: int = 8, max_queued_solves: int = 16,
+                 max_queued_interactive: int = 64, max_solve_wait: float = 180.0):
+        self.solve_workers = solve_workers
+        self.interactive_workers = interactive_workers
+        self.max_queued = {SOLVE: max_queued_solves, "interactive": max_queued_interactive}
+        self.max_solve_wait = max_solve_wait
+        self._condition = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._service_seconds = dict(_INITIAL_SERVICE_SECONDS)
+        self._running = {}
+        self._threads = []
+        self.stats = {"admitted": 0, "shed": 0, "completed": 0, "failed": 0}
+
+    def _start(self):
+        if self._threads:
+            return
+        for i in range(self.interactive_workers):
+            self._spawn(f"scheduler-interactive-{i}", interactive_only=True)
+        for i in range(self.solve_workers):
+            self._spawn(f"scheduler-solve-{i}", interactive_only=False)
+
+    def _spawn(self, name: str, interactive_only: bool):
+        thread = threading.Thread(target=self._work, args=(interactive_only,), name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _lane(self, kind: str) -> str:
+        return "interactive" if kind in INTERACTIVE else SOLVE
+
+    def submit(self, kind: str, fn, *args, **kwargs) -> Ticket:
+        """Queue fn(*args, **kwargs) as a job of `kind`, or raise Overloaded."""
+        if kind not in PRIORITIES:
+            raise ValueError(f"Unknown job kind {kind!r}")
+        with self._condition:
+            self._start()
+            lane = self._lane(kind)
+            queued = sum(1 for _, _, ticket, _ in self._queue if self._lane(ticket.kind) == lane)
+            if queued >= self.max_queued[lane]:
+                self.stats["shed"] += 1
+                raise Overloaded("The tutor is very busy right now, please try again in a minute.",
+                                 retry_after=self._drain_seconds(lane))
+            ticket = Ticket(self, kind, (PRIORITIES[kind], next(self._sequence)))
+            if kind == SOLVE and self._wait_locked(ticket) > self.max_solve_wait:
+                self.stats["shed"] += 1
+                raise Overloaded("The tutor is very busy right now, please try again in a minute.",
+                                 retry_after=self._drain_seconds(lane))
+            heapq.heappush(self._queue, (ticket.key[0], ticket.key[1], ticket, (fn, args, kwargs)))
+            self.stats["admitted"] += 1
+            self._condition.notify_all()
+        return ticket
+
+    def _work(self, interactive_only: bool):
+        while True:
+            with self._condition:
+                while not self._queue or (interactive_only and self._queue[0][2].kind not in INTERACTIVE):
+                    self._condition.wait()
+                _, _, ticket, (fn, args, kwargs) = heapq.heappop(self._queue)
+                ticket.started_at = time.monotonic()
+                self._running[ticket] = interactive_only
+            if not ticket.future.set_running_or_notify_cancel():
+                with self._condition:
+                    self._running.pop(ticket, None)
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                ticket.future.set_exception(e)
+                outcome = "failed"
+            else:
+                ticket.future.set_result(result)
+                outcome = "completed"
+            with self._condition:
+                elapsed = time.monotonic() - ticket.started_at
+                self._running.pop(ticket, None)
+                # Exponentially weighted, so the estimate follows the providers' current latency
+                self._service_seconds[ticket.kind] = 0.8 * self._service_seconds[ticket.kind] + 0.2 * elapsed
+                self.stats[outcome] += 1
+                self._condition.notify_all()
+
+    def _ahead(self, ticket: Ticket) -> list:
+        return [queued for _, _, queued, _ in self._queue if queued.key < ticket.key]
+
+    def _workers_for(self, kind: str) -> int:
+        return self.interactive_workers + self.solve_workers if kind in INTERACTIVE else self.solve_workers
+
+    def _wait_locked(self, ticket: Ticket) -> float:
+        if ticket.started_at is not None or ticket.future.done():
+            return 0.0
+        ahead = self._ahead(ticket)
+        workers = self._workers_for(ticket.kind)
+        # Time left on the jobs occupying workers this job could run on
+        now = time.monotonic()
+        busy = [
+            max(0.0, self._service_seconds[running.kind] - (now - running.started_at))
+            for running, on_interactive_worker in self._running.items()
+            if ticket.kind in INTERACTIVE or not on_interactive_worker
+        ]
+        # Hand the jobs ahead, in order, to whichever worker frees up first
+        free_at = sorted(busy)[:workers] + [0.0] * max(0, workers - len(busy))
+        heapq.heapify(free_at)
+        for other in ahead:
+            heapq.heappush(free_at, heapq.heappop(free_at) + self._service_seconds[other.kind])
+        return free_at[0]
+
+    def _drain_seconds(self, lane: str) -> float:
+        kind = SOLVE if lane == SOLVE else VALIDATE
+        queued = [ticket for _, _, ticket, _ in self._queue if self._lane(ticket.kind) == lane]
+        return sum(self._service_seconds[ticket.kind] for ticket in queued) / self._workers_for(kind)
+
+    def position(self, ticket: Ticket) -> int:
+        with self._condition:
+            if ticket.started_at is not None or ticket.future.done():
+                return 0
+            return len(self._ahead(ticket)) + 1
+
+    def estimated_wait(self, ticket: Ticket) -> float:
+        with self._condition:
+            return self._wait_locked(ticket)
+
+    def snapshot(self) -> dict:
+        """Queue depth, running jobs and service time estimates, for logging or an admin view."""
+        with self._condition:
+            queued = {}
+            for _, _, ticket, _ in self._queue:
+                queued[ticket.kind] = queued.get(ticket.kind, 0) + 1
+            running = {}
+            for ticket in self._running:
+                running[ticket.kind] = running.get(ticket.kind, 0) + 1
+            return {
+                "queued": queued,
+                "running": running,
+                "service_seconds": dict(self._service_seconds),
+                **self.stats,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = Scheduler(
+                    solve_workers=settings.get_int("SCHEDULER_SOLVE_WORKERS", 4),
+                    interactive_workers=settings.get_int("SCHEDULER_INTERACTIVE_WORKERS", 8),
+                    max_queued_solves=settings.get_int("SCHEDULER_MAX_QUEUED_SOLVES", 16),
+                    max_queued_interactive=settings.get_int("SCHEDULER_MAX_QUEUED_INTERACTIVE", 64),
+                    max_solve_wait=settings.get_float("SCHEDULER_MAX_SOLVE_WAIT", 180),
+                )
+                logging.debug(f"Started scheduler: {_scheduler.snapshot()}")
+    return _scheduler
@@ -0,0 +1,453 @@
+import abc
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import solution as codec
+from settings import get_settings
+from solution import MathSolution
+
+settings = get_settings()
+# e.g. sqlite:///sessions.db or redis://localhost:6379/0; unset keeps sessions in process memory only
+SESSION_STORE_URL = settings.session_store_url
+SESSION_TTL_SECONDS = settings.session_ttl_seconds
+# Decoded solution contents kept in memory, so sessions on the same solution load its blob once
+SOLUTION_CONTENT_CACHE = 256
+
+
+class MissingBlobError(ValueError):
+    """A state document refers to blobs the store no longer holds, e.g. because they expired."""
+
+    def __init__(self, digests):
+        super().__init__(f"Solution content {', '.join(digests)} is missing from the store")
+        self.digests = list(digests)
+
+
+class SessionConflict(Exception):
+    """The stored session changed since it was loaded, e.g. another worker saved it first."""
+
+
+class SessionStore(abc.ABC):
+    """
+    Interface for keeping tutoring sessions outside a single Streamlit process.
+
+    A session is a small state document (problem_state with per-step progress), an
+    append-only list of chat messages and content-addressed blobs (encoded solution content,
+    shared by every session on the same solution), so each rerun only writes what changed.
+    """
+
+    @abc.abstractmethod
+    def load_state(self, session_id: str):
+        ...
+
+    @abc.abstractmethod
+    def load_messages(self, session_id: str) -> list:
+        ...
+
+    @abc.abstractmethod
+    def save_session(self, session_id: str, state: bytes, start: int, messages: list, blobs=(),
+                     expected: bytes = None):
+        """
+        Store the state document and the chat messages at positions start, start + 1, ...,
+        dropping any after them, all or nothing.
+
+        Compare-and-set: `expected` is the sha256 digest of the state document the caller
+        loaded or last saved (None for a session it hasn't seen stored), and SessionConflict
+        is raised without writing anything when the stored one differs. `blobs` are the
+        digests the state refers to: a store that expires data keeps them at least as long
+        as the state, raising MissingBlobError, once the session is saved, for any it no
+        longer holds.
+        """
+
+    @abc.abstractmethod
+    def load_blob(self, digest: str):
+        ...
+
+    @abc.abstractmethod
+    def save_blob(self, digest: str, data: bytes):
+        ...
+
+    @abc.abstractmethod
+    def delete(self, session_id: str):
+        ...
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session store in a local SQLite file; fine for one host, or a shared volume with WAL."""
+
+    def __init__(self, path: str = "sessions.db"):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    state BLOB,
+                    updated_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    session_id TEXT,
+                    idx INTEGER,
+                    message TEXT,
+                    PRIMARY KEY (session_id, idx)
+                );
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    data BLOB
+                );
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Streamlit runs each session's script on its own thread, so keep one connection per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load_state(self, session_id: str):
+        row = self._connection().execute(
+            "SELECT state FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def load_messages(self, session_id: str) -> list:
+        rows = self._connection().execute(
+            "SELECT message FROM messages WHERE session_id = ? ORDER BY idx", (session_id,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def save_session(self, session_id: str, state: bytes, start: int, messages: list, blobs=(),
+                     expected: bytes = None):
+        # Blobs are never deleted here, so there is nothing to keep alive
+        with self._connection() as conn:
+            # Takes the write lock before reading, so no other writer can get in between
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if (hashlib.sha256(row[0]).digest() if row else None) != expected:
+                raise SessionConflict(f"Session {session_id} was changed since it was loaded")
+            conn.execute("DELETE FROM messages WHERE session_id = ? AND idx >= ?", (session_id, start))
+            conn.executemany(
+                "INSERT INTO messages (session_id, idx, message) VALUES (?, ?, ?)",
+                [(session_id, start + i, json.dumps(message)) for i, message in enumerate(messages)]
+            )
+            conn.execute(
+                "INSERT INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (session_id, state, time.time())
+            )
+
+    def load_blob(self, digest: str):
+        row = self._connection().execute("SELECT data FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        return row[0] if row else None
+
+    def save_blob(self, digest: str, data: bytes):
+        with self._connection() as conn:
+            conn.execute("INSERT OR IGNORE INTO blobs (digest, data) VALUES (?, ?)", (digest, data))
+
+    def delete(self, session_id: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Networked session store shared by every replica. Needs the optional `redis` package.
+
+    Keys expire after SESSION_TTL_SECONDS of inactivity. A solution blob is shared by
+    sessions, so every save of a state that refers to it extends its expiry as well.
+    """
+
+    def __init__(self, url: str, prefix: str = "razemath", ttl: int = SESSION_TTL_SECONDS):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("RedisSessionStore requires the redis package: pip install redis") from e
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+        self._watch_error = redis.WatchError
+
+    def _key(self, *parts) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def load_state(self, session_id: str):
+        return self.client.get(self._key("session", session_id, "state"))
+
+    def load_messages(self, session_id: str) -> list:
+        return [json.loads(m) for m in self.client.lrange(self._key("session", session_id, "messages"), 0, -1)]
+
+    def save_session(self, session_id: str, state: bytes, start: int, messages: list, blobs=(),
+                     expected: bytes = None):
+        state_key = self._key("session", session_id, "state")
+        messages_key = self._key("session", session_id, "messages")
+        blobs = list(blobs)
+        # Optimistic transaction: it doesn't run if the state changes after WATCH. Blobs are
+        # shared between sessions and touched by all their saves, so they aren't watched.
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(state_key)
+                current = pipe.get(state_key)
+                if (hashlib.sha256(current).digest() if current is not None else None) != expected:
+                    raise SessionConflict(f"Session {session_id} was changed since it was loaded")
+                pipe.multi()
+                for digest in blobs:
+                    pipe.expire(self._key("blob", digest), self.ttl)
+                if start == 0:
+                    pipe.delete(messages_key)
+                else:
+                    pipe.ltrim(messages_key, 0, start - 1)
+                if messages:
+                    pipe.rpush(messages_key, *[json.dumps(m) for m in messages])
+                pipe.expire(messages_key, self.ttl)
+                pipe.set(state_key, state, ex=self.ttl)
+                results = pipe.execute()
+            except self._watch_error as e:
+                raise SessionConflict(f"Session {session_id} was changed since it was loaded") from e
+        missing = [digest for digest, extended in zip(blobs, results) if not extended]
+        if missing:
+            raise MissingBlobError(missing)
+
+    def load_blob(self, digest: str):
+        return self.client.get(self._key("blob", digest))
+
+    def save_blob(self, digest: str, data: bytes):
+        self.client.set(self._key("blob", digest), data, ex=self.ttl, nx=True)
+
+    def delete(self, session_id: str):
+        self.client.delete(self._key("session", session_id, "state"), self._key("session", session_id, "messages"))
+
+
+def create_session_store(url: str):
+    """Build a store from a URL like sqlite:///sessions.db or redis://host:6379/0."""
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://")):
+        return RedisSessionStore(url)
+    raise ValueError(f"Unsupported session store URL: {url}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """The process-wide store configured by SESSION_STORE_URL, or None when persistence is off."""
+    global _store
+    if _store is None and SESSION_STORE_URL:
+        with _store_lock:
+            if _store is None:
+                _store = create_session_store(SESSION_STORE_URL)
+    return _store
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def encode_problem_state(problem_state: dict, store: SessionStore, saved_blobs: set = None,
+                         history: str = None, referenced: set = None) -> bytes:
+    """
+    Serialize problem_state to JSON, moving the solution content into a content-addressed blob.
+
+    Content is immutable, so it is written once per solution and only the student's progress
+    is rewritten as they work. `steps` is not stored separately, it is always
+    `solution.steps`. Digests in `saved_blobs` are known to be stored already; the ones
+    the document refers to are added to `referenced`. `history`, a digest of the chat
+    messages, is stored alongside so the document changes whenever the messages do.
+    """
+    saved_blobs = saved_blobs if saved_blobs is not None else set()
+    solution = problem_state.get("solution")
+    encoded_solution = None
+    if solution is not None:
+        content = codec.encode(solution.content)
+        digest = hashlib.sha256(content).hexdigest()
+        if digest not in saved_blobs:
+            store.save_blob(digest, content)
+            saved_blobs.add(digest)
+            _remember_content(digest, solution.content)
+        if referenced is not None:
+            referenced.add(digest)
+        encoded_solution = {
+            "content": digest,
+            "progress": base64.b64encode(codec.encode_progress(solution.progress())).decode("ascii")
+        }
+    state = {key: value for key, value in problem_state.items() if key not in ("steps", "solution", "variables")}
+    state["variables"] = sorted(problem_state.get("variables") or [])
+    state["solution"] = encoded_solution
+    if history is not None:
+        state["history"] = history
+    try:
+        return json.dumps(state, sort_keys=True).encode("utf-8")
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"problem_state can't be stored: {str(e)}") from e
+
+
+_contents = OrderedDict()
+_contents_lock = threading.Lock()
+
+
+def _remember_content(digest: str, content):
+    with _contents_lock:
+        _contents[digest] = content
+        _contents.move_to_end(digest)
+        while len(_contents) > SOLUTION_CONTENT_CACHE:
+            _contents.popitem(last=False)
+
+
+def _load_content(digest: str, store: SessionStore):
+    """A solution's content, fetched from the store and decoded only if this process doesn't hold it yet."""
+    with _contents_lock:
+        content = _contents.get(digest)
+        if content is not None:
+            _contents.move_to_end(digest)
+            return content
+    data = store.load_blob(digest)
+    if data is None:
+        raise MissingBlobError([digest])
+    content = codec.decode(data)
+    _remember_content(digest, content)
+    return content
+
+
+def decode_problem_state(data: bytes, store: SessionStore) -> dict:
+    state = json.loads(data)
+    state.pop("history", None)
+    state["variables"] = set(state.get("variables") or [])
+    encoded_solution = state.get("solution")
+    if encoded_solution is not None:
+        progress = codec.decode_progress(base64.b64decode(encoded_solution["progress"]))
+        solution = MathSolution(_load_content(encoded_solution["content"], store), progress)
+        state["solution"] = solution
+        state["steps"] = solution.steps
+    else:
+        state["steps"] = None
+    return state
+
+
+def _message_digest(index: int, message) -> bytes:
+    try:
+        return hashlib.sha256(json.dumps(message, sort_keys=True).encode("utf-8")).digest()
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Chat message {index} can't be stored: {str(e)}") from e
+
+
+class SessionPersistence:
+    """
+    Tracks what of one session has already been written, so each flush only rewrites chat
+    messages from the first one that was added or changed since, and problem_state when it
+    actually changed.
+
+    Writes are compare-and-set against the state this object last loaded or saved, so two
+    processes working on the same session can't overwrite each other's changes. The one
+    that loses sets `conflict` and writes nothing; restore() picks up the winner's version.
+    A failed flush is logged and kept in `error` until a flush succeeds; nothing is marked
+    written, so the next flush retries all of it.
+    """
+
+    def __init__(self, store: SessionStore, session_id: str):
+        self.store = store
+        self.session_id = session_id
+        self._message_digests = []
+        self._state_digest = None
+        self._saved_blobs = set()
+        self.error = None
+        self.conflict = False
+
+    def restore(self, session_state) -> bool:
+        """
+        Load the persisted session into session_state. Returns True if one existed.
+
+        Only what changed since this object last saw the session is decoded: an unchanged
+        state document (which covers the messages too, see flush) is skipped, and solution
+        content is only fetched when this process doesn't hold it already.
+        """
+        data = self.store.load_state(self.session_id)
+        self.conflict = False
+        if data is None:
+            # Nothing stored (any more), the next flush writes the session afresh
+            self._message_digests = []
+            self._state_digest = None
+            return False
+        state_digest = hashlib.sha256(data).digest()
+        if state_digest == self._state_digest:
+            return True
+        session_state.problem_state = decode_problem_state(data, self.store)
+        session_state.chat_history = self.store.load_messages(self.session_id)
+        self._message_digests = [_message_digest(i, m) for i, m in enumerate(session_state.chat_history)]
+        self._state_digest = state_digest
+        return True
+
+    def flush(self, session_state):
+        try:
+            chat_history = session_state.chat_history
+            digests = [_message_digest(i, message) for i, message in enumerate(chat_history)]
+            # The state carries a digest of the messages, so it changes whenever they do
+            history = hashlib.sha256(b"".join(digests)).hexdigest()
+            referenced = set()
+            data = encode_problem_state(session_state.problem_state, self.store, self._saved_blobs, history, referenced)
+            digest = hashlib.sha256(data).digest()
+            if digest != self._state_digest:
+                # Rewrite from the first message that's new or was changed in place
+                start = next((i for i, (new, old) in enumerate(zip(digests, self._message_digests)) if new != old),
+                             min(len(digests), len(self._message_digests)))
+                try:
+                    self.store.save_session(self.session_id, data, start, chat_history[start:], referenced,
+                                            self._state_digest)
+                except MissingBlobError as e:
+                    # The session is saved, but expired content it refers to must be written again
+                    self._saved_blobs.difference_update(e.digests)
+                    encode_problem_state(session_state.problem_state, self.store, self._saved_blobs, history)
+                self._state_digest = digest
+                self._message_digests = digests
+            self.error = None
+        except SessionConflict as e:
+            logging.warning(f"Not saving session {self.session_id}: {str(e)}")
+            self.error = str(e)
+            self.conflict = True
+        except Exception as e:
+            # Persistence must never break the tutoring flow, but it mustn't stop unnoticed either
+            logging.exception(f"Error persisting session {self.session_id}")
+            self.error = str(e)
+
+
+def restore_session(session_state, query_params):
+    """
+    Attach persistence to this browser session, restoring it from the store on reconnect.
+
+    The session id lives in the `sid` query parameter so a reload, a restarted replica or a
+    different replica behind the load balancer finds the same session. A new session has
+    nothing to restore and doesn't touch the store until its first flush.
+    """
+    store = get_session_store()
+    if store is None:
+        return None
+    if "persistence" in session_state:
+        persistence = session_state.persistence
+        if persistence.conflict:
+            # Another tab saved the session first: carry on from its version
+            persistence.restore(session_state)
+        return persistence
+
+    session_id = query_params.get("sid")
+    persistence = SessionPersistence(store, session_id or new_session_id())
+    if not session_id:
+        query_params["sid"] = persistence.session_id
+    else:
+        try:
+            if persistence.restore(session_state):
+                logging.debug(f"Restored session {session_id} with {len(session_state.chat_history)} messages")
+        except Exception as e:
+            logging.error(f"Error restoring session {session_id}: {str(e)}")
+    session_state.persistence = persistence
+    return persistence
@@ -0,0 +1,141 @@
+import os
+import threading
+
+
+class Settings:
+    """
+    Every configuration value the app reads, parsed once per process.
+
+    `.env` is loaded on first use (existing environment variables win), so importing a
+    module no longer costs a dotenv parse and every module sees the same values.
+    """
+
+    def __init__(self, environ):
+        self._environ = dict(environ)
+        get = self._environ.get
+
+        # API credentials and endpoints
+        self.openai_api_key = get("OPENAI_API_KEY")
+        self.deepseek_api_key = get("DEEPSEEK_API_KEY")
+        self.openrouter_api_key = get("OPENROUTER_API_KEY")
+        self.openrouter_base_url = get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+        self.wolfram_app_id = get("WOLFRAM_APP_ID")
+        self.wolfram_base_url = get("WOLFRAM_BASE_URL", "http://api.wolframalpha.com/v2/query")
+        self.sheets_emulator_host = get("SHEETS_EMULATOR_HOST")  # e.g. http://127.0.0.1:8003 for local stand-ins
+
+        # Model for answer checking, defaults to the validate_answer template's; see benchmarks/validator_eval.py
+        self.validate_model = get("VALIDATE_MODEL")
+        # Cascaded validation: the fast model's verdict is kept at or above this confidence
+        self.validate_fast_model = get("VALIDATE_FAST_MODEL", "gpt-4o-mini")
+        self.validate_confidence_threshold = self.get_float("VALIDATE_CONFIDENCE_THRESHOLD", 0.85)
+
+        # Solve pipeline budget, see MathSolver.get_math_solution
+        self.solve_budget_seconds = self.get_float("SOLVE_BUDGET_SECONDS", 120)
+        self.structure_reserve_seconds = self.get_float("STRUCTURE_RESERVE_SECONDS", 45)
+        self.graph_min_seconds = self.get_float("GRAPH_MIN_SECONDS", 2)
+        # Opt-in fetching of graphs while the structuring call streams, see graph.GraphPool;
+        # GRAPH_SPECULATIVE_LIMIT plots guessed from the reasoning start even earlier (0 waits for
+        # the steps' own queries)
+        self.graph_pipeline = get("GRAPH_PIPELINE", "0") == "1"
+        self.graph_workers = self.get_int("GRAPH_WORKERS", 4)
+        self.graph_speculative_limit = self.get_int("GRAPH_SPECULATIVE_LIMIT", 2)
+
+        # Custom hint cache, see hints.HintCache
+        self.hint_cache_threshold = self.get_float("HINT_CACHE_THRESHOLD", 0.75)
+        self.hint_cache_max_steps = self.get_int("HINT_CACHE_MAX_STEPS", 2048)
+        self.hint_cache_max_per_step = self.get_int("HINT_CACHE_MAX_PER_STEP", 64)
+
+        # Answers learned from LLM validation, see answers.AnswerCache
+        self.answer_cache_max_steps = self.get_int("ANSWER_CACHE_MAX_STEPS", 4096)
+        self.answer_cache_max_per_step = self.get_int("ANSWER_CACHE_MAX_PER_STEP", 32)
+
+        # Wolfram equivalence checks for symbolic answers before the LLM, see equivalence.EquivalenceOracle;
+        # verdicts are cached in the SQLite file at EQUIVALENCE_CACHE_PATH (empty keeps them in memory)
+        self.equivalence_oracle = get("EQUIVALENCE_ORACLE", "0") == "1"
+        self.equivalence_cache_path = get("EQUIVALENCE_CACHE_PATH", "equivalence.db")
+        self.equivalence_timeout = self.get_float("EQUIVALENCE_TIMEOUT", 5)
+
+        # Reuse of solutions for problems that differ only in their constants, see templates.ProblemTemplateIndex
+        self.template_reuse = get("TEMPLATE_REUSE", "0") == "1"
+        self.template_index_max_shapes = self.get_int("TEMPLATE_INDEX_MAX_SHAPES", 4096)
+
+        # Shared rate limits per provider, see ratelimit.RateGovernor; 0 means no limit. Buckets are
+        # shared by the processes on a host through files in RATE_LIMIT_DIR, unset keeps them per process
+        self.rate_limit_dir = get("RATE_LIMIT_DIR")
+        self.rate_limit_max_wait = self.get_float("RATE_LIMIT_MAX_WAIT", 5)
+        self.rate_limits = {
+            "openai": (self.get_float("RATE_LIMIT_OPENAI_RPM", 500), self.get_float("RATE_LIMIT_OPENAI_TPM", 150000)),
+            "openrouter": (self.get_float("RATE_LIMIT_OPENROUTER_RPM", 200), self.get_float("RATE_LIMIT_OPENROUTER_TPM", 0)),
+            "wolfram": (self.get_float("RATE_LIMIT_WOLFRAM_RPM", 60), 0),
+        }
+
+        # Session persistence; unset keeps sessions in process memory only
+        self.session_store_url = get("SESSION_STORE_URL")
+        self.session_ttl_seconds = self.get_int("SESSION_TTL_SECONDS", 7 * 24 * 3600)
+
+        # Per-session memory accounting, see memory.MemoryMonitor; 0 seconds turns it off
+        self.memory_sample_seconds = self.get_float("MEMORY_SAMPLE_SECONDS", 60)
+        self.memory_tracemalloc_frames = self.get_int("MEMORY_TRACEMALLOC_FRAMES", 0)
+        self.memory_report_top = self.get_int("MEMORY_REPORT_TOP", 10)
+        # Opt-in timing of each script run, see profiler.RenderProfiler; capture is off, cprofile or sample
+        self.render_profile = get("RENDER_PROFILE", "0") == "1"
+        self.render_profile_capture = get("RENDER_PROFILE_CAPTURE", "off")
+        self.render_profile_slow_ms = self.get_float("RENDER_PROFILE_SLOW_MS", 500)
+        self.render_profile_keep = self.get_int("RENDER_PROFILE_KEEP", 5)
+        # Opens the admin panel with ?admin=<token>; unset hides it
+        self.admin_token = get("ADMIN_TOKEN")
+
+        # Record/replay of outbound HTTP, see cassette.py
+        self.cassette_mode = get("CASSETTE_MODE", "off")
+        self.cassette_path = get("CASSETTE_PATH", "cassettes/session.cassette")
+        self.cassette_realtime = get("CASSETTE_REALTIME", "0") == "1"
+
+    def get(self, name: str, default: str = None) -> str:
+        return self._environ.get(name, default)
+
+    def get_int(self, name: str, default: int) -> int:
+        value = self._environ.get(name)
+        return int(value) if value not in (None, "") else default
+
+    def get_float(self, name: str, default: float) -> float:
+        value = self._environ.get(name)
+        return float(value) if value not in (None, "") else default
+
+    def google_service_account_info(self) -> dict:
+        private_key = self.get("GOOGLE_PRIVATE_KEY")
+        return {
+            "type": "service_account",
+            "project_id": self.get("GOOGLE_PROJECT_ID"),
+            "private_key_id": self.get("GOOGLE_PRIVATE_KEY_ID"),
+            "private_key": private_key.replace('\\n', '\n') if private_key else None,
+            "client_email": self.get("GOOGLE_CLIENT_EMAIL"),
+            "client_id": self.get("GOOGLE_CLIENT_ID"),
+            "auth_uri": self.get("GOOGLE_AUTH_URI"),
+            "token_uri": self.get("GOOGLE_TOKEN_URI"),
+            "auth_provider_x509_cert_url": self.get("GOOGLE_AUTH_PROVIDER_CERT_URL"),
+            "client_x509_cert_url": self.get("GOOGLE_CLIENT_CERT_URL")
+        }
+
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def get_settings() -> Settings:
+    """The process-wide settings, loading .env and reading the environment on first call."""
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                from dotenv import load_dotenv
+                load_dotenv()
+                _settings = Settings(os.environ)
+    return _settings
+
+
+def reload_settings() -> Settings:
+    """Re-read the environment, e.g. after a benchmark points the app at local stand-ins."""
+    global _settings
+    with _settings_lock:
+        _settings = None
+    return get_settings()
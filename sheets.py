@@ -1,42 +1,98 @@
-import os
+import json
+import logging
+import threading
 from datetime import datetime
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from dotenv import load_dotenv
-# Load environment variables from .env file
-load_dotenv()
+from functools import lru_cache
+from resilience import SHEETS
+from settings import get_settings
+
+settings = get_settings()
+SHEETS_EMULATOR_HOST = settings.sheets_emulator_host  # e.g. http://127.0.0.1:8003 for local stand-ins
+# googleapiclient, google-auth and httplib2 are only imported when the first row is logged
+_local = threading.local()
+
+@lru_cache(maxsize=None)
+def _discovery_document() -> dict:
+    # The Sheets v4 discovery document ships with googleapiclient; parse it once per process
+    # instead of on every build()
+    from googleapiclient.discovery_cache import get_static_doc
+    return json.loads(get_static_doc('sheets', 'v4'))
+
+def _get_service():
+    """
+    The Sheets service for this thread, built on first use.
+
+    httplib2 connections are not thread-safe, so each Streamlit script thread keeps its own
+    service; it is rebuilt only if the active cassette changes.
+    """
+    from cassette import get_cassette
+    recording = get_cassette()
+    cached = getattr(_local, "service", None)
+    if cached is None or cached[0] is not recording:
+        _local.service = cached = (recording, _build_service(recording))
+    return cached[1]
+
+def _build_service(recording=None):
+    from google.auth.credentials import AnonymousCredentials
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build_from_document
+    import httplib2
+    from cassette import httplib2_http
+
+    client_options = {"api_endpoint": SHEETS_EMULATOR_HOST} if SHEETS_EMULATOR_HOST else None
+    if SHEETS_EMULATOR_HOST or (recording and recording.replaying):
+        # Local stand-in server or replayed cassette: no Google auth needed
+        credentials = AnonymousCredentials()
+    else:
+        credentials = _service_account_credentials()
+    # googleapiclient takes either http or credentials, so authorize our own http (with its timeout and
+    # the cassette, if one is active) ourselves
+    http = httplib2_http(httplib2.Http(timeout=SHEETS.timeout))
+    return build_from_document(_discovery_document(), http=AuthorizedHttp(credentials, http=http),
+                               client_options=client_options)
+
+@lru_cache(maxsize=None)
+def _service_account_credentials():
+    from google.oauth2.service_account import Credentials
+    # Load credentials from environment variables
+    return Credentials.from_service_account_info(settings.google_service_account_info())
+
 def append_data_to_sheet(problem: str):
-# Load credentials from environment variables
-    credentials = Credentials.from_service_account_info({
-        "type": "service_account",
-        "project_id": os.getenv("GOOGLE_PROJECT_ID"),
-        "private_key_id": os.getenv("GOOGLE_PRIVATE_KEY_ID"),
-        "private_key": os.getenv("GOOGLE_PRIVATE_KEY").replace('\\n', '\n'),
-        "client_email": os.getenv("GOOGLE_CLIENT_EMAIL"),
-        "client_id": os.getenv("GOOGLE_CLIENT_ID"),
-        "auth_uri": os.getenv("GOOGLE_AUTH_URI"),
-        "token_uri": os.getenv("GOOGLE_TOKEN_URI"),
-        "auth_provider_x509_cert_url": os.getenv("GOOGLE_AUTH_PROVIDER_CERT_URL"),
-        "client_x509_cert_url": os.getenv("GOOGLE_CLIENT_CERT_URL")
-    })
+    """
+    Log one row to the tracking sheet. Logging is best effort: failures, including an open
+    Sheets circuit, are logged and dropped so they never hold up the tutoring flow.
+    """
+    append_rows_to_sheet([problem])
+
+def append_rows_to_sheet(rows: list):
+    """Log several rows with one request, e.g. everything one student action produced. Best effort too."""
+    if not rows:
+        return
+    try:
+        _append_rows(rows)
+    except Exception as e:
+        logging.error(f"Error appending data to sheet: {str(e)}")
+
+def _append_rows(rows: list):
         # The ID of the spreadsheet
     SPREADSHEET_ID = '1L_Uhxz3zNBtyCGsvMIcRI-X8OmRmXXKxb905Yrq5z4Y'
     RANGE_NAME = 'Sheet1!A:B'  # Access every row in columns A and B
-        # Build the service
-    service = build('sheets', 'v4', credentials=credentials)
+        # Built once per thread, see _get_service
+    service = _get_service()
         # Get the current date and time
     current_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         # Prepare the values to append
     values = [
-        [current_datetime, problem]
+        [current_datetime, row] for row in rows
     ]
     body = {
         'values': values
     }
         # Append the values to the sheet
-    result = service.spreadsheets().values().append(
+    request = service.spreadsheets().values().append(
         spreadsheetId=SPREADSHEET_ID, range=RANGE_NAME,
         valueInputOption="RAW", body=body,
-        insertDataOption="INSERT_ROWS").execute()
-    print(f"{result.get('updates').get('updatedCells')} cells updated.")
+        insertDataOption="INSERT_ROWS")
+    result = SHEETS.call(request.execute)
+    logging.debug(f"{(result.get('updates') or {}).get('updatedCells')} cells updated.")
 
@@ -0,0 +1,395 @@
+import hashlib
+import json
+import struct
+from typing import Dict, List
+
+from answers import normalize_answer
+
+# Bump when the binary layout changes; decode() keeps reading every older version
+SCHEMA_VERSION = 3
+MAGIC = b"RZMS"
+
+_HEADER = struct.Struct(">4sB")
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_PROGRESS = struct.Struct(">HHB")
+
+
+class StepContent:
+    """
+    The immutable part of a solution step, as produced by the structuring call.
+
+    Instances are read-only, so one can be shared by every student working the same problem.
+    """
+    __slots__ = ("instruction", "question", "answer", "explanation", "graph_query", "graph_image", "hints",
+                 "accepted_answers")
+
+    def __init__(self, instruction: str, question: str, answer: str, explanation: str,
+                 graph_query: str = None, graph_image: bytes = None, hints=(), accepted_answers=()):
+        setter = object.__setattr__
+        setter(self, "instruction", instruction)
+        setter(self, "question", question)
+        setter(self, "answer", answer)
+        setter(self, "explanation", explanation)
+        setter(self, "graph_query", graph_query)
+        setter(self, "graph_image", graph_image)
+        # Tiered hints from the structuring call, weakest first
+        setter(self, "hints", tuple(hints))
+        # Normalized forms of the answer and its equivalent spellings, see answers.normalize_answer
+        setter(self, "accepted_answers", frozenset(
+            normalize_answer(variant) for variant in (answer, *accepted_answers) if variant.strip()
+        ))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"StepContent is immutable, cannot set {name}")
+
+    def __eq__(self, other):
+        return isinstance(other, StepContent) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, name) for name in self.__slots__))
+
+    def __reduce__(self):
+        return (StepContent, tuple(getattr(self, name) for name in self.__slots__))
+
+    def __repr__(self):
+        return f"StepContent(question={self.question!r}, answer={self.answer!r})"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StepContent":
+        try:
+            return cls(
+                instruction=str(data["instruction"]),
+                question=str(data["question"]),
+                answer=str(data["answer"]),
+                explanation=str(data["explanation"]),
+                graph_query=str(data["graph_query"]) if data.get("graph_query") is not None else None,
+                graph_image=data.get("graph_image"),
+                hints=tuple(str(hint) for hint in data.get("hints") or ()),
+                accepted_answers=tuple(str(variant) for variant in data.get("accepted_answers") or ()),
+            )
+        except KeyError as e:
+            raise ValueError(f"Solution step is missing field {e}") from None
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SolutionContent:
+    """The immutable, shareable content of a structured solution."""
+    __slots__ = ("steps", "final_answer", "original_problem")
+
+    def __init__(self, steps, final_answer: str, original_problem: str):
+        setter = object.__setattr__
+        setter(self, "steps", tuple(steps))
+        setter(self, "final_answer", final_answer)
+        setter(self, "original_problem", original_problem)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"SolutionContent is immutable, cannot set {name}")
+
+    def __eq__(self, other):
+        return isinstance(other, SolutionContent) and (
+            self.steps, self.final_answer, self.original_problem
+        ) == (other.steps, other.final_answer, other.original_problem)
+
+    def __hash__(self):
+        return hash((self.steps, self.final_answer, self.original_problem))
+
+    def __reduce__(self):
+        return (SolutionContent, (self.steps, self.final_answer, self.original_problem))
+
+    def __repr__(self):
+        return f"SolutionContent(original_problem={self.original_problem!r}, steps={len(self.steps)})"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SolutionContent":
+        try:
+            return cls(
+                steps=[StepContent.from_dict(step) for step in data["steps"]],
+                final_answer=str(data["final_answer"]),
+                original_problem=str(data["original_problem"]),
+            )
+        except KeyError as e:
+            raise ValueError(f"Solution is missing field {e}") from None
+
+    def to_dict(self) -> dict:
+        return {
+            "steps": [step.to_dict() for step in self.steps],
+            "final_answer": self.final_answer,
+            "original_problem": self.original_problem,
+        }
+
+    def digest(self) -> str:
+        """Stable content hash, usable as a cache or storage key."""
+        return hashlib.sha256(encode(self)).hexdigest()
+
+
+class StepProgress:
+    """One student's mutable progress on one step."""
+    __slots__ = ("hint_count", "attempt_count", "user_attempts", "user_correct")
+
+    def __init__(self, hint_count: int = 0, attempt_count: int = 0,
+                 user_attempts: List[Dict] = None, user_correct: bool = False):
+        self.hint_count = hint_count
+        self.attempt_count = attempt_count
+        self.user_attempts = user_attempts if user_attempts is not None else []
+        self.user_correct = user_correct
+
+    def copy(self) -> "StepProgress":
+        return StepProgress(self.hint_count, self.attempt_count, [dict(a) for a in self.user_attempts], self.user_correct)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _content_property(name):
+    return property(lambda self: getattr(self.content, name), doc=f"StepContent.{name} (read-only)")
+
+
+def _progress_property(name):
+    def fset(self, value):
+        setattr(self.progress, name, value)
+    return property(lambda self: getattr(self.progress, name), fset, doc=f"StepProgress.{name}")
+
+
+class Step:
+    """A student's view of a step: shared StepContent plus their own StepProgress."""
+    __slots__ = ("content", "progress")
+
+    instruction = _content_property("instruction")
+    question = _content_property("question")
+    answer = _content_property("answer")
+    explanation = _content_property("explanation")
+    graph_query = _content_property("graph_query")
+    graph_image = _content_property("graph_image")
+    hints = _content_property("hints")
+    accepted_answers = _content_property("accepted_answers")
+
+    hint_count = _progress_property("hint_count")
+    attempt_count = _progress_property("attempt_count")
+    user_attempts = _progress_property("user_attempts")
+    user_correct = _progress_property("user_correct")
+
+    def __init__(self, content: StepContent, progress: StepProgress = None):
+        self.content = content
+        self.progress = progress or StepProgress()
+
+    def __repr__(self):
+        return f"Step(question={self.question!r}, attempt_count={self.attempt_count}, user_correct={self.user_correct})"
+
+
+class MathSolution:
+    """
+    A student's view of a solution: shared SolutionContent plus per-step progress.
+
+    `dropped` names the optional work skipped to stay within the solve budget, e.g.
+    ("reasoning", "graph:2"); it describes how this solution was built and is not persisted.
+    """
+    __slots__ = ("content", "steps", "dropped")
+
+    def __init__(self, content: SolutionContent, progress: List[StepProgress] = None, dropped=()):
+        if progress is not None and len(progress) != len(content.steps):
+            raise ValueError("Progress does not match the number of solution steps")
+        self.content = content
+        self.dropped = tuple(dropped)
+        self.steps = [
+            Step(step, progress[i] if progress is not None else StepProgress())
+            for i, step in enumerate(content.steps)
+        ]
+
+    @property
+    def final_answer(self) -> str:
+        return self.content.final_answer
+
+    @property
+    def original_problem(self) -> str:
+        return self.content.original_problem
+
+    @classmethod
+    def from_dict(cls, data: dict, dropped=()) -> "MathSolution":
+        """Build a fresh solution from the structuring call's (json.loads'd) arguments."""
+        return cls(SolutionContent.from_dict(data), dropped=dropped)
+
+    def copy(self) -> "MathSolution":
+        """A new solution sharing this content, with an independent copy of the progress."""
+        return MathSolution(self.content, [step.progress.copy() for step in self.steps], self.dropped)
+
+    def fresh(self) -> "MathSolution":
+        """A new solution sharing this content, with no progress."""
+        return MathSolution(self.content, dropped=self.dropped)
+
+    def progress(self) -> List[StepProgress]:
+        return [step.progress for step in self.steps]
+
+    def __repr__(self):
+        return f"MathSolution(original_problem={self.original_problem!r}, steps={len(self.steps)})"
+
+
+# Binary codec
+#
+# Layout (big-endian), version 3:
+#   magic "RZMS" | u8 version | str original_problem | str final_answer | u16 step count |
+#   per step: str instruction | str question | str answer | str explanation |
+#             optional str graph_query | optional bytes graph_image | u8 hint count | str hint... |
+#             u8 accepted answer count | str accepted answer...
+# where str/bytes are u32 length + data and optional adds a leading u8 presence flag.
+# Version 2 is the same without the accepted answers, version 1 also without the hints;
+# both accept just the step's own answer when decoded.
+
+def _pack_bytes(out: list, data: bytes):
+    out.append(_U32.pack(len(data)))
+    out.append(data)
+
+
+def _pack_str(out: list, text: str):
+    _pack_bytes(out, text.encode("utf-8"))
+
+
+def _pack_optional(out: list, data: bytes):
+    if data is None:
+        out.append(b"\x00")
+    else:
+        out.append(b"\x01")
+        _pack_bytes(out, data)
+
+
+def _pack_count(out: list, fmt: struct.Struct, items, what: str):
+    limit = 256 ** fmt.size - 1
+    if len(items) > limit:
+        raise ValueError(f"Cannot encode {len(items)} {what}, the schema allows at most {limit}")
+    out.append(fmt.pack(len(items)))
+
+
+def encode(content: SolutionContent, include_images: bool = True) -> bytes:
+    """
+    Serialize solution content; drop graph images with include_images=False. Raises
+    ValueError for more steps, hints or accepted answers than the layout can count.
+    """
+    out = [_HEADER.pack(MAGIC, SCHEMA_VERSION)]
+    _pack_str(out, content.original_problem)
+    _pack_str(out, content.final_answer)
+    _pack_count(out, _U16, content.steps, "steps")
+    for step in content.steps:
+        _pack_str(out, step.instruction)
+        _pack_str(out, step.question)
+        _pack_str(out, step.answer)
+        _pack_str(out, step.explanation)
+        _pack_optional(out, step.graph_query.encode("utf-8") if step.graph_query is not None else None)
+        _pack_optional(out, step.graph_image if include_images else None)
+        _pack_count(out, _U8, step.hints, "hints")
+        for hint in step.hints:
+            _pack_str(out, hint)
+        _pack_count(out, _U8, step.accepted_answers, "accepted answers")
+        for variant in sorted(step.accepted_answers):
+            _pack_str(out, variant)
+    return b"".join(out)
+
+
+class _Reader:
+    __slots__ = ("view", "pos")
+
+    def __init__(self, data: bytes):
+        self.view = memoryview(data)
+        self.pos = 0
+
+    def unpack(self, fmt: struct.Struct):
+        values = fmt.unpack_from(self.view, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def read_bytes(self) -> bytes:
+        (length,) = self.unpack(_U32)
+        data = self.view[self.pos:self.pos + length].tobytes()
+        if len(data) != length:
+            raise ValueError("Truncated solution data")
+        self.pos += length
+        return data
+
+    def read_str(self) -> str:
+        return self.read_bytes().decode("utf-8")
+
+    def read_optional(self):
+        flag = self.view[self.pos]
+        self.pos += 1
+        return self.read_bytes() if flag else None
+
+
+def _decode_steps(reader: _Reader, with_hints: bool, with_accepted: bool = False) -> SolutionContent:
+    original_problem = reader.read_str()
+    final_answer = reader.read_str()
+    (count,) = reader.unpack(_U16)
+    steps = []
+    for _ in range(count):
+        instruction, question, answer, explanation = reader.read_str(), reader.read_str(), reader.read_str(), reader.read_str()
+        graph_query = reader.read_optional()
+        graph_image = reader.read_optional()
+        hints = ()
+        if with_hints:
+            (hint_count,) = reader.unpack(_U8)
+            hints = tuple(reader.read_str() for _ in range(hint_count))
+        accepted_answers = ()
+        if with_accepted:
+            (accepted_count,) = reader.unpack(_U8)
+            accepted_answers = tuple(reader.read_str() for _ in range(accepted_count))
+        steps.append(StepContent(instruction, question, answer, explanation,
+                                 graph_query.decode("utf-8") if graph_query is not None else None,
+                                 graph_image, hints, accepted_answers))
+    return SolutionContent(steps, final_answer, original_problem)
+
+
+def _decode_v1(reader: _Reader) -> SolutionContent:
+    return _decode_steps(reader, with_hints=False)
+
+
+def _decode_v2(reader: _Reader) -> SolutionContent:
+    return _decode_steps(reader, with_hints=True)
+
+
+def _decode_v3(reader: _Reader) -> SolutionContent:
+    return _decode_steps(reader, with_hints=True, with_accepted=True)
+
+
+_DECODERS = {1: _decode_v1, 2: _decode_v2, 3: _decode_v3}
+
+
+def decode(data: bytes) -> SolutionContent:
+    """Deserialize solution content written by any supported schema version."""
+    try:
+        reader = _Reader(data)
+        magic, version = reader.unpack(_HEADER)
+        if magic != MAGIC:
+            raise ValueError("Not an encoded solution")
+        decoder = _DECODERS.get(version)
+        if decoder is None:
+            raise ValueError(f"Unsupported solution schema version {version}")
+        return decoder(reader)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"Corrupt solution data: {str(e)}") from None
+
+
+def encode_progress(progress: List[StepProgress]) -> bytes:
+    """Serialize one student's progress: fixed-size counters plus their attempts as JSON."""
+    out = [_U16.pack(len(progress))]
+    for step in progress:
+        out.append(_PROGRESS.pack(step.hint_count, step.attempt_count, int(step.user_correct)))
+        _pack_str(out, json.dumps(step.user_attempts, separators=(",", ":")) if step.user_attempts else "")
+    return b"".join(out)
+
+
+def decode_progress(data: bytes) -> List[StepProgress]:
+    try:
+        reader = _Reader(data)
+        (count,) = reader.unpack(_U16)
+        progress = []
+        for _ in range(count):
+            hint_count, attempt_count, user_correct = reader.unpack(_PROGRESS)
+            attempts = reader.read_str()
+            progress.append(StepProgress(hint_count, attempt_count, json.loads(attempts) if attempts else [],
+                                         bool(user_correct)))
+        return progress
+    except (struct.error, IndexError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Corrupt progress data: {str(e)}") from None
@@ -0,0 +1,421 @@
+import logging
+import random
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from fractions import Fraction
+
+from settings import get_settings
+
+settings = get_settings()
+TEMPLATE_REUSE = settings.template_reuse
+TEMPLATE_INDEX_MAX_SHAPES = settings.template_index_max_shapes
+
+# Problems with more constants than this aren't templated, the expression search grows too fast
+MAX_CONSTANTS = 6
+# A shape whose solutions contradict each other this many times is not tried again
+MAX_REJECTIONS = 2
+# Solutions of a shape that must agree before its skeleton is served: all but the last
+# induce the answer expressions, the last is held back to check them
+MIN_SAMPLES = 3
+
+# A number that isn't part of a name (x2, \log10), a subscript or an exponent, which stays part of the shape
+_NUMBER = re.compile(r"(?<![\w.\\^])(?<![_^]\{)\d+(?:\.\d+)?")
+_OPERATOR_SPACE = re.compile(r"\s*([^\w\s])\s*")
+_OPS = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a / b,
+}
+# Constants substituted when telling apart expressions that agree on the problem's own constants
+_PROBES = 3
+
+
+class _Unsafe(Exception):
+    """A number in the solution can't be tied to the problem's constants with confidence."""
+
+
+def canonicalize(problem: str):
+    """
+    The problem's shape, with every constant replaced by #, and its constants in order:
+    "Solve for x: 2x + 5 = 13" -> ("solve for x:#x+#=#", [2, 5, 13]). Exponents are kept
+    in the shape since changing one changes the method, not just the numbers.
+    """
+    text = _OPERATOR_SPACE.sub(r"\1", problem.replace("$", "").strip().lower())
+    text = re.sub(r"\s+", " ", text)
+    constants = [Fraction(match.group()) for match in _NUMBER.finditer(text)]
+    return _NUMBER.sub("#", text), constants
+
+
+def _evaluate(expression, constants):
+    kind = expression[0]
+    if kind == "c":
+        return constants[expression[1]]
+    if kind == "n":
+        return expression[1]
+    op, left, right = expression
+    return _OPS[op](_evaluate(left, constants), _evaluate(right, constants))
+
+
+def _format(expression) -> str:
+    kind = expression[0]
+    if kind == "c":
+        return f"c{expression[1]}"
+    if kind == "n":
+        return str(expression[1])
+    op, left, right = expression
+    return f"({_format(left)} {op} {_format(right)})"
+
+
+@lru_cache(maxsize=MAX_CONSTANTS)
+def _functions(count: int) -> tuple:
+    """
+    Every function of `count` constants with up to two arithmetic operations, e.g.
+    (c2 - c1) / c0, as (signature, expression) pairs. The signature is the function's values
+    on random probe constants, so two expressions with the same signature are taken to be
+    the same function and only the shorter one is kept.
+    """
+    rng = random.Random(count)
+    probes = [[Fraction(rng.randint(11, 997)) for _ in range(count)] for _ in range(_PROBES)]
+    leaves = [("c", i) for i in range(count)]
+    pairs = [(op, a, b) for a in leaves for b in leaves for op in _OPS]
+    triples = [(op, a, b) for a in pairs for b in leaves for op in _OPS]
+    triples += [(op, a, b) for a in leaves for b in pairs for op in _OPS]
+    functions = {}
+    for expression in leaves + pairs + triples:
+        try:
+            signature = tuple(_evaluate(expression, probe) for probe in probes)
+        except ZeroDivisionError:
+            continue
+        functions.setdefault(signature, expression)
+    return tuple(functions.items())
+
+
+def _signature(expression, count: int) -> tuple:
+    if expression[0] == "n":
+        return (expression[1],) * _PROBES
+    return next(signature for signature, candidate in _functions(count) if candidate == expression)
+
+
+def _candidates(constants: list, value: Fraction) -> dict:
+    """Every function of the constants that takes this value, plus the value itself as a literal."""
+    candidates = {(value,) * _PROBES: ("n", value)}
+    for signature, expression in _functions(len(constants)):
+        try:
+            if _evaluate(expression, constants) == value:
+                candidates.setdefault(signature, expression)
+        except ZeroDivisionError:
+            continue
+    return candidates
+
+
+def _answer_slots(solution: dict) -> list:
+    """Each step answer and the final answer as (shape, numbers), e.g. ("x=#", [4])."""
+    answers = [str(step["answer"]) for step in solution["steps"]] + [str(solution["final_answer"])]
+    return [(_NUMBER.sub("#", re.sub(r"\s+", "", answer)), [Fraction(n) for n in _NUMBER.findall(answer)])
+            for answer in answers]
+
+
+def _places(literal: str) -> int:
+    return len(literal.split(".")[1]) if "." in literal else 0
+
+
+def _placeholder(expression, literal: str):
+    value = Fraction(literal)
+    if expression[0] == "n":
+        return literal
+    if value <= 0:
+        raise _Unsafe(f"{literal} is not positive")
+    return expression, _places(literal)
+
+
+class _Quantities:
+    """The problem's constants and the solution's answers, by value, for placing the numbers in its text."""
+
+    def __init__(self, constants: list, answers: list):
+        count = len(constants)
+        self._by_value = {}
+        for expression in [("c", i) for i in range(count)] + answers:
+            self._by_value.setdefault(_evaluate(expression, constants), {}).setdefault(
+                _signature(expression, count), expression)
+
+    def find(self, value: Fraction):
+        """The quantity with this value, None if there is none, raising _Unsafe if several differ."""
+        found = self._by_value.get(value, {})
+        if len(found) > 1:
+            raise _Unsafe(f"{value} is ambiguous: {', '.join(_format(e) for e in found.values())}")
+        return next(iter(found.values()), None)
+
+
+def _compile_text(text: str, quantities: _Quantities, all_math: bool) -> tuple:
+    """
+    Split text into literal strings and (expression, decimal places) placeholders. Numbers
+    are only substituted inside math ($...$, or all of an answer or graph query): one that
+    is a constant or an answer becomes a placeholder, 0 and 1 stay as they are, and any
+    other number in math, or a constant or answer outside math, makes the text unsafe.
+    """
+    parts = []
+    segments = [text] if all_math else text.split("$")
+    for index, segment in enumerate(segments):
+        if index > 0:
+            parts.append("$")
+        in_math = all_math or index % 2 == 1
+        position = 0
+        for match in _NUMBER.finditer(segment):
+            value = Fraction(match.group())
+            expression = quantities.find(value)
+            if expression is None or expression[0] == "n":
+                if in_math and value not in (0, 1) and expression is None:
+                    raise _Unsafe(f"{match.group()} in {text!r} doesn't follow from the problem")
+                continue
+            if not in_math:
+                raise _Unsafe(f"{match.group()} outside math in {text!r} follows from the problem")
+            parts.append(segment[position:match.start()])
+            parts.append(_placeholder(expression, match.group()))
+            position = match.end()
+        parts.append(segment[position:])
+    return tuple(part for part in parts if part != "")
+
+
+def _compile_answer(text: str, expressions: list) -> tuple:
+    """An answer with its numbers, in order, replaced by the expressions resolved for them."""
+    parts = []
+    position = 0
+    for match, expression in zip(_NUMBER.finditer(text), expressions):
+        parts.append(text[position:match.start()])
+        parts.append(_placeholder(expression, match.group()))
+        position = match.end()
+    parts.append(text[position:])
+    return tuple(part for part in parts if part != "")
+
+
+def _render_text(parts: tuple, constants: list) -> str:
+    """The text with each placeholder evaluated for the new constants; ValueError if one doesn't fit."""
+    out = []
+    for part in parts:
+        if isinstance(part, str):
+            out.append(part)
+            continue
+        expression, places = part
+        try:
+            value = _evaluate(expression, constants)
+        except ZeroDivisionError:
+            raise ValueError(f"{_format(expression)} divides by zero")
+        scaled = value * 10 ** places
+        # Written the same way as in the original: positive, with as many decimal places
+        if value <= 0 or scaled.denominator != 1:
+            raise ValueError(f"{_format(expression)} = {value} doesn't fit {places} decimal places")
+        digits = str(scaled.numerator).rjust(places + 1, "0")
+        out.append(f"{digits[:-places]}.{digits[-places:]}" if places else digits)
+    return "".join(out)
+
+
+# Prose fields, with math between $ delimiters
+_STEP_TEXT = ("instruction", "question", "explanation")
+
+
+class Skeleton:
+    """A structured solution with its numbers replaced by expressions of the problem's constants."""
+
+    def __init__(self, solution: dict, constants: list, answers: list):
+        """`answers` holds the resolved expression for each number of each step answer, then the final answer's."""
+        self.constants = tuple(constants)
+        quantities = _Quantities(constants, [expression for slot in answers for expression in slot])
+        self.steps = []
+        for step, expressions in zip(solution["steps"], answers):
+            compiled = {"answer": _compile_answer(str(step["answer"]), expressions)}
+            for field in _STEP_TEXT:
+                compiled[field] = _compile_text(str(step[field]), quantities, False)
+            if step.get("graph_query") is not None:
+                compiled["graph_query"] = _compile_text(str(step["graph_query"]), quantities, True)
+            compiled["hints"] = [_compile_text(str(hint), quantities, False) for hint in step.get("hints") or ()]
+            compiled["accepted_answers"] = [_compile_text(str(variant), quantities, True)
+                                            for variant in step.get("accepted_answers") or ()]
+            self.steps.append(compiled)
+        self.final_answer = _compile_answer(str(solution["final_answer"]), answers[-1])
+
+    def instantiate(self, problem: str, constants: list) -> dict:
+        """The solution for the same shape with other constants, raising ValueError if one doesn't fit."""
+        steps = []
+        for compiled in self.steps:
+            step = {field: _render_text(parts, constants) for field, parts in compiled.items()
+                    if field not in ("hints", "accepted_answers")}
+            step["hints"] = [_render_text(parts, constants) for parts in compiled["hints"]]
+            step["accepted_answers"] = [_render_text(parts, constants) for parts in compiled["accepted_answers"]]
+            steps.append(step)
+        return {"steps": steps, "final_answer": _render_text(self.final_answer, constants), "original_problem": problem}
+
+
+def _start_slots(solution: dict, constants: list) -> list:
+    """For each answer, its shape and, per number, every function of the constants that could produce it."""
+    return [(shape, [_candidates(constants, value) for value in values]) for shape, values in _answer_slots(solution)]
+
+
+def _narrow_slots(slots: list, solution: dict, constants: list):
+    """
+    Keep the candidates that also produce this solution's answers from its constants.
+    Returns None when the answers have a different shape or a number no candidate explains.
+    """
+    answers = _answer_slots(solution)
+    if len(answers) != len(slots):
+        return None
+    narrowed = []
+    for (shape, candidates), (new_shape, values) in zip(slots, answers):
+        if shape != new_shape:
+            return None
+        kept = []
+        for functions, value in zip(candidates, values):
+            matching = {}
+            for signature, expression in functions.items():
+                try:
+                    if _evaluate(expression, constants) == value:
+                        matching[signature] = expression
+                except ZeroDivisionError:
+                    continue
+            if not matching:
+                return None
+            kept.append(matching)
+        narrowed.append((shape, kept))
+    return narrowed
+
+
+def _reproduces(skeleton: Skeleton, problem: str, constants: list, solution: dict) -> bool:
+    """Whether the skeleton gives the same answers as this solution, from its constants."""
+    try:
+        instantiated = skeleton.instantiate(problem, constants)
+    except ValueError:
+        return False
+    return _answer_slots(instantiated) == _answer_slots(solution)
+
+
+class ProblemTemplateIndex:
+    """
+    Process-wide index from problem shape to a solution skeleton, so a problem that differs
+    from an earlier one only in its constants ("2x + 5 = 13", "3x + 7 = 22") is solved by
+    exact arithmetic instead of the LLM pipeline.
+
+    One solution can't tell how its answers follow from the constants (in 2x + 5 = 13, x = 4
+    is 2 + 2, 2 * 2 and (13 - 5) / 2), so each answer number keeps every candidate
+    expression, and each later solve of the same shape keeps the ones that give its answers
+    too. Once every answer number has a single expression, after at least MIN_SAMPLES - 1
+    solutions, the latest solution's text is compiled into a candidate skeleton, as long as
+    every number in its math is a constant or an answer. Two samples can agree by chance
+    (7 mod 3 = 1 and 10 mod 4 = 2 both fit c0 - 2 * c1), so a candidate is only served
+    once it reproduces the answers of the next solution, which played no part in
+    inducing it; one that doesn't is narrowed further with that solution instead. Shapes
+    are evicted least recently used.
+    """
+
+    def __init__(self, max_shapes: int = TEMPLATE_INDEX_MAX_SHAPES, enabled: bool = TEMPLATE_REUSE):
+        self.max_shapes = max_shapes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._shapes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.confirmed = 0
+        self.rejected = 0
+
+    def lookup(self, problem: str):
+        """The solution dict for `problem` from a skeleton, without graph images, or None."""
+        if not self.enabled:
+            return None
+        shape, constants = canonicalize(problem)
+        with self._lock:
+            entry = self._shapes.get(shape)
+            if entry is not None:
+                self._shapes.move_to_end(shape)
+            skeleton = entry["skeleton"] if entry is not None else None
+        solution = None
+        if skeleton is not None:
+            try:
+                solution = skeleton.instantiate(problem, constants)
+            except ValueError as e:
+                logging.debug(f"Template for {shape!r} doesn't fit {problem!r}: {str(e)}")
+        with self._lock:
+            if solution is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return solution
+
+    def learn(self, problem: str, solution: dict):
+        """Narrow down the skeleton for this problem's shape with a solution the LLM structured."""
+        if not self.enabled:
+            return
+        shape, constants = canonicalize(problem)
+        if not 0 < len(constants) <= MAX_CONSTANTS:
+            return
+        try:
+            with self._lock:
+                entry = self._shapes.get(shape)
+                if entry is None:
+                    self._shapes[shape] = {"slots": _start_slots(solution, constants), "constants": {tuple(constants)},
+                                           "candidate": None, "skeleton": None, "rejections": 0}
+                    while len(self._shapes) > self.max_shapes:
+                        self._shapes.popitem(last=False)
+                    return
+                # Done, given up on, or the same constants again, which tells nothing new
+                if entry["skeleton"] is not None or entry["rejections"] >= MAX_REJECTIONS \
+                        or tuple(constants) in entry["constants"]:
+                    return
+
+                candidate = entry["candidate"]
+                if candidate is not None:
+                    # A held-back solution: it confirms the candidate, or narrows it down further below
+                    entry["candidate"] = None
+                    if _reproduces(candidate, problem, constants, solution):
+                        entry["constants"].add(tuple(constants))
+                        entry["skeleton"] = candidate
+                        self.confirmed += 1
+                        logging.info(f"Solution template for {shape!r} confirmed on {problem!r}")
+                        return
+                    logging.debug(f"Solution template for {shape!r} doesn't reproduce {problem!r}")
+
+                slots = _narrow_slots(entry["slots"], solution, constants)
+                if slots is None:
+                    self._reject(shape, entry, solution, constants, "answers don't fit the candidates")
+                    return
+                entry["slots"] = slots
+                entry["constants"].add(tuple(constants))
+                if len(entry["constants"]) < MIN_SAMPLES - 1 \
+                        or any(len(functions) > 1 for _, candidates in slots for functions in candidates):
+                    return
+                answers = [[next(iter(functions.values())) for functions in candidates] for _, candidates in slots]
+                try:
+                    entry["candidate"] = Skeleton(solution, constants, answers)
+                except _Unsafe as e:
+                    self._reject(shape, entry, solution, constants, str(e))
+                    return
+                logging.debug(f"Solution template candidate for {shape!r}: answers "
+                              + "; ".join(", ".join(_format(e) for e in slot) for slot in answers))
+        except Exception as e:
+            # Learning must never fail the solve that taught it
+            logging.error(f"Error learning a solution template for {shape!r}: {str(e)}")
+
+    def _reject(self, shape: str, entry: dict, solution: dict, constants: list, reason: str):
+        # Called with the lock held; starts over from this solution until MAX_REJECTIONS
+        self.rejected += 1
+        entry["rejections"] += 1
+        entry["candidate"] = None
+        entry["slots"] = _start_slots(solution, constants)
+        entry["constants"] = {tuple(constants)}
+        logging.debug(f"Solution template for {shape!r} rejected ({entry['rejections']}): {reason}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "shapes": len(self._shapes),
+                "usable": sum(1 for entry in self._shapes.values() if entry["skeleton"] is not None),
+                "confirmed": self.confirmed,
+                "rejected": self.rejected,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+template_index = ProblemTemplateIndex()
@@ -0,0 +1,103 @@
+import pytest
+
+from answers import AnswerCache, local_verdict, normalize_answer
+from solution import StepContent
+
+SPELLINGS = [
+    ("\\frac{1}{2}", "1/2"),
+    ("$\\dfrac{3}{6}$", "1/2"),
+    ("\\frac{\\frac{1}{2}}{3}", "1/6"),
+    ("0.5", "1/2"),
+    ("2/4", "1/2"),
+    ("  X = 1/2 ", "1/2"),
+    ("y=2x+1", "2x+1"),
+    ("0.1+0.2", "3/10"),
+    ("2^3", "8"),
+    ("2**3", "8"),
+    ("−4", "-4"),
+    ("x=-(3)", "-3"),
+    ("2 \\cdot x", "2x"),
+    ("2*x", "2x"),
+    ("3 \\times (x)", "3x"),
+    ("\\sqrt{2}", "sqrt(2)"),
+    ("3π", "3pi"),
+    ("\\left(x+1\\right)^2", "(x+1)^2"),
+    ("x^{2}", "x^2"),
+    ("2^{10}", "1024"),
+    ("e^{x+1}", "e^(x+1)"),
+    ("x^{\\frac{1}{2}}", "x^(1/2)"),
+    ("\\frac{x^{2}}{2}", "(x^2)/2"),
+    ("\\left\\{1, 2\\right\\}", "{1,2}"),
+    ("((2))", "2"),
+]
+
+
+@pytest.mark.parametrize("text, expected", SPELLINGS)
+def test_normalize_answer(text, expected):
+    assert normalize_answer(text) == expected
+
+
+@pytest.mark.parametrize("text", [text for text, _ in SPELLINGS] + ["x=y=2", "1/0", "10^100", "2^(1/2)"])
+def test_normalize_answer_is_idempotent(text):
+    assert normalize_answer(normalize_answer(text)) == normalize_answer(text)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("x=y=2", "x=y=2"),  # only a single leading assignment is dropped
+    ("1/0", "1/0"),
+    ("10^100", "10^100"),  # exponents are capped before evaluating
+    ("2^(1/2)", "2^(1/2)"),  # irrational, left symbolic
+    ("sin(x)", "sin(x)"),
+    ("{1,2}", "{1,2}"),  # a set, not the interval (1,2)
+    ("(2)3", "(2)3"),  # a product, not 23
+    ("(2)x", "(2)x"),
+])
+def test_normalize_answer_leaves_what_it_cannot_evaluate(text, expected):
+    assert normalize_answer(text) == expected
+
+
+@pytest.mark.parametrize("answer, expected, verdict", [
+    ("x = 4", "4", True),
+    ("0.30", "3/10", True),
+    ("2*x", "2x", True),
+    ("5", "4", False),
+    ("1/3", "0.33", False),
+    ("2x", "x*2", None),  # equal, but only an algebra system can tell
+    ("1/0", "1", None),
+    ("sqrt(2)", "1.414", None),
+    ("{1,2}", "(1,2)", None),
+    ("(2)3", "23", None),
+])
+def test_local_verdict(answer, expected, verdict):
+    assert local_verdict(answer, expected) is verdict
+
+
+def test_answer_cache_accepts_known_and_learned_answers():
+    cache = AnswerCache(max_steps=2, max_per_step=2)
+    step = StepContent("Divide both sides by 2.", "What is x?", "1/2", "", accepted_answers=("x = 0.5",))
+
+    assert cache.accepts(step, "\\frac{1}{2}")
+    assert not cache.accepts(step, "2/4x")
+    cache.learn(step, "2/4x")
+    assert cache.accepts(step, "2/4x")
+    assert cache.stats()["learned"] == 1
+
+    # Known answers aren't stored, and a step keeps at most max_per_step learned ones
+    cache.learn(step, "0.5")
+    cache.learn(step, "a")
+    cache.learn(step, "b")
+    assert cache.stats()["learned"] == 2
+    assert not cache.accepts(step, "b")
+
+
+def test_answer_cache_evicts_least_recently_used_steps():
+    cache = AnswerCache(max_steps=2, max_per_step=4)
+    steps = [StepContent("", f"Question {i}?", str(i), "") for i in range(3)]
+    cache.learn(steps[0], "first")
+    cache.learn(steps[1], "second")
+    assert cache.accepts(steps[0], "first")  # now the most recently used
+    cache.learn(steps[2], "third")
+
+    assert cache.accepts(steps[0], "first")
+    assert not cache.accepts(steps[1], "second")
+    assert cache.stats()["steps"] == 2
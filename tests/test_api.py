@@ -0,0 +1,206 @@
+import asyncio
+import json
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+import api
+from api import SessionRegistry
+from scheduler import SOLVE, VALIDATE, Overloaded
+from session_store import SessionPersistence, SQLiteSessionStore
+from solution import MathSolution
+from test_templates import linear_solution
+from tutor import TutorSession
+
+PROBLEM = "Solve for x: 2x + 5 = 13"
+
+
+class Scheduler:
+    """
+    Runs jobs as they're submitted, except kinds in `hold`, which wait in `held` for the
+    test, and kinds in `shed`, which are refused.
+    """
+
+    def __init__(self):
+        self.hold = set()
+        self.held = []
+        self.shed = set()
+
+    def submit(self, kind, fn, *args):
+        if kind in self.shed:
+            raise Overloaded("The tutor is very busy right now, please try again in a minute.", retry_after=7.4)
+        future = Future()
+        if kind in self.hold:
+            self.held.append((future, fn, args))
+        else:
+            future.set_result(fn(*args))
+        return SimpleNamespace(future=future)
+
+    def release(self):
+        future, fn, args = self.held.pop(0)
+        future.set_result(fn(*args))
+
+
+class Solver:
+    def get_math_solution(self, problem):
+        return MathSolution.from_dict(linear_solution(2, 5, 13))
+
+    def match_accepted_answer(self, step, answer):
+        return (True, "Correct!") if answer == step.answer else None
+
+    def validate_step(self, step, answer):
+        return False, "Check the subtraction."
+
+    def generate_problem_summary(self, solution):
+        return "Well done."
+
+
+class RacingStore(SQLiteSessionStore):
+    """Runs `race`, once, right before the next save: another worker saving first."""
+
+    race = None
+
+    def save_session(self, *args, **kwargs):
+        race, self.race = self.race, None
+        if race is not None:
+            race()
+        return super().save_session(*args, **kwargs)
+
+
+@pytest.fixture
+def worker(monkeypatch, tmp_path):
+    worker = SimpleNamespace(store=RacingStore(str(tmp_path / "sessions.db")), scheduler=Scheduler(), rows=[])
+    monkeypatch.setattr(api, "registry", SessionRegistry(worker.store))
+    monkeypatch.setattr(api, "get_solver", Solver)
+    monkeypatch.setattr(api, "get_scheduler", lambda: worker.scheduler)
+    monkeypatch.setattr(api, "_append_rows", worker.rows.extend)
+    return worker
+
+
+async def exchange(method, path, body=None) -> list:
+    """The ASGI messages the app sends in response."""
+    messages = [{"type": "http.request", "body": json.dumps(body).encode("utf-8") if body is not None else b""}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+    await api.app({"type": "http", "method": method, "path": path, "query_string": b"", "headers": []}, receive, send)
+    return sent
+
+
+async def request(method, path, body=None) -> tuple:
+    sent = await exchange(method, path, body)
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+async def solved_session() -> str:
+    status, created = await request("POST", "/sessions", {"problem": PROBLEM})
+    assert status == 202
+    await api.registry.get(created["session_id"]).solving
+    return created["session_id"]
+
+
+def on_another_worker(store, session_id, change):
+    """Load the session as another worker would, change it and save it."""
+    session = TutorSession()
+    persistence = SessionPersistence(store, session_id)
+    assert persistence.restore(session)
+    change(session)
+    persistence.flush(session)
+    assert persistence.error is None
+
+
+def test_an_answer_saved_after_another_workers_changes_nothing(worker):
+    async def scenario():
+        session_id = await solved_session()
+        worker.store.race = lambda: on_another_worker(worker.store, session_id,
+                                                      lambda session: session.answer("8", True, "Right."))
+        status, body = await request("POST", f"/sessions/{session_id}/answers", {"answer": "7"})
+        assert status == 409, body
+        # This worker has the other one's version now, and carries on from it
+        assert [m["content"] for m in api.registry.get(session_id).session.chat_history] == \
+               [m["content"] for m in worker.store.load_messages(session_id)]
+        status, body = await request("POST", f"/sessions/{session_id}/answers", {"answer": "4"})
+        assert status == 200, body
+        return session_id
+
+    session_id = asyncio.run(scenario())
+    verdicts = [m["is_correct"] for m in worker.store.load_messages(session_id) if m.get("event") == "verdict"]
+    assert verdicts == [True, True]
+    assert not any(row["user_input"] == "7" for row in worker.rows)
+
+
+def test_the_background_solve_is_applied_again_over_another_workers_save(worker):
+    worker.scheduler.hold = {SOLVE}
+
+    async def scenario():
+        status, created = await request("POST", "/sessions", {"problem": PROBLEM})
+        session_id = created["session_id"]
+        worker.store.race = lambda: on_another_worker(worker.store, session_id,
+                                                      lambda session: session.solve_failed("y = ?", "no solution"))
+        worker.scheduler.release()
+        await api.registry.get(session_id).solving
+        return session_id
+
+    session_id = asyncio.run(scenario())
+    assert [m.get("event") for m in worker.store.load_messages(session_id)][:2] == ["error", "problem"]
+    status, body = asyncio.run(request("GET", f"/sessions/{session_id}"))
+    assert body["status"] == "in_progress" and body["problem"] == PROBLEM
+
+
+def test_unknown_sessions_and_routes_are_404(worker):
+    assert asyncio.run(request("GET", "/sessions/nobody")) == (404, {"error": "No session nobody"})
+    assert asyncio.run(request("POST", "/sessions/nobody/answers", {"answer": "8"}))[0] == 404
+    assert asyncio.run(request("GET", "/nowhere"))[0] == 404
+    sent = asyncio.run(exchange("DELETE", "/sessions/nobody"))
+    assert sent[0]["status"] == 405 and (b"allow", b"GET") in sent[0]["headers"]
+
+
+def test_actions_the_session_isnt_ready_for_are_409(worker):
+    worker.scheduler.hold = {SOLVE}
+
+    async def scenario():
+        _, created = await request("POST", "/sessions", {"problem": PROBLEM})
+        session_id = created["session_id"]
+        # Still solving
+        assert (await request("POST", f"/sessions/{session_id}/answers", {"answer": "8"}))[0] == 409
+        assert (await request("POST", f"/sessions/{session_id}/hints", {}))[0] == 409
+        assert (await request("GET", f"/sessions/{session_id}/summary"))[0] == 409
+        assert (await request("POST", f"/sessions/{session_id}/problems", {"problem": PROBLEM}))[0] == 409
+
+        worker.scheduler.release()
+        await api.registry.get(session_id).solving
+        assert (await request("POST", f"/sessions/{session_id}/problems", {"problem": PROBLEM}))[0] == 409
+        for answer in ("8", "4"):
+            assert (await request("POST", f"/sessions/{session_id}/answers", {"answer": answer}))[0] == 200
+        # Finished
+        status, body = await request("POST", f"/sessions/{session_id}/answers", {"answer": "4"})
+        assert status == 409 and body["error"]
+        assert (await request("POST", f"/sessions/{session_id}/hints", {}))[0] == 409
+        assert await request("GET", f"/sessions/{session_id}/summary") == \
+               (200, {"summary": "Well done.", "final_answer": "x = 4"})
+
+    asyncio.run(scenario())
+
+
+def test_shed_jobs_are_503_and_change_nothing(worker):
+    worker.scheduler.shed = {SOLVE}
+    sent = asyncio.run(exchange("POST", "/sessions", {"problem": PROBLEM}))
+    assert sent[0]["status"] == 503 and (b"retry-after", b"7") in sent[0]["headers"]
+    assert len(api.registry) == 0
+
+    worker.scheduler.shed = {VALIDATE}
+
+    async def scenario():
+        session_id = await solved_session()
+        before = worker.store.load_state(session_id)
+        assert (await request("POST", f"/sessions/{session_id}/answers", {"answer": "7"}))[0] == 503
+        assert worker.store.load_state(session_id) == before
+        # Answers the accepted answers settle don't need the scheduler
+        assert (await request("POST", f"/sessions/{session_id}/answers", {"answer": "8"}))[0] == 200
+
+    asyncio.run(scenario())
@@ -0,0 +1,92 @@
+import os
+import time
+
+import pytest
+
+from answers import normalize_answer
+from solution import MathSolution
+
+AppTest = pytest.importorskip("streamlit.testing.v1").AppTest
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+PROBLEM = "Solve for x: 2x + 5 = 13"
+SOLUTION = {
+    "steps": [
+        {"instruction": "Subtract $5$ from both sides.", "question": "What is $13 - 5$?", "answer": "8",
+         "explanation": "$13 - 5 = 8$.", "hints": ["Work out $13 - 5$."]},
+        {"instruction": "Divide both sides by $2$.", "question": "What is $x$?", "answer": "4",
+         "explanation": "$8 / 2 = 4$.", "hints": ["Work out $8 / 2$."]},
+    ],
+    "final_answer": "x = 4",
+    "original_problem": PROBLEM,
+}
+
+
+class FakeSolver:
+    """Stands in for llm.MathSolver: a fixed solution and exact-match answer checking."""
+
+    def get_math_solution(self, problem, deadline=None):
+        return MathSolution.from_dict(SOLUTION)
+
+    def match_accepted_answer(self, step, user_answer):
+        return (True, "Correct.") if normalize_answer(user_answer) in step.accepted_answers else None
+
+    def validate_step(self, step, user_answer):
+        return False, "Not quite."
+
+    def generate_problem_summary(self, solution):
+        return "Well done."
+
+    def dump_to_file(self, variable, filename="debug_validation.txt"):
+        pass
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    from profiler import render_profiler
+    import ui.chat
+    monkeypatch.setattr(render_profiler, "enabled", True)
+    monkeypatch.setattr(ui.chat, "append_rows_to_sheet", lambda rows: None)
+    at = AppTest.from_file(MAIN_SCRIPT, default_timeout=30)
+    at.session_state["solver"] = FakeSolver()
+    at.run()
+    return at
+
+
+def submit(at, text: str):
+    at.text_input(key="input_box").input(text)
+    next(button for button in at.button if button.label == "Submit").click().run()
+
+
+def start_problem(at):
+    submit(at, PROBLEM)
+    deadline = time.monotonic() + 10
+    while at.session_state.problem_state["steps"] is None:
+        assert time.monotonic() < deadline, "the problem was never started"
+        time.sleep(0.05)
+        at.run()
+    assert not at.exception
+
+
+def test_an_answer_takes_one_script_run(app):
+    start_problem(app)
+    messages = len(app.session_state.chat_history)
+
+    submit(app, "7")
+    assert app.session_state.last_render["action_runs"] == 1
+    assert app.session_state.problem_state["current_step"] == 0
+    assert len(app.session_state.chat_history) > messages
+
+    submit(app, "8")
+    assert app.session_state.last_render["action_runs"] == 1
+    assert app.session_state.problem_state["current_step"] == 1
+    assert not app.exception
+
+
+def test_a_hint_takes_one_script_run(app):
+    start_problem(app)
+    app.button(key="hint_0").click().run()
+    assert app.session_state.last_render["action_runs"] == 1
+    assert app.session_state.problem_state["steps"][0].hint_count == 1
+    assert not app.exception
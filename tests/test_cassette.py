@@ -0,0 +1,116 @@
+import gzip
+import json
+
+import httpx
+import pytest
+import requests
+
+from cassette import CassetteMiss, CassetteTransport, httpx_client, requests_session, use_cassette
+
+COMPLETION = {"model": "gpt-4o", "messages": [{"role": "user", "content": "What is 13 - 5?"}], "temperature": 0}
+
+
+class Chunks(httpx.SyncByteStream):
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        yield from self.chunks
+
+
+class Provider:
+    """httpx.MockTransport handler standing in for the API, counting the requests it gets."""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        if request.url.path.endswith("/stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                                  stream=Chunks([b"data: 1\n\n", b"data: 2\n\n", b"data: [DONE]\n\n"]))
+        return httpx.Response(200, json={"choices": [{"message": {"content": "8"}}]},
+                              headers={"x-ratelimit-remaining-requests": "99", "set-cookie": "session=abc"})
+
+
+def recording_client(cassette, provider):
+    return httpx.Client(transport=CassetteTransport(cassette, httpx.MockTransport(provider)))
+
+
+def test_httpx_round_trip(tmp_path):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    provider = Provider()
+    with use_cassette(path, "record") as cassette:
+        with recording_client(cassette, provider) as client:
+            recorded = client.post("https://api.openai.com/v1/chat/completions?key=secret", json=COMPLETION)
+            with client.stream("POST", "https://api.openai.com/v1/stream", json={}) as response:
+                streamed = list(response.iter_raw())
+    assert len(provider.requests) == 2
+    assert b"secret" not in gzip.open(path).read()
+
+    with use_cassette(path):
+        with httpx_client() as client:
+            # Another host and base path, keys in another order, and no credentials
+            replayed = client.post("https://openrouter.ai/api/v1/chat/completions",
+                                   content=json.dumps(dict(reversed(COMPLETION.items()))))
+            with client.stream("POST", "https://api.openai.com/v1/stream", json={}) as response:
+                assert list(response.iter_raw()) == streamed
+    assert replayed.status_code == recorded.status_code
+    assert replayed.json() == recorded.json()
+    assert replayed.headers["x-ratelimit-remaining-requests"] == "99"
+    assert "set-cookie" not in replayed.headers
+    assert len(provider.requests) == 2
+
+
+def test_replay_falls_back_to_requests_of_the_same_shape(tmp_path):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    with use_cassette(path, "record") as cassette:
+        with recording_client(cassette, Provider()) as client:
+            client.post("https://api.openai.com/v1/chat/completions", json=COMPLETION)
+
+    with use_cassette(path):
+        with httpx_client() as client:
+            other_question = dict(COMPLETION, messages=[{"role": "user", "content": "What is 8 / 2?"}])
+            assert client.post("https://api.openai.com/v1/chat/completions", json=other_question).status_code == 200
+            with pytest.raises(CassetteMiss):
+                client.post("https://api.openai.com/v1/chat/completions", json=dict(COMPLETION, model="o3"))
+            with pytest.raises(CassetteMiss):
+                client.get("https://api.openai.com/v1/models")
+
+
+def test_token_requests_are_never_recorded(tmp_path):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    provider = Provider()
+    with use_cassette(path, "record") as cassette:
+        with recording_client(cassette, provider) as client:
+            client.post("https://oauth2.googleapis.com/token", data={"assertion": "signed"})
+    assert len(provider.requests) == 1
+    with pytest.raises(CassetteMiss):
+        with use_cassette(path):
+            pass
+
+
+def test_requests_round_trip(tmp_path, monkeypatch):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    sent = []
+
+    def send(adapter, request, **kwargs):
+        sent.append(request)
+        response = requests.Response()
+        response.status_code = 200
+        response.headers.update({"content-type": "image/png", "date": "Mon, 19 Oct 2026 09:00:00 GMT"})
+        response._content = b"\x89PNG"
+        return response
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", send)
+
+    # Like graph.py's, the session is created once and follows whichever cassette is active
+    session = requests_session()
+    url = "https://api.wolframalpha.com/v2/query?appid=secret&input=plot+y%3D2x%2B5"
+    with use_cassette(path, "record"):
+        session.get(url)
+    with use_cassette(path):
+        replayed = session.get(url.replace("secret", "other"))
+    assert len(sent) == 1
+    assert replayed.status_code == 200
+    assert replayed.content == b"\x89PNG"
+    assert replayed.headers["content-type"] == "image/png" and "date" not in replayed.headers
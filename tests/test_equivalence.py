@@ -0,0 +1,115 @@
+import pytest
+
+import graph
+from equivalence import EquivalenceOracle, VerdictCache, is_antiderivative, to_expression
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("x", ("x", {"x"})),
+    ("2x^2sin(x)", ("2*x^2*sin(x)", {"x"})),
+    ("xsin(x)", ("x*sin(x)", {"x"})),
+    ("2(x+1)(x-1)", ("2*(x+1)*(x-1)", {"x"})),
+    ("e^x", ("e^x", {"x"})),
+    ("3pi", ("3*pi", set())),
+    ("sqrt(t)/2", ("sqrt(t)/2", {"t"})),
+])
+def test_to_expression(text, expected):
+    assert to_expression(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "x=2", "1,2", "one", "2xy", "(x+1", "x+1)", "sinx", "x!"])
+def test_to_expression_rejects_what_is_not_one_expression(text):
+    assert to_expression(text) is None
+
+
+@pytest.mark.parametrize("result, kind, verdict", [
+    ("0", "equivalent", True),
+    ("0", "antiderivative", True),
+    ("5", "equivalent", False),
+    ("-1/2", "antiderivative", True),
+    ("2 x", "equivalent", False),
+    ("2 x", "antiderivative", False),
+    ("", "equivalent", None),
+    (None, "equivalent", None),
+    ("(no result)", "equivalent", None),
+])
+def test_interpret(result, kind, verdict):
+    assert EquivalenceOracle.interpret(result, kind) is verdict
+
+
+def test_is_antiderivative_needs_a_constant_of_integration():
+    assert is_antiderivative("x^3/3 + C")
+    assert is_antiderivative("\\sin(x) + k")
+    assert not is_antiderivative("x^2")
+    assert not is_antiderivative("x + c^2")
+
+
+class Wolfram:
+    """simplify_with_wolfram answering from a table, counting its queries."""
+
+    def __init__(self, results):
+        self.results = results
+        self.queries = []
+
+    def __call__(self, expression, deadline=None):
+        self.queries.append(expression)
+        result = self.results[expression]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def oracle():
+    return EquivalenceOracle(enabled=True, cache=VerdictCache(path=""))
+
+
+def use_wolfram(monkeypatch, results):
+    wolfram = Wolfram(results)
+    monkeypatch.setattr(graph, "simplify_with_wolfram", wolfram)
+    return wolfram
+
+
+def test_check_asks_wolfram_once_per_pair(monkeypatch, oracle):
+    wolfram = use_wolfram(monkeypatch, {
+        "(x^2-1)-((x+1)*(x-1))": "0",
+        "((x+1)*(x-1))-(x^2-1)": "0",
+        "(x^2+1)-(x^2-1)": "2",
+        "(x^2-1)-(x^2+1)": "-2",
+    })
+    assert oracle.check("x^2 - 1", "(x+1)(x-1)", "Multiply out (x+1)(x-1).")
+    assert oracle.check("(x + 1)(x - 1)", "x^2-1", "Multiply out (x+1)(x-1).")
+    assert oracle.check("x^2+1", "x^2-1", "Multiply out (x+1)(x-1).") is False
+    assert len(wolfram.queries) == 2
+    assert oracle.stats()["cache_hits"] == 1
+
+
+def test_check_leaves_what_it_cannot_settle_to_the_llm(monkeypatch, oracle):
+    wolfram = use_wolfram(monkeypatch, {"(2*x)-(x+x)": TimeoutError("Wolfram is down")})
+    assert oracle.check("1/2", "0.5", "") is None  # plain numbers, see answers.local_verdict
+    assert oracle.check("x = 2", "2", "") is None
+    assert oracle.check("2x", "x+x", "") is None  # Wolfram unreachable, and not cached
+    assert oracle.check("2x", "x+x", "") is None
+    assert len(wolfram.queries) == 2
+    assert not EquivalenceOracle(enabled=False).check("2x", "x+x", "")
+
+
+def test_check_leaves_equivalent_answers_in_the_wrong_form_to_the_llm(monkeypatch, oracle):
+    use_wolfram(monkeypatch, {"(x^2-1)-((x+1)*(x-1))": "0", "(x^2)-((x+1)*(x-1))": "1"})
+    assert oracle.check("x^2-1", "(x+1)(x-1)", "Factor x^2 - 1.") is None
+    assert oracle.check("x^2", "(x+1)(x-1)", "Factor x^2 - 1.") is False
+
+
+def test_integration_steps_without_a_constant_compare_exactly(monkeypatch, oracle):
+    use_wolfram(monkeypatch, {"(x^2)-(x^2+1)": "-1", "(x^2+1)-(x^2)": "1"})
+    assert oracle.check("x^2", "x^2+1", "In the integral of 2x(x^2+1)^3 dx, what should u be?") is False
+    assert oracle.check("x^2", "x^2+1", "∫ 2x dx") is False
+
+
+def test_antiderivatives_may_differ_by_a_constant(monkeypatch, oracle):
+    use_wolfram(monkeypatch, {"(x^2+x)-(x^2)": "x", "(x^2)-(x^2+x)": "-x", "(x^2+1)-(x^2)": "1",
+                              "(x^2)-(x^2+1)": "-1"})
+    assert oracle.check("x^2 + 1 + C", "x^2 + C", "Integrate 2x.")
+    assert oracle.check("x^2 + x + C", "x^2 + C", "Integrate 2x.") is False
+    # A missing constant of integration is for the LLM to point out
+    assert oracle.check("x^2", "x^2 + C", "Integrate 2x.") is None
@@ -0,0 +1,87 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import llm
+from answers import AnswerCache
+from llm import ACCEPTED_ANSWER_EXPLANATION, EQUIVALENT_EXPLANATION, MathSolver
+from solution import MathSolution, SolutionContent, StepContent
+
+SOLUTION = SolutionContent(
+    steps=[
+        StepContent("Subtract 5 from both sides.", "What is 13 - 5?", "8", "13 - 5 = 8"),
+        StepContent("Divide both sides by 2.", "What is x?", "4", "8 / 2 = 4"),
+        StepContent("Factor the check.", "Factor x^2 - 16.", "(x+4)(x-4)", "x^2 - 16 = (x+4)(x-4)"),
+    ],
+    final_answer="x = 4",
+    original_problem="Solve for x: 2x + 5 = 13",
+)
+
+
+class Oracle:
+    """equivalence_oracle settling the answers in `verdicts`, and nothing else."""
+
+    def __init__(self, verdicts=None):
+        self.verdicts = verdicts or {}
+
+    def check(self, answer, expected, question):
+        return self.verdicts.get(answer)
+
+
+@pytest.fixture
+def solver(monkeypatch):
+    monkeypatch.setattr(llm, "answer_cache", AnswerCache())
+    monkeypatch.setattr(llm, "equivalence_oracle", Oracle())
+    solver = MathSolver.__new__(MathSolver)
+    solver.requests = []
+    solver.results = []
+
+    def create(**kwargs):
+        solver.requests.append(json.dumps(kwargs["messages"]))
+        arguments = json.dumps({"results": solver.results})
+        message = SimpleNamespace(function_call=SimpleNamespace(arguments=arguments))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+    solver.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return solver
+
+
+def test_accepted_answers_are_graded_without_a_call(solver):
+    verdicts = solver.validate_exam_answers(MathSolution(SOLUTION), ["8", "x = 4", "(x + 4)(x - 4)"])
+    assert verdicts == [(True, ACCEPTED_ANSWER_EXPLANATION)] * 3
+    assert solver.requests == []
+
+
+def test_only_unsettled_answers_go_to_the_llm_in_one_call(solver, monkeypatch):
+    monkeypatch.setattr(llm, "equivalence_oracle", Oracle({"(x-4)(x+4)": True}))
+    solver.results = [{"step": 2, "is_correct": True, "explanation": "Four is 4."}]
+    solution = MathSolution(SOLUTION)
+
+    verdicts = solver.validate_exam_answers(solution, ["8", "four", "(x-4)(x+4)"])
+    assert verdicts == [(True, ACCEPTED_ANSWER_EXPLANATION), (True, "Four is 4."), (True, EQUIVALENT_EXPLANATION)]
+    assert len(solver.requests) == 1
+    assert "Step 2" in solver.requests[0] and "Step 1" not in solver.requests[0] and "Step 3" not in solver.requests[0]
+
+    # Learned, so the next student's exam skips the call
+    assert solver.validate_exam_answers(solution.fresh(), ["8", "four", "(x-4)(x+4)"]) == \
+           [(True, ACCEPTED_ANSWER_EXPLANATION)] * 3
+    assert len(solver.requests) == 1
+
+
+def test_blank_answers_are_left_to_the_llm(solver):
+    solver.results = [{"step": 1, "is_correct": False, "explanation": "No answer."},
+                      {"step": 3, "is_correct": False, "explanation": "Check the signs."}]
+    verdicts = solver.validate_exam_answers(MathSolution(SOLUTION), ["", "4", "(x+4)(x+4)"])
+    assert verdicts == [(False, "No answer."), (True, ACCEPTED_ANSWER_EXPLANATION), (False, "Check the signs.")]
+    assert "(no answer)" in solver.requests[0]
+
+
+def test_verdicts_missing_from_the_response_fail_the_grading(solver):
+    solver.results = [{"step": 1, "is_correct": True, "explanation": "Right."}]
+    with pytest.raises(Exception, match=r"Missing verdicts for steps \[3\]"):
+        solver.validate_exam_answers(MathSolution(SOLUTION), ["8.0", "4", "(x-4)^2"])
+
+
+def test_one_answer_per_step_is_required(solver):
+    with pytest.raises(ValueError):
+        solver.validate_exam_answers(MathSolution(SOLUTION), ["8", "4"])
@@ -0,0 +1,57 @@
+import io
+from concurrent.futures import Future
+
+import pytest
+
+import llm
+from llm import MathSolver
+from test_templates import linear_solution
+
+
+class FakePrefetch:
+    def __init__(self):
+        self.fetched = []
+        self.closed = False
+
+    def fetch(self, query, speculative=False):
+        self.fetched.append(query)
+        future = Future()
+        future.set_result(io.BytesIO(b"png"))
+        return future
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def prefetch(monkeypatch):
+    prefetch = FakePrefetch()
+    monkeypatch.setattr(llm, "GRAPH_PIPELINE", True)
+    monkeypatch.setattr(llm.graph_pool, "prefetch", lambda deadline, min_seconds=0.0: prefetch)
+    return prefetch
+
+
+def test_templated_solve_closes_prefetch(monkeypatch, prefetch):
+    monkeypatch.setattr(llm.template_index, "lookup", lambda problem: linear_solution(4, 1, 9))
+    solver = MathSolver.__new__(MathSolver)  # no clients, a templated solve makes no LLM call
+
+    solution = solver.get_math_solution("Solve for x: 4x + 1 = 9")
+
+    assert solution.final_answer == "x = 2"
+    assert prefetch.fetched == ["plot y = 4x + 1"]
+    assert solution.steps[0].graph_image == b"png"
+    assert prefetch.closed
+
+
+def test_failed_solve_closes_prefetch(monkeypatch, prefetch):
+    monkeypatch.setattr(llm.template_index, "lookup", lambda problem: None)
+    solver = MathSolver.__new__(MathSolver)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("unreachable")
+    monkeypatch.setattr(solver, "_reason", fail, raising=False)
+    monkeypatch.setattr(solver, "_structure_streamed", fail, raising=False)
+
+    with pytest.raises(Exception, match="Error getting math solution"):
+        solver.get_math_solution("Solve for x: 4x + 1 = 9")
+    assert prefetch.closed
@@ -0,0 +1,96 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import llm
+from hints import HintCache, StepHintIndex, step_key, tokenize
+from llm import MathSolver
+from solution import Step, StepContent
+
+STEP = StepContent("Subtract 5 from both sides.", "What is 13 - 5?", "8", "13 - 5 = 8")
+
+
+def test_tokenize_drops_filler_words():
+    assert tokenize("What is 13 - 5 for x^2?") == ["13", "-", "5", "x", "^", "2"]
+
+
+def test_step_key_ignores_attempt_order_and_repeats():
+    assert step_key(STEP, ["7", "9"]) == step_key(STEP, ["9", "7", "9"])
+    assert step_key(STEP) != step_key(STEP, ["7"])
+    assert step_key(STEP) != step_key(StepContent(STEP.instruction, "What is 13 - 6?", "7", ""))
+
+
+def test_index_finds_the_closest_question():
+    index = StepHintIndex()
+    index.add("why do we subtract 5", "To undo the +5.")
+    index.add("what does isolate mean", "Get x on its own.")
+    similarity, hint = index.search("why subtract 5 here")
+    assert hint == "To undo the +5."
+    assert 0 < similarity <= 1
+    assert StepHintIndex().search("anything") is None
+
+
+def test_index_keeps_the_newest_questions():
+    index = StepHintIndex(max_entries=2)
+    for i in range(3):
+        index.add(f"question {i}", f"hint {i}")
+    assert index.questions == ["question 1", "question 2"]
+
+
+def test_cache_reuses_hints_for_similar_questions():
+    cache = HintCache(threshold=0.75)
+    assert cache.lookup(STEP, "why do we subtract 5") is None
+    cache.add(STEP, "why do we subtract 5", "To undo the +5.")
+
+    assert cache.lookup(STEP, "Why do we subtract 5?") == "To undo the +5."
+    assert cache.lookup(STEP, "what is a coefficient") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_cache_keeps_hints_to_the_attempts_they_explain():
+    cache = HintCache(threshold=0.75)
+    cache.add(STEP, "why is this wrong", "13 - 5 is not 18, you added.", attempts=["18"])
+
+    assert cache.lookup(STEP, "why is this wrong") is None
+    assert cache.lookup(STEP, "why is this wrong", attempts=["7"]) is None
+    assert cache.lookup(STEP, "why is this wrong", attempts=["18"]) == "13 - 5 is not 18, you added."
+
+
+def test_cache_evicts_least_recently_used_steps():
+    cache = HintCache(threshold=0.75, max_steps=2)
+    steps = [StepContent("", f"What is {i} + {i}?", str(2 * i), "") for i in range(3)]
+    for step in steps[:2]:
+        cache.add(step, "how do I add", "Count on.")
+    cache.lookup(steps[0], "how do I add")
+    cache.add(steps[2], "how do I add", "Count on.")
+
+    assert cache.lookup(steps[0], "how do I add") == "Count on."
+    assert cache.lookup(steps[1], "how do I add") is None
+
+
+@pytest.fixture
+def solver(monkeypatch):
+    cache = HintCache(threshold=0.75)
+    monkeypatch.setattr(llm, "hint_cache", cache)
+    solver = MathSolver.__new__(MathSolver)
+    solver.calls = 0
+
+    def create(**kwargs):
+        solver.calls += 1
+        arguments = json.dumps({"hint": f"hint {solver.calls}"})
+        message = SimpleNamespace(function_call=SimpleNamespace(arguments=arguments))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+    solver.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return solver
+
+
+def test_custom_hints_are_shared_after_the_same_attempts(solver):
+    first = solver.generate_custom_hint(Step(STEP), "why is this wrong", ["x = 18", "7"])
+    second = solver.generate_custom_hint(Step(STEP), "why is this wrong", ["7", "18"])
+    other = solver.generate_custom_hint(Step(STEP), "why is this wrong", ["9"])
+
+    assert first == second == "hint 1"
+    assert other == "hint 2"
+    assert solver.calls == 2
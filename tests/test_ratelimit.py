@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+import ratelimit
+from ratelimit import RateGovernor, _Bucket, estimate_tokens, parse_reset
+
+
+def test_parse_reset_reads_every_format():
+    assert parse_reset("6m0s") == 360
+    assert parse_reset("1.5s") == 1.5
+    assert parse_reset("20ms") == pytest.approx(0.02)
+    assert parse_reset("12") == 12
+    now = 1_760_000_000
+    assert parse_reset(str((now + 30) * 1000), now=now) == pytest.approx(30)
+    assert parse_reset("") is None
+    assert parse_reset("soon") is None
+
+
+def test_estimate_tokens_counts_the_prompt_and_the_reply():
+    body = json.dumps({"messages": [{"role": "user", "content": "x" * 400}], "max_tokens": 50}).encode()
+    assert 100 < estimate_tokens(body) < 200
+    assert estimate_tokens(b"not json") == ratelimit.COMPLETION_TOKEN_ESTIMATE
+
+
+def test_bucket_refills_up_to_its_limit():
+    bucket = _Bucket(60, 600)
+    bucket.updated = 0.0
+    for _ in range(60):
+        bucket.take(10)
+    assert bucket.requests == 0 and bucket.tokens == 0
+    assert bucket.wait_for(10, now=0.0) == pytest.approx(1.0)
+    bucket.refill(1.0)
+    assert bucket.requests == pytest.approx(1) and bucket.tokens == pytest.approx(10)
+    assert bucket.wait_for(10, now=1.0) == 0
+    bucket.refill(1000.0)
+    assert bucket.requests == 60 and bucket.tokens == 600
+
+
+def test_unlimited_dimensions_build_no_debt():
+    bucket = _Bucket(0, 0)
+    for _ in range(1000):
+        bucket.take(5000)
+    assert bucket.requests == 0 and bucket.tokens == 0
+    # A limit reported later starts out full instead of paying back the requests made without one
+    bucket.set_limits(100, 10000)
+    assert bucket.requests == 100 and bucket.tokens == 10000
+    assert bucket.wait_for(500, now=bucket.updated) == 0
+
+
+def test_observe_follows_headers_and_429s():
+    governor = RateGovernor(directory=None, max_wait=0)
+    governor.observe("openai", "gpt-4o", 200, {"x-ratelimit-limit-requests": "100",
+                                               "x-ratelimit-remaining-requests": "3",
+                                               "x-ratelimit-limit-tokens": "1000",
+                                               "x-ratelimit-remaining-tokens": "900"})
+    bucket = governor.snapshot()["buckets"]["openai:gpt-4o"]
+    assert bucket["requests_per_minute"] == 100 and bucket["requests"] == pytest.approx(3, abs=0.1)
+    assert bucket["tokens_per_minute"] == 1000 and bucket["tokens"] == pytest.approx(900, abs=1)
+
+    governor.observe("openai", "gpt-4o", 429, {"retry-after": "30"})
+    assert governor.snapshot()["rate_limited"] == 1
+    # max_wait 0: sent anyway, counted as an overrun
+    governor.acquire("openai", "gpt-4o", 10)
+    assert governor.snapshot()["overruns"] == 1
+
+
+def test_acquire_waits_for_capacity(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMITS", {"wolfram": (600, 0)})
+    governor = RateGovernor(directory=None, max_wait=5)
+    for _ in range(600):
+        governor.acquire("wolfram")
+    assert governor.snapshot()["waits"] == 0
+    # One request refills in 0.1s at 600 a minute
+    waited = governor.acquire("wolfram")
+    assert 0.02 < waited < 1
+    assert governor.snapshot()["overruns"] == 0
+
+
+@pytest.mark.skipif(ratelimit.fcntl is None, reason="file buckets need fcntl")
+def test_file_buckets_are_shared_between_governors(tmp_path, monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMITS", {"wolfram": (10, 0)})
+    first = RateGovernor(directory=str(tmp_path), max_wait=0)
+    second = RateGovernor(directory=str(tmp_path), max_wait=0)
+    for _ in range(5):
+        first.acquire("wolfram")
+    for _ in range(5):
+        second.acquire("wolfram")
+    assert second.snapshot()["buckets"]["wolfram"]["requests"] == pytest.approx(0, abs=0.1)
+    second.acquire("wolfram")
+    assert second.snapshot()["overruns"] == 1
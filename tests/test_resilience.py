@@ -0,0 +1,165 @@
+import httpx
+import pytest
+
+import resilience
+from resilience import SHEETS, CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceeded, Dependency, TransientError
+
+
+class Clock:
+    """Stands in for the time module: sleeping only moves the clock forward."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class HttpError(Exception):
+    """Shaped like googleapiclient's HttpError: the status is on `resp`."""
+
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = type("Response", (), {"status": status})()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience, "time", clock)
+    return clock
+
+
+def failing(*errors, result="ok"):
+    """A callable raising `errors` in turn, then returning `result`; counts its calls."""
+    errors = list(errors)
+
+    def fn(**kwargs):
+        fn.calls += 1
+        if errors:
+            raise errors.pop(0)
+        return result
+    fn.calls = 0
+    return fn
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure(TimeoutError())
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure(TimeoutError())
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure(TimeoutError("slow"))
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.snapshot()["last_error"] == "TimeoutError: slow"
+
+
+def test_half_open_breaker_lets_one_trial_through(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure(TimeoutError())
+    clock.now += 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure(TimeoutError())
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_retries_with_jittered_backoff(clock):
+    dependency = Dependency("test", timeout=5, attempts=4, base_delay=0.5, max_delay=1.5)
+    fn = failing(TimeoutError(), HttpError(503), TransientError())
+    assert dependency.call(fn) == "ok"
+    assert fn.calls == 4
+    assert len(clock.sleeps) == 3
+    for attempt, delay in enumerate(clock.sleeps):
+        assert 0 <= delay <= min(1.5, 0.5 * 2 ** attempt)
+    assert dependency.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_gives_up_after_the_last_attempt(clock):
+    dependency = Dependency("test", timeout=5, attempts=3, failure_threshold=10)
+    fn = failing(*[TimeoutError()] * 5)
+    with pytest.raises(TimeoutError):
+        dependency.call(fn)
+    assert fn.calls == 3
+    assert len(clock.sleeps) == 2
+
+
+def test_client_errors_are_not_retried_and_keep_the_circuit_closed(clock):
+    dependency = Dependency("test", timeout=5, attempts=3, failure_threshold=1)
+    fn = failing(HttpError(400))
+    with pytest.raises(HttpError):
+        dependency.call(fn)
+    assert fn.calls == 1
+    assert dependency.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_circuit_fails_fast(clock):
+    dependency = Dependency("test", timeout=5, attempts=3, failure_threshold=3)
+    with pytest.raises(TimeoutError):
+        dependency.call(failing(*[TimeoutError()] * 3))
+    fn = failing()
+    with pytest.raises(CircuitOpenError):
+        dependency.call(fn)
+    assert fn.calls == 0
+
+
+@pytest.fixture
+def sheets(monkeypatch, clock):
+    monkeypatch.setattr(SHEETS, "breaker", CircuitBreaker("sheets", failure_threshold=10))
+    return SHEETS
+
+
+@pytest.mark.parametrize("error", [TimeoutError("The read operation timed out"), HttpError(500), HttpError(503)])
+def test_sheets_does_not_retry_appends_that_may_have_been_applied(sheets, error):
+    fn = failing(error)
+    with pytest.raises(type(error)):
+        sheets.call(fn)
+    assert fn.calls == 1
+    # Still a sign of an unhealthy service
+    assert sheets.breaker.snapshot()["consecutive_failures"] == 1
+
+
+@pytest.mark.parametrize("error", [HttpError(429), ConnectionRefusedError(), httpx.ConnectError("refused")])
+def test_sheets_retries_appends_that_were_never_applied(sheets, error):
+    fn = failing(error)
+    assert sheets.call(fn) == "ok"
+    assert fn.calls == 2
+
+
+def test_trial_cut_short_by_the_deadline_releases_the_half_open_circuit(clock):
+    dependency = Dependency("test", timeout=10, attempts=1, failure_threshold=1, reset_timeout=30)
+    with pytest.raises(TimeoutError):
+        dependency.call(failing(TimeoutError()))
+    clock.now += 30
+
+    deadline = Deadline(3)
+
+    def slow(timeout):
+        clock.now += timeout
+        raise TimeoutError("read timed out")
+    with pytest.raises(DeadlineExceeded):
+        dependency.call(slow, deadline=deadline)
+    assert dependency.breaker.state == CircuitBreaker.HALF_OPEN
+
+    fn = failing()
+    assert dependency.call(fn) == "ok"
+    assert fn.calls == 1
+    assert dependency.breaker.state == CircuitBreaker.CLOSED
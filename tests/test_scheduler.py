@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from scheduler import HINT, SOLVE, SUMMARY, VALIDATE, Overloaded, Scheduler
+
+TIMEOUT = 5
+
+
+class Blocker:
+    """A job that holds its worker until released."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self):
+        self.started.set()
+        assert self.released.wait(TIMEOUT)
+
+
+@pytest.fixture
+def blocker():
+    blocker = Blocker()
+    yield blocker
+    blocker.released.set()
+
+
+def occupy(scheduler, blocker, kind=SOLVE):
+    ticket = scheduler.submit(kind, blocker)
+    assert blocker.started.wait(TIMEOUT)
+    return ticket
+
+
+def test_most_urgent_jobs_run_first(blocker):
+    scheduler = Scheduler(solve_workers=1, interactive_workers=0)
+    occupy(scheduler, blocker)
+    order = []
+    tickets = [scheduler.submit(kind, order.append, name)
+               for kind, name in [(SOLVE, "solve"), (SUMMARY, "summary"), (VALIDATE, "validate"), (HINT, "hint")]]
+    assert [ticket.position() for ticket in tickets] == [4, 3, 1, 2]
+
+    blocker.released.set()
+    for ticket in tickets:
+        ticket.result(TIMEOUT)
+    assert order == ["validate", "hint", "summary", "solve"]
+    assert scheduler.snapshot()["completed"] == 5
+
+
+def test_interactive_workers_never_take_solves(blocker):
+    scheduler = Scheduler(solve_workers=1, interactive_workers=1)
+    occupy(scheduler, blocker)
+    waiting = scheduler.submit(SOLVE, lambda: "solved")
+
+    # The interactive worker is idle, but only answers students mid-problem
+    assert scheduler.submit(VALIDATE, lambda: "checked").result(TIMEOUT) == "checked"
+    assert not waiting.done() and waiting.position() == 1
+    assert waiting.estimated_wait() > 0
+
+    blocker.released.set()
+    assert waiting.result(TIMEOUT) == "solved"
+
+
+def test_full_lanes_shed_jobs(blocker):
+    scheduler = Scheduler(solve_workers=1, interactive_workers=0, max_queued_solves=1, max_queued_interactive=1)
+    occupy(scheduler, blocker)
+    scheduler.submit(SOLVE, lambda: None)
+    with pytest.raises(Overloaded) as shed:
+        scheduler.submit(SOLVE, lambda: None)
+    assert shed.value.retry_after > 0
+
+    # Each lane has its own cap
+    scheduler.submit(HINT, lambda: None)
+    with pytest.raises(Overloaded):
+        scheduler.submit(VALIDATE, lambda: None)
+    assert scheduler.snapshot()["shed"] == 2
+    assert scheduler.snapshot()["queued"] == {SOLVE: 1, HINT: 1}
+
+
+def test_solves_that_would_wait_too_long_are_shed(blocker):
+    # A solve takes 45s until one finishes, so a second one would wait about that long
+    scheduler = Scheduler(solve_workers=1, interactive_workers=0, max_solve_wait=30)
+    occupy(scheduler, blocker)
+    with pytest.raises(Overloaded):
+        scheduler.submit(SOLVE, lambda: None)
+    # Interactive jobs aren't held to it
+    scheduler.submit(VALIDATE, lambda: None)
+    assert scheduler.snapshot()["queued"] == {VALIDATE: 1}
+
+
+def test_unknown_kinds_are_rejected():
+    with pytest.raises(ValueError):
+        Scheduler().submit("train", lambda: None)
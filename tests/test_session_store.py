@@ -0,0 +1,282 @@
+import fnmatch
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+import session_store
+from session_store import RedisSessionStore, SessionPersistence, SQLiteSessionStore, restore_session
+from solution import MathSolution
+from test_templates import linear_solution
+from tutor import TutorSession
+
+
+class WatchError(Exception):
+    pass
+
+
+class FakeRedis:
+    """The few redis.Redis commands RedisSessionStore uses, with expiry on a fake clock."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.data = {}
+        self.expires = {}
+        # Bumped on every write, for WATCH
+        self.versions = {}
+
+    def _written(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _live(self, key):
+        if key in self.expires and self.expires[key] <= self.now:
+            del self.data[key], self.expires[key]
+        return key in self.data
+
+    def get(self, key):
+        return self.data[key] if self._live(key) else None
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and self._live(key):
+            return None
+        self.data[key] = value
+        self._written(key)
+        self.expires.pop(key, None)
+        if ex is not None:
+            self.expires[key] = self.now + ex
+        return True
+
+    def expire(self, key, seconds):
+        if not self._live(key):
+            return False
+        self._written(key)
+        self.expires[key] = self.now + seconds
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            if self._live(key):
+                self._written(key)
+                del self.data[key]
+                self.expires.pop(key, None)
+
+    def lrange(self, key, start, end):
+        items = self.data[key] if self._live(key) else []
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def ltrim(self, key, start, end):
+        if self._live(key):
+            self._written(key)
+            self.data[key] = self.data[key][start:end + 1]
+
+    def rpush(self, key, *values):
+        if not self._live(key):
+            self.data[key] = []
+        self._written(key)
+        self.data[key].extend(value.encode("utf-8") for value in values)
+
+    def keys(self, pattern):
+        return [key for key in list(self.data) if self._live(key) and fnmatch.fnmatch(key, pattern)]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Queues commands for execute(); between watch() and multi() they run right away."""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+        self.watched = {}
+        self.immediate = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.watched = {}
+
+    def watch(self, *keys):
+        self.watched = {key: self.client.versions.get(key, 0) for key in keys}
+        self.immediate = True
+
+    def multi(self):
+        self.immediate = False
+
+    def __getattr__(self, name):
+        if self.immediate:
+            return getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.client, name), args, kwargs))
+        return queue
+
+    def execute(self):
+        if any(self.client.versions.get(key, 0) != version for key, version in self.watched.items()):
+            raise WatchError()
+        return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+
+
+def redis_store(ttl=100):
+    store = RedisSessionStore.__new__(RedisSessionStore)  # the redis package isn't needed with a fake client
+    store.client, store.prefix, store.ttl = FakeRedis(), "test", ttl
+    store._watch_error = WatchError
+    return store
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def store(request, tmp_path):
+    return SQLiteSessionStore(str(tmp_path / "sessions.db")) if request.param == "sqlite" else redis_store()
+
+
+@pytest.fixture(autouse=True)
+def new_process(monkeypatch):
+    """Forget decoded solutions, as a different replica would; call it again to forget them again."""
+    def forget():
+        monkeypatch.setattr(session_store, "_contents", OrderedDict())
+    forget()
+    return forget
+
+
+def started_session():
+    tutor = TutorSession()
+    tutor.start("Solve for x: 2x + 5 = 13", MathSolution.from_dict(linear_solution(2, 5, 13)))
+    tutor.answer("7", False, "Check the subtraction.")
+    return SimpleNamespace(problem_state=tutor.problem_state, chat_history=tutor.chat_history)
+
+
+def restored(store, session_id):
+    state = SimpleNamespace()
+    assert SessionPersistence(store, session_id).restore(state)
+    return state
+
+
+def progress(state):
+    return [step.progress.to_dict() for step in state.problem_state["solution"].steps]
+
+
+def test_flush_restore_round_trip(store, new_process):
+    session = started_session()
+    persistence = SessionPersistence(store, "sid")
+    persistence.flush(session)
+    assert persistence.error is None
+
+    new_process()
+    state = restored(store, "sid")
+    assert state.chat_history == session.chat_history
+    assert progress(state) == progress(session)
+    assert state.problem_state["steps"][0].question == session.problem_state["steps"][0].question
+    assert state.problem_state["current_step"] == 0
+
+    # Messages edited in place, added and dropped all reach the store
+    session.chat_history[1] = dict(session.chat_history[1], content="edited")
+    session.chat_history.append({"role": "user", "content": "8"})
+    persistence.flush(session)
+    assert restored(store, "sid").chat_history == session.chat_history
+    del session.chat_history[-2:]
+    persistence.flush(session)
+    assert restored(store, "sid").chat_history == session.chat_history
+
+
+def test_restore_of_an_unknown_session(store):
+    assert not SessionPersistence(store, "nobody").restore(SimpleNamespace())
+
+
+def test_saving_a_state_keeps_its_solution_alive(new_process):
+    store = redis_store(ttl=100)
+    session = started_session()
+    persistence = SessionPersistence(store, "sid")
+    persistence.flush(session)
+
+    # The blob was written once, at time 0; the student keeps working
+    store.client.now = 60
+    session.chat_history.append({"role": "user", "content": "8"})
+    persistence.flush(session)
+
+    store.client.now = 130
+    new_process()
+    assert progress(restored(store, "sid")) == progress(session)
+
+
+def test_an_expired_solution_is_written_again(new_process):
+    store = redis_store(ttl=100)
+    session = started_session()
+    persistence = SessionPersistence(store, "sid")
+    persistence.flush(session)
+
+    store.client.delete(*store.client.keys("test:blob:*"))
+    session.chat_history.append({"role": "user", "content": "8"})
+    persistence.flush(session)
+    assert persistence.error is None
+
+    new_process()
+    assert progress(restored(store, "sid")) == progress(session)
+
+
+def test_a_stale_copy_of_a_session_saves_nothing(store):
+    session = started_session()
+    first = SessionPersistence(store, "sid")
+    first.flush(session)
+    second = SessionPersistence(store, "sid")
+    other = restored(store, "sid")
+    assert second.restore(other)
+
+    session.chat_history.append({"role": "user", "content": "8"})
+    first.flush(session)
+    other.chat_history.append({"role": "user", "content": "9"})
+    other.problem_state["current_step"] = 1
+    second.flush(other)
+    assert second.conflict and second.error
+    assert restored(store, "sid").chat_history == session.chat_history
+
+    # Reloaded, it carries on from the version that was saved
+    assert second.restore(other)
+    assert not second.conflict
+    assert other.chat_history == session.chat_history
+    other.chat_history.append({"role": "user", "content": "9"})
+    second.flush(other)
+    assert second.error is None
+    assert restored(store, "sid").chat_history == other.chat_history
+
+
+def test_a_save_racing_another_between_watch_and_exec_conflicts(monkeypatch, new_process):
+    store = redis_store()
+    session = started_session()
+    persistence = SessionPersistence(store, "sid")
+    persistence.flush(session)
+
+    watch = FakePipeline.watch
+
+    def watch_then_lose_the_race(pipe, *keys):
+        watch(pipe, *keys)
+        store.client.set("test:session:sid:state", b"saved by another worker")
+    monkeypatch.setattr(FakePipeline, "watch", watch_then_lose_the_race)
+    session.chat_history.append({"role": "user", "content": "8"})
+    persistence.flush(session)
+    assert persistence.conflict
+    assert store.load_state("sid") == b"saved by another worker"
+    assert len(store.load_messages("sid")) == len(session.chat_history) - 1
+
+
+class SessionState(SimpleNamespace):
+    def __contains__(self, name):
+        return name in vars(self)
+
+
+def test_streamlit_reloads_a_session_saved_by_another_tab(store, monkeypatch):
+    monkeypatch.setattr(session_store, "get_session_store", lambda: store)
+    tab, other_tab = SessionState(**vars(started_session())), SessionState()
+    query_params = {}
+    restore_session(tab, query_params)
+    tab.persistence.flush(tab)
+    restore_session(other_tab, dict(query_params))
+
+    other_tab.chat_history.append({"role": "user", "content": "8"})
+    other_tab.persistence.flush(other_tab)
+    tab.chat_history.append({"role": "user", "content": "9"})
+    tab.persistence.flush(tab)
+    assert tab.persistence.conflict
+
+    assert restore_session(tab, query_params) is tab.persistence
+    assert tab.chat_history == other_tab.chat_history
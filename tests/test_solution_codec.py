@@ -0,0 +1,104 @@
+import pytest
+
+import solution as codec
+from solution import MathSolution, SolutionContent, StepContent, StepProgress
+
+
+def content(hints=("Start with the constant.",), accepted=("x=4", "x = 4")) -> SolutionContent:
+    return SolutionContent(
+        steps=[
+            StepContent("Subtract 5 from both sides.", "What is 13 - 5?", "8", "13 - 5 = 8",
+                        graph_query="plot y = 2x + 5", graph_image=b"\x89PNG", hints=hints),
+            StepContent("Divide both sides by 2.", "What is x?", "4", "8 / 2 = 4",
+                        accepted_answers=accepted),
+        ],
+        final_answer="x = 4",
+        original_problem="Solve for x: 2x + 5 = 13",
+    )
+
+
+def encode_old(content: SolutionContent, version: int) -> bytes:
+    """The layout of schema versions 1 (no hints) and 2 (no accepted answers)."""
+    out = [codec._HEADER.pack(codec.MAGIC, version)]
+    codec._pack_str(out, content.original_problem)
+    codec._pack_str(out, content.final_answer)
+    out.append(codec._U16.pack(len(content.steps)))
+    for step in content.steps:
+        for text in (step.instruction, step.question, step.answer, step.explanation):
+            codec._pack_str(out, text)
+        codec._pack_optional(out, step.graph_query.encode("utf-8") if step.graph_query is not None else None)
+        codec._pack_optional(out, step.graph_image)
+        if version >= 2:
+            out.append(codec._U8.pack(len(step.hints)))
+            for hint in step.hints:
+                codec._pack_str(out, hint)
+    return b"".join(out)
+
+
+def test_round_trip():
+    original = content()
+    data = codec.encode(original)
+    assert data[:5] == codec._HEADER.pack(codec.MAGIC, codec.SCHEMA_VERSION)
+    assert codec.decode(data) == original
+
+
+def test_round_trip_without_images():
+    decoded = codec.decode(codec.encode(content(), include_images=False))
+    assert decoded.steps[0].graph_image is None
+    assert decoded.steps[0].graph_query == "plot y = 2x + 5"
+
+
+def test_accepted_answers_are_encoded_in_a_stable_order():
+    assert codec.encode(content(accepted=("x = 4", "x=4"))) == codec.encode(content(accepted=("x=4", "x = 4")))
+
+
+def test_decodes_v2_without_accepted_answers():
+    decoded = codec.decode(encode_old(content(), 2))
+    assert decoded == content(accepted=())
+    assert decoded.steps[0].hints == ("Start with the constant.",)
+
+
+def test_decodes_v1_without_hints():
+    decoded = codec.decode(encode_old(content(), 1))
+    assert decoded == content(hints=(), accepted=())
+    assert decoded.steps[0].graph_image == b"\x89PNG"
+
+
+def test_counts_up_to_the_u8_limit_round_trip():
+    # The step's own answer is one of its accepted answers
+    original = content(hints=[f"hint {i}" for i in range(255)], accepted=[f"x = {i}" for i in range(100, 354)])
+    assert len(original.steps[1].accepted_answers) == 255
+    assert codec.decode(codec.encode(original)) == original
+
+
+@pytest.mark.parametrize("field", ["hints", "accepted"])
+def test_counts_over_the_u8_limit_are_rejected(field):
+    too_many = [f"x = {i}" for i in range(256)]
+    with pytest.raises(ValueError, match="at most 255"):
+        codec.encode(content(**{field: too_many}))
+
+
+def test_rejects_foreign_and_corrupt_data():
+    data = codec.encode(content())
+    with pytest.raises(ValueError, match="Not an encoded solution"):
+        codec.decode(b"JUNK" + data[4:])
+    with pytest.raises(ValueError, match="Unsupported"):
+        codec.decode(codec._HEADER.pack(codec.MAGIC, 99) + data[5:])
+    with pytest.raises(ValueError):
+        codec.decode(data[:-3])
+
+
+def test_progress_round_trip():
+    attempts = [{"user_answer": "7", "is_correct": False}, {"user_answer": "8", "is_correct": True}]
+    progress = [StepProgress(hint_count=2, attempt_count=2, user_attempts=attempts, user_correct=True),
+                StepProgress()]
+    decoded = codec.decode_progress(codec.encode_progress(progress))
+    assert [step.to_dict() for step in decoded] == [step.to_dict() for step in progress]
+
+
+def test_solutions_share_content_but_not_progress():
+    first = MathSolution(content())
+    second = first.fresh()
+    first.steps[0].hint_count = 1
+    assert second.content is first.content
+    assert second.steps[0].hint_count == 0
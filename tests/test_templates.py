@@ -0,0 +1,90 @@
+from fractions import Fraction
+
+from templates import ProblemTemplateIndex, canonicalize
+
+
+def linear_solution(a: int, b: int, c: int) -> dict:
+    """A structured solution of "Solve for x: ax + b = c", worded like the structuring call's."""
+    x = (c - b) // a
+    return {
+        "steps": [
+            {
+                "instruction": f"Isolate the term with $x$ by subtracting ${b}$ from both sides.",
+                "question": f"What is ${c} - {b}$?",
+                "answer": str(c - b),
+                "explanation": f"Subtracting ${b}$ from ${c}$ gives ${c - b}$, so ${a}x = {c - b}$.",
+                "hints": [f"Work out ${c} - {b}$."],
+                "graph_query": f"plot y = {a}x + {b}",
+            },
+            {
+                "instruction": "Divide both sides by the coefficient of $x$.",
+                "question": f"What is $x$ when ${a}x = {c - b}$?",
+                "answer": str(x),
+                "explanation": f"Dividing ${c - b}$ by ${a}$ gives $x = {x}$.",
+                "accepted_answers": [f"x = {x}"],
+            },
+        ],
+        "final_answer": f"x = {x}",
+        "original_problem": f"Solve for x: {a}x + {b} = {c}",
+    }
+
+
+def mod_solution(a: int, b: int) -> dict:
+    return {
+        "steps": [
+            {
+                "instruction": f"Divide ${a}$ by ${b}$ and keep the remainder.",
+                "question": f"What is ${a}$ mod ${b}$?",
+                "answer": str(a % b),
+                "explanation": f"The remainder of ${a}$ divided by ${b}$ is ${a % b}$.",
+            },
+        ],
+        "final_answer": str(a % b),
+        "original_problem": f"What is {a} mod {b}?",
+    }
+
+
+def test_canonicalize_keeps_exponents_in_the_shape():
+    assert canonicalize("Solve for x: 2x + 5 = 13") == ("solve for x:#x+#=#", [Fraction(2), Fraction(5), Fraction(13)])
+    assert canonicalize("x^2 = 9")[0] == "x^2=#"
+
+
+def test_linear_template_is_served_once_confirmed():
+    index = ProblemTemplateIndex(enabled=True)
+    index.learn("Solve for x: 2x + 5 = 13", linear_solution(2, 5, 13))
+    index.learn("Solve for x: 3x + 7 = 22", linear_solution(3, 7, 22))
+    # Induced from two samples, not yet checked on one it didn't see
+    assert index.lookup("Solve for x: 4x + 1 = 9") is None
+
+    index.learn("Solve for x: 5x + 2 = 17", linear_solution(5, 2, 17))
+    solution = index.lookup("Solve for x: 4x + 1 = 9")
+    assert solution is not None
+    assert solution["final_answer"] == "x = 2"
+    assert [step["answer"] for step in solution["steps"]] == ["8", "2"]
+    assert solution["steps"][0]["graph_query"] == "plot y = 4x + 1"
+    assert solution["steps"][1]["accepted_answers"] == ["x = 2"]
+    assert index.stats()["confirmed"] == 1
+
+
+def test_mod_template_is_never_served():
+    index = ProblemTemplateIndex(enabled=True)
+    index.learn("What is 7 mod 3?", mod_solution(7, 3))
+    index.learn("What is 10 mod 4?", mod_solution(10, 4))
+    # 1 and 2 both fit c0 - 2 * c1, which is wrong for 11 mod 3 and 9 mod 2
+    assert index.lookup("What is 11 mod 3?") is None
+    assert index.lookup("What is 9 mod 2?") is None
+
+    index.learn("What is 9 mod 2?", mod_solution(9, 2))
+    index.learn("What is 11 mod 3?", mod_solution(11, 3))
+    for a, b in [(11, 3), (9, 2), (17, 5)]:
+        solution = index.lookup(f"What is {a} mod {b}?")
+        assert solution is None or solution["final_answer"] == str(a % b)
+    assert index.stats()["usable"] == 0
+
+
+def test_disabled_index_learns_nothing():
+    index = ProblemTemplateIndex(enabled=False)
+    for a, b, c in [(2, 5, 13), (3, 7, 22), (5, 2, 17)]:
+        index.learn(f"Solve for x: {a}x + {b} = {c}", linear_solution(a, b, c))
+    assert index.lookup("Solve for x: 4x + 1 = 9") is None
+    assert index.stats()["shapes"] == 0
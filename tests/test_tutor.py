@@ -0,0 +1,136 @@
+import pytest
+
+from solution import MathSolution
+from test_templates import linear_solution
+from tutor import MAX_ATTEMPTS, MAX_HINTS, TutorError, TutorSession
+
+
+@pytest.fixture
+def session():
+    session = TutorSession()
+    session.start("Solve for x: 2x + 5 = 13", MathSolution.from_dict(linear_solution(2, 5, 13)))
+    return session
+
+
+def events(messages):
+    return [message["event"] for message in messages]
+
+
+def test_idle_session_refuses_actions():
+    session = TutorSession()
+    assert session.status == "idle"
+    for action in (lambda: session.answer("4", True, ""), session.hint, lambda: session.finish(""), session.close):
+        with pytest.raises(TutorError):
+            action()
+    assert session.chat_history == []
+
+
+def test_start_posts_the_first_step(session):
+    assert session.status == "in_progress"
+    assert events(session.chat_history) == ["problem", "step"]
+    assert session.chat_history[-1]["requires_input"]
+    assert session.problem_state['awaiting_answer']
+    assert session.take_sheet_rows()[0]["user_feedback"] == "Started new problem"
+    assert session.take_sheet_rows() == []
+
+
+def test_correct_answers_walk_to_completion(session):
+    assert events(session.answer("8", True, "Yes.")) == ["verdict", "step"]
+    assert session.problem_state['current_step'] == 1
+    assert events(session.answer("4", True, "Yes.")) == ["verdict", "final_answer"]
+    assert session.status == "complete"
+    assert session.needs_summary
+    assert not session.problem_state['awaiting_answer']
+    with pytest.raises(TutorError):
+        session.answer("4", True, "")
+
+    assert events(session.finish("Well done.")) == ["summary"]
+    assert not session.needs_summary
+    row = session.take_sheet_rows()[-1]
+    assert (row["current_step"], row["user_input"], row["problem_summary"]) == ("complete", "4", "Well done.")
+
+    closed = session.close()
+    assert closed['summary'] == "Well done."
+    assert session.status == "idle"
+
+
+def test_wrong_answers_count_down_then_reveal(session):
+    for attempts_left in range(MAX_ATTEMPTS - 1, 0, -1):
+        (message,) = session.answer("7", False, "Check the subtraction.")
+        assert message["attempts_left"] == attempts_left
+        assert message["requires_input"]
+    assert session.problem_state['current_step'] == 0
+
+    messages = session.answer("7", False, "Check the subtraction.")
+    assert events(messages) == ["reveal", "step"]
+    assert messages[0]["answer"] == "8"
+    step = session.problem_state['steps'][0]
+    assert not step.user_correct
+    assert [attempt["user_answer"] for attempt in step.user_attempts] == ["7"] * MAX_ATTEMPTS
+    assert session.take_sheet_rows()[-1]["user_feedback"] == "Max attempts reached, showing solution"
+
+
+def test_hints_run_out(session):
+    step = session.current_step
+    shown = [session.hint()[0] for _ in range(MAX_HINTS)]
+    # The pre-generated hint first, then the explanation
+    assert [message["content"] for message in shown] == [step.hints[0]] + [step.explanation] * (MAX_HINTS - 1)
+    assert shown[-1]["hints_left"] == 0
+    with pytest.raises(TutorError):
+        session.hint()
+    assert step.hint_count == MAX_HINTS
+
+
+def test_custom_hint_records_the_question(session):
+    (message,) = session.custom_hint("why subtract?", "To undo the +5.")
+    assert (message["event"], message["question"], message["content"]) == ("hint", "why subtract?", "To undo the +5.")
+    session.answer("18", False, "")
+    assert session.previous_attempts() == ["18"]
+
+
+def test_exam_grades_every_step_at_once():
+    session = TutorSession()
+    session.start("Solve for x: 2x + 5 = 13", MathSolution.from_dict(linear_solution(2, 5, 13)), exam=True)
+    assert session.status == "exam"
+    assert session.current_step is None
+    with pytest.raises(TutorError, match="exam form"):
+        session.answer("8", True, "")
+
+    messages = session.grade_exam(["8", "5"], [(True, "Yes."), (False, "Divide by 2.")])
+    assert events(messages) == ["verdict", "verdict", "final_answer"]
+    assert messages[-1]["score"] == 1
+    assert session.status == "complete"
+    with pytest.raises(TutorError):
+        session.grade_exam(["8", "4"], [(True, ""), (True, "")])
+
+    session.finish("Half right.")
+    assert session.take_sheet_rows()[-1]["user_feedback"].startswith("Exam submitted (1/2 correct")
+
+
+def test_snapshot_tracks_the_current_step(session):
+    session.hint()
+    session.answer("7", False, "")
+    snapshot = session.snapshot()
+    assert snapshot["status"] == "in_progress"
+    assert snapshot["question"] == session.current_step.question
+    assert (snapshot["attempts_left"], snapshot["hints_left"]) == (MAX_ATTEMPTS - 1, MAX_HINTS - 1)
+    assert snapshot["final_answer"] is None
+
+
+def test_guards_raise_without_recording_anything(session):
+    assert session.answerable_step() is session.current_step
+    with pytest.raises(TutorError, match="no exam"):
+        session.gradable_exam(["8", "4"])
+
+    exam = TutorSession()
+    exam.start("Solve for x: 2x + 5 = 13", MathSolution.from_dict(linear_solution(2, 5, 13)), exam=True)
+    messages = len(exam.chat_history)
+    with pytest.raises(TutorError, match="exam form"):
+        exam.answerable_step()
+    with pytest.raises(TutorError, match="Expected 2 answers"):
+        exam.gradable_exam(["8"])
+    with pytest.raises(TutorError, match="Expected 2 verdicts"):
+        exam.grade_exam(["8", "4"], [(True, "Yes.")])
+    assert exam.status == "exam"
+    assert len(exam.chat_history) == messages
+    assert all(not step.user_attempts for step in exam.problem_state['steps'])
@@ -0,0 +1,299 @@
+import json
+import time
+
+from solution import MathSolution
+
+# A step is revealed after this many wrong answers, and offers at most this many hints
+MAX_ATTEMPTS = 3
+MAX_HINTS = 3
+
+
+class TutorError(Exception):
+    """Raised for an action that doesn't fit the session's state, e.g. an answer with no problem open."""
+
+
+def new_problem_state() -> dict:
+    return {
+        'original_problem': None,
+        'steps': None,
+        'current_step': 0,
+        'expected_answer': None,
+        'variables': set(),
+        'awaiting_answer': False,
+        'final_answer': None,
+        'solution': None
+    }
+
+
+class TutorSession:
+    """
+    The step, attempt and hint rules of a tutoring session, without any UI or API calls.
+
+    State is kept in the same `problem_state` dict and `chat_history` list the Streamlit app
+    keeps in st.session_state, so a session can be persisted with session_store and picked up
+    by either front end. Callers make the model calls (solve, validate, hint, summary) and
+    pass the results in; every action appends its chat messages and returns them. Messages
+    carry an "event" field (problem, exam, step, verdict, reveal, final_answer, hint, summary,
+    error) for clients that don't render chat text. Rows for the Sheets log pile up in
+    `sheet_rows` until the caller takes them with take_sheet_rows(), so each action costs one
+    batched write.
+
+    A session moves idle -> in_progress (or exam) -> complete, and close() puts a finished
+    problem away to go back to idle. Actions that don't fit the current status raise
+    TutorError without changing anything.
+    """
+
+    def __init__(self, problem_state: dict = None, chat_history: list = None):
+        self.problem_state = problem_state if problem_state is not None else new_problem_state()
+        self.chat_history = chat_history if chat_history is not None else []
+        self.sheet_rows = []
+
+    @property
+    def status(self) -> str:
+        """
+        "idle" before a problem, "in_progress" while steps remain, "exam" while an exam waits
+        for its answers, then "complete".
+        """
+        steps = self.problem_state['steps']
+        if steps is None:
+            return "idle"
+        if self.problem_state['current_step'] >= len(steps):
+            return "complete"
+        exam = self.problem_state.get('exam')
+        return "exam" if exam and not exam['submitted'] else "in_progress"
+
+    @property
+    def current_step(self):
+        if self.status != "in_progress":
+            return None
+        return self.problem_state['steps'][self.problem_state['current_step']]
+
+    @property
+    def needs_summary(self) -> bool:
+        return self.status == "complete" and self.problem_state.get('summary') is None
+
+    def take_sheet_rows(self) -> list:
+        rows, self.sheet_rows = self.sheet_rows, []
+        return rows
+
+    def _say(self, content: str, event: str, requires_input: bool = False, step_num: int = None, **data) -> dict:
+        message = {
+            "role": "assistant",
+            "content": content,
+            "timestamp": time.strftime("%H:%M"),
+            "requires_input": requires_input,
+            "event": event,
+            **data
+        }
+        if step_num is not None:
+            message["step_num"] = step_num
+        self.chat_history.append(message)
+        return message
+
+    def _log(self, user_input, correct_answer, user_feedback: str, current_step=None, hint: str = None,
+             problem_summary: str = None):
+        self.sheet_rows.append({
+            "original_problem": self.problem_state['original_problem'],
+            "current_step": self.problem_state['current_step'] + 1 if current_step is None else current_step,
+            "user_input": user_input,
+            "correct_answer": correct_answer,
+            "hint": hint,
+            "final_answer": self.problem_state['final_answer'],
+            "problem_summary": problem_summary,
+            "user_feedback": user_feedback
+        })
+
+    def _step_message(self) -> dict:
+        index = self.problem_state['current_step']
+        step = self.problem_state['steps'][index]
+        self.problem_state['awaiting_answer'] = True
+        return self._say(f"**Step {index + 1}:** {step.instruction}\n\n{step.question}", "step",
+                         requires_input=True, step_num=index, instruction=step.instruction, question=step.question)
+
+    def start(self, problem: str, solution: MathSolution, exam: bool = False) -> list:
+        """
+        Open a solved problem and post its first step or, in `exam` mode, ask for every step's
+        answer at once (see grade_exam).
+        """
+        self.problem_state = new_problem_state()
+        self.problem_state.update({
+            'original_problem': problem,
+            'steps': solution.steps,
+            'final_answer': solution.final_answer,
+            'solution': solution,
+            'summary': None,
+        })
+        start = len(self.chat_history)
+        self._say(f"Let's solve this problem step by step: {problem}", "problem",
+                  problem=problem, step_count=len(solution.steps))
+        if exam:
+            self.problem_state['exam'] = {'started_at': time.time(), 'submitted': False}
+            self._say(f"Exam mode: answer all {len(solution.steps)} steps below, then submit them together.", "exam",
+                      step_count=len(solution.steps))
+        else:
+            self._step_message()
+        self._log(problem, None, "Started new problem", current_step=0)
+        return self.chat_history[start:]
+
+    def answer(self, user_answer: str, is_correct: bool, explanation: str) -> list:
+        """Apply a validated answer to the current step: advance, retry, or reveal after MAX_ATTEMPTS."""
+        step = self.answerable_step()
+        index = self.problem_state['current_step']
+        start = len(self.chat_history)
+        step.user_attempts.append({"user_answer": user_answer, "is_correct": is_correct})
+        hint = step.explanation if step.hint_count > 0 else None
+
+        if is_correct:
+            step.user_correct = True
+            self._say(f"✅ Correct! {explanation}", "verdict", step_num=index, is_correct=True)
+            self._log(user_answer, step.answer, "Correct answer", hint=hint)
+            self._advance(user_answer, step.answer, f"Great job! The final answer is: {self.problem_state['final_answer']}")
+            return self.chat_history[start:]
+
+        step.attempt_count += 1
+        attempts_left = MAX_ATTEMPTS - step.attempt_count
+        if attempts_left > 0:
+            self._say(f"❌ That's not quite right. {explanation}\nYou have {attempts_left} attempts left.", "verdict",
+                      requires_input=True, step_num=index, is_correct=False, attempts_left=attempts_left)
+            self._log(user_answer, step.answer, f"Incorrect answer (Attempt {step.attempt_count})", hint=hint)
+            return self.chat_history[start:]
+
+        step.user_correct = False
+        self._say(f"❌ That's not quite right. {explanation}\nThe correct answer is: {step.answer}", "reveal",
+                  step_num=index, is_correct=False, answer=step.answer)
+        self._log(user_answer, step.answer, f"Incorrect answer (Attempt {step.attempt_count})", hint=hint)
+        self._log(user_answer, step.answer, "Max attempts reached, showing solution", hint=step.explanation)
+        self._advance(user_answer, step.answer, f"The final answer is: {self.problem_state['final_answer']}")
+        return self.chat_history[start:]
+
+    def _advance(self, user_answer: str, correct_answer: str, final_message: str):
+        self.problem_state['current_step'] += 1
+        if self.status == "in_progress":
+            self._step_message()
+            return
+        self.problem_state['awaiting_answer'] = False
+        self._say(final_message, "final_answer", final_answer=self.problem_state['final_answer'])
+        # Logged once the summary is in, see finish()
+        self.problem_state['last_answer'] = (user_answer, correct_answer)
+
+    def grade_exam(self, answers: list, results: list) -> list:
+        """Apply one verdict per step to an exam, as (is_correct, explanation) pairs, and close it."""
+        exam = self.gradable_exam(answers)
+        steps = self.problem_state['steps']
+        if len(results) != len(steps):
+            raise TutorError(f"Expected {len(steps)} verdicts, got {len(results)}.")
+        start = len(self.chat_history)
+        elapsed = time.time() - exam['started_at']
+        for i, (step, answer, (is_correct, explanation)) in enumerate(zip(steps, answers, results)):
+            step.attempt_count = 1
+            step.user_correct = is_correct
+            step.user_attempts.append({"user_answer": answer, "is_correct": is_correct})
+            if is_correct:
+                content = f"**Step {i + 1}:** ✅ Correct! {explanation}"
+            else:
+                content = f"**Step {i + 1}:** ❌ {explanation}\nThe correct answer is: {step.answer}"
+            self._say(content, "verdict", step_num=i, is_correct=is_correct)
+
+        score = sum(1 for is_correct, _ in results if is_correct)
+        final_answer = self.problem_state['final_answer']
+        self._say(f"You got {score} of {len(steps)} steps right in {int(elapsed // 60)}m {int(elapsed % 60)}s. "
+                  f"The final answer is: {final_answer}", "final_answer", final_answer=final_answer, score=score)
+        exam['submitted'] = True
+        self.problem_state['current_step'] = len(steps)
+        self.problem_state['awaiting_answer'] = False
+        self.problem_state['last_answer'] = (json.dumps(answers), json.dumps([step.answer for step in steps]))
+        self.problem_state['completion_note'] = f"Exam submitted ({score}/{len(steps)} correct in {elapsed:.0f}s)"
+        return self.chat_history[start:]
+
+    def answerable_step(self):
+        """The step waiting for an answer, else TutorError; check before spending a validation call."""
+        step = self.current_step
+        if step is None:
+            if self.status == "exam":
+                raise TutorError("Enter your answers in the exam form below and submit them together.")
+            raise TutorError("There is no step waiting for an answer.")
+        return step
+
+    def gradable_exam(self, answers: list) -> dict:
+        """The exam `answers` (one per step) are for, else TutorError; check before grading them."""
+        if self.status != "exam":
+            raise TutorError("There is no exam waiting for answers.")
+        steps = self.problem_state['steps']
+        if len(answers) != len(steps):
+            raise TutorError(f"Expected {len(steps)} answers, got {len(answers)}.")
+        return self.problem_state['exam']
+
+    def hint(self) -> list:
+        """The next pre-generated hint for the current step (the explanation for older solutions)."""
+        step = self.hintable_step()
+        hint = step.hints[step.hint_count] if step.hint_count < len(step.hints) else step.explanation
+        step.hint_count += 1
+        return [self._hint_message(step, hint)]
+
+    def custom_hint(self, question: str, hint: str) -> list:
+        """
+        Record a hint answering the student's own question. MathSolver.generate_custom_hint
+        already counts it against the step's hints.
+        """
+        step = self.current_step
+        if step is None:
+            raise TutorError("There is no step to ask about.")
+        return [self._hint_message(step, hint, question=question)]
+
+    def hintable_step(self):
+        """The current step if it can take another hint, else TutorError; check before asking for a custom hint."""
+        step = self.current_step
+        if step is None:
+            raise TutorError("Cannot show hints for a completed problem.")
+        if step.hint_count >= MAX_HINTS:
+            raise TutorError("You've reached the maximum number of hints for this step.")
+        return step
+
+    def _hint_message(self, step, hint: str, question: str = None) -> dict:
+        data = {"hints_left": max(0, MAX_HINTS - step.hint_count)}
+        if question is not None:
+            data["question"] = question
+        return self._say(hint, "hint", step_num=self.problem_state['current_step'], **data)
+
+    def previous_attempts(self) -> list:
+        step = self.current_step
+        return [attempt["user_answer"] for attempt in step.user_attempts] if step is not None else []
+
+    def finish(self, summary: str) -> list:
+        """Post the problem summary once every step is done."""
+        if self.status != "complete":
+            raise TutorError("The problem isn't finished yet.")
+        self.problem_state['summary'] = summary
+        user_answer, correct_answer = self.problem_state.pop('last_answer', (None, None))
+        note = self.problem_state.pop('completion_note', "Problem completed")
+        message = self._say(summary, "summary")
+        self._log(user_answer, correct_answer, note, current_step="complete", problem_summary=summary)
+        return [message]
+
+    def close(self) -> dict:
+        """Put the finished problem away so the next one can start; returns its problem_state."""
+        if self.status != "complete":
+            raise TutorError("The problem isn't finished yet.")
+        closed, self.problem_state = self.problem_state, new_problem_state()
+        return closed
+
+    def solve_failed(self, problem: str, error) -> list:
+        """Tell the student a problem they asked for couldn't be solved."""
+        return [self._say(f"Sorry, I couldn't solve \"{problem}\": {error}", "error", problem=problem)]
+
+    def snapshot(self) -> dict:
+        """JSON-safe view of where the session stands."""
+        step = self.current_step
+        steps = self.problem_state['steps']
+        return {
+            "status": self.status,
+            "problem": self.problem_state['original_problem'],
+            "step_count": len(steps) if steps is not None else 0,
+            "current_step": self.problem_state['current_step'],
+            "question": step.question if step is not None else None,
+            "attempts_left": MAX_ATTEMPTS - step.attempt_count if step is not None else None,
+            "hints_left": max(0, MAX_HINTS - step.hint_count) if step is not None else None,
+            "final_answer": self.problem_state['final_answer'] if self.status == "complete" else None,
+            "summary": self.problem_state.get('summary'),
+            "messages": len(self.chat_history),
+        }
@@ -0,0 +1,112 @@
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from memory import format_bytes, memory_monitor
+from profiler import render_profiler
+from settings import get_settings
+
+ADMIN_TOKEN = get_settings().admin_token
+
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+def sample_session_memory():
+    """Measure this session's state if it's due; called at the end of every script run."""
+    memory_monitor.sample(current_session_id(), st.session_state)
+
+def is_admin() -> bool:
+    return bool(ADMIN_TOKEN) and st.query_params.get("admin") == ADMIN_TOKEN
+
+def display_admin_panel():
+    """Memory and rendering costs, for ?admin=<ADMIN_TOKEN>."""
+    display_memory_panel()
+    display_render_panel()
+
+def display_memory_panel():
+    """Memory held per session and allocation growth."""
+    with st.expander("Admin: memory", expanded=True):
+        if st.button("Measure this session now", key="admin_measure"):
+            memory_monitor.sample(current_session_id(), st.session_state, force=True)
+            if memory_monitor.tracemalloc_frames > 0:
+                memory_monitor.diff_allocations()
+
+        report = memory_monitor.snapshot()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Sessions tracked", len(report["sessions"]))
+        col2.metric("Session state", format_bytes(report["tracked_bytes"]))
+        col3.metric("Process RSS", format_bytes(report["rss"]) if report["rss"] else "n/a")
+        if not memory_monitor.enabled:
+            st.caption("Periodic sampling is off (MEMORY_SAMPLE_SECONDS=0), only manual measurements are shown.")
+
+        st.caption("Sessions, largest first")
+        st.dataframe([
+            {
+                "session": session["session_id"][:8],
+                "total": format_bytes(session["total"]),
+                "growth": format_bytes(session["growth"]),
+                "samples": session["samples"],
+                "largest keys": ", ".join(
+                    f"{key} {format_bytes(size)}"
+                    for key, size in sorted(session["keys"].items(), key=lambda item: item[1], reverse=True)[:3]
+                ),
+                "measured": f"{session['measured_seconds_ago']:.0f}s ago",
+            }
+            for session in report["sessions"]
+        ], use_container_width=True)
+
+        this_session = next((s for s in report["sessions"] if s["session_id"] == current_session_id()), None)
+        if this_session:
+            st.caption("This session by key")
+            st.dataframe([
+                {"key": key, "keys": this_session["counts"].get(key, 1), "size": format_bytes(size)}
+                for key, size in sorted(this_session["keys"].items(), key=lambda item: item[1], reverse=True)
+            ], use_container_width=True)
+
+        if report["allocation_growth"]:
+            st.caption("Allocation growth since the previous tracemalloc snapshot")
+            st.dataframe([
+                {"location": line["location"], "grew": format_bytes(line["size_diff"]),
+                 "blocks": line["count_diff"], "now": format_bytes(line["size"])}
+                for line in report["allocation_growth"]
+            ], use_container_width=True)
+        elif memory_monitor.tracemalloc_frames <= 0:
+            st.caption("Set MEMORY_TRACEMALLOC_FRAMES to trace allocation growth between samples.")
+
+def display_render_panel():
+    """Where script runs spend their time: the previous run of this session and every run since startup."""
+    with st.expander("Admin: rendering", expanded=True):
+        if not render_profiler.enabled:
+            st.caption("Set RENDER_PROFILE=1 to time each script run.")
+            return
+
+        last = st.session_state.get("last_render")
+        if last:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Previous run", f"{last['seconds'] * 1000:.0f} ms")
+            col2.metric("Runs in its action", last["action_runs"])
+            col3.metric("Chat messages", f"{last['messages']} in {last['messages_seconds'] * 1000:.0f} ms")
+            st.bar_chart({name: seconds * 1000 for name, seconds in last["sections"].items()})
+            if last["slowest_messages"]:
+                st.caption("Slowest messages: " + ", ".join(
+                    f"#{message['index']} {message['kind']} {message['seconds'] * 1000:.0f} ms"
+                    for message in last["slowest_messages"]
+                ))
+
+        report = render_profiler.snapshot()
+        if report["runs"]:
+            st.caption(f"All sessions: {report['runs']['count']} runs, p50 {report['runs']['p50_ms']:.0f} ms, "
+                       f"p95 {report['runs']['p95_ms']:.0f} ms; runs per action: "
+                       + ", ".join(f"{reruns + 1}: {count}" for reruns, count in report["reruns_per_action"].items()))
+            st.dataframe([
+                {"section": name, "runs": stats["count"], "mean ms": round(stats["mean_ms"], 1),
+                 "p50 ms": round(stats["p50_ms"], 1), "p95 ms": round(stats["p95_ms"], 1)}
+                for name, stats in sorted(report["sections"].items(), key=lambda item: item[1]["p95_ms"], reverse=True)
+            ], use_container_width=True)
+
+        if report["slowest"]:
+            labels = [f"{entry['at']} {entry['seconds'] * 1000:.0f} ms" for entry in report["slowest"]]
+            chosen = st.selectbox("Slow run profiles", labels, key="admin_profile")
+            st.code(report["slowest"][labels.index(chosen)]["profile"], language=None)
+        elif render_profiler.capture == "off":
+            st.caption("Set RENDER_PROFILE_CAPTURE=cprofile or sample to keep profiles of slow runs.")
@@ -0,0 +1,46 @@
+import streamlit as st
+
+# (button label, LaTeX preview, text appended to the input)
+ADVANCED_OPS = [
+    ("d/dx", r"\frac{d}{dx}", " d/dx "),
+    ("∫", r"\int", "∫() dx "),
+    ("∫_a^b", r"\int_{a}^{b}", "∫_a^b () dx "),
+    ("lim", r"\lim_{x \to }", "lim_{x→} () "),
+    ("Σ", r"\sum_{i=1}^{n}", "Σ_{i=1}^n () "),
+]
+FUNCTIONS = [
+    ("sin", "sin("),
+    ("cos", "cos("),
+    ("tan", "tan("),
+    ("log", "log("),
+    ("e^x", "e^("),
+]
+
+def append_to_input(text: str):
+    st.session_state.input_buffer += text
+    st.session_state.input_box = st.session_state.input_buffer
+
+def clear_input():
+    st.session_state.input_buffer = ""
+    st.session_state.input_box = ""
+
+def calculator_keypad():
+    """
+    Buttons that append operators and functions to the answer input. Meant to be rendered
+    inside the input_panel fragment, so a key press only reruns the input, not the chat.
+    """
+    with st.expander("Advanced Calculator"):
+        st.caption("Advanced Operations")
+        cols = st.columns(len(ADVANCED_OPS))
+        for col, (op, latex, text) in zip(cols, ADVANCED_OPS):
+            with col:
+                st.latex(latex)
+                st.button(op, key=f"adv_{op}", on_click=append_to_input, args=(text,), use_container_width=True)
+
+        st.caption("Functions")
+        cols = st.columns(len(FUNCTIONS) + 1)
+        for col, (func, text) in zip(cols, FUNCTIONS):
+            with col:
+                st.button(func, key=f"func_{func}", on_click=append_to_input, args=(text,), use_container_width=True)
+        with cols[-1]:
+            st.button("Clear", key="clear_expr", on_click=clear_input, use_container_width=True)
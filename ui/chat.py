@@ -1,290 +1,263 @@
 import streamlit as st
 import time
-from sheets import append_data_to_sheet
+from sheets import append_rows_to_sheet
 import json
 import logging
+from scheduler import HINT, SOLVE, SUMMARY, VALIDATE, Overloaded, get_scheduler
+from profiler import render_profiler
+from tutor import MAX_HINTS, TutorError, TutorSession
+from ui.calculator import calculator_keypad
+from ui.queue_status import format_wait, run_scheduled
+
+# Problems one student can have solving in the background at once
+MAX_QUEUED_PROBLEMS = 3
+SOLVE_POLL_SECONDS = 1.0
 
 def handle_user_input():
+    """
+    Apply the student's last action, then draw the input panel. This runs before the chat
+    is drawn, so the script run that follows an action already shows its outcome.
+    """
+    process_action()
+    input_panel()
+    submit_form()
+
+def tutor_session() -> TutorSession:
+    """The tutoring rules over this student's problem_state and chat_history, see tutor.TutorSession."""
+    return TutorSession(st.session_state.problem_state, st.session_state.chat_history)
+
+def queue_action(kind: str, **data):
+    """Record a student action for process_action; used as a widget callback so no extra run is needed."""
+    st.session_state.pending_action = {"kind": kind, **data}
+
+def queue_custom_hint(step_num: int):
+    queue_action("custom_hint", question=st.session_state.get(f"hint_question_{step_num}", "").strip())
+
+def process_action():
+    """
+    Apply the pending action to the tutoring session: at most one answer, hint or exam per
+    script run. The session's chat messages are rendered by display_chat_history in the same
+    run and its Sheets rows are sent together by flush_sheet_log once the page is drawn.
+    """
+    action = st.session_state.pop('pending_action', None)
+    if action is None:
+        return
+    session = tutor_session()
+    try:
+        if action["kind"] == "submit":
+            submit_input(session, action["text"])
+        elif action["kind"] == "hint":
+            session.hint()
+        elif action["kind"] == "custom_hint":
+            ask_custom_hint(session, action["question"])
+        elif action["kind"] == "exam":
+            grade_exam(session)
+    except TutorError as e:
+        st.warning(str(e))
+    except Exception as e:
+        logging.error(f"Error in process_action: {str(e)}")
+        st.error(f"An error occurred: {str(e)}")
+    finally:
+        apply_session(session)
+
+def apply_session(session: TutorSession):
+    st.session_state.problem_state = session.problem_state
+    st.session_state.setdefault('sheet_rows', []).extend(session.take_sheet_rows())
+
+def reset_input():
+    st.session_state.user_input = ''
+    st.session_state.input_buffer = ''
+    st.session_state.reset_input_box = True
+
+def submit_input(session: TutorSession, user_input: str):
+    st.session_state.user_input = user_input
+    if not user_input:
+        return
+    if session.status == "complete":
+        # Left finished by an interrupted run; make way for the next problem
+        session.close()
+    if session.status == "idle":
+        # Solved in the background, poll_solve_jobs starts it once it's ready
+        if queue_problem(user_input):
+            reset_input()
+        return
+
+    # Checked before spending a validation call, e.g. an exam waits for its form instead
+    step = session.answerable_step()
+    logging.debug("Starting handle_user_input")
+    solver = st.session_state.solver
+    # Known forms of the answer are accepted on the spot, only the rest are queued for the LLM
+    is_correct, explanation = solver.match_accepted_answer(step, user_input) or run_scheduled(
+        VALIDATE, solver.validate_step, step, user_input, message="Checking your answer..."
+    )
+    # Dump the results to a file for inspection
+    solver.dump_to_file({
+        "is_correct": is_correct,
+        "explanation": explanation,
+        "user_answer": user_input,
+        "correct_answer": step.answer,
+        "step_question": step.question
+    }, "debug_validation.txt")
+    logging.debug(f"Validation result - is_correct: {is_correct}, explanation: {explanation}")
+
+    index = session.problem_state['current_step']
+    session.answer(user_input, is_correct, explanation)
+    if session.problem_state['current_step'] != index:
+        reset_input()
+    complete_problem(session)
+
+def ask_custom_hint(session: TutorSession, question: str):
+    if not question:
+        return
+    # Checked before spending a model call
+    step = session.hintable_step()
+    hint = run_scheduled(
+        HINT, st.session_state.solver.generate_custom_hint, step, question, session.previous_attempts(),
+        message="Thinking about your question..."
+    )
+    session.custom_hint(question, hint)
+
+def grade_exam(session: TutorSession):
+    steps = session.problem_state['steps'] or []
+    answers = [st.session_state.get(f"exam_answer_{i}", "").strip() for i in range(len(steps))]
+    # A stale form raises TutorError before the grading call
+    session.gradable_exam(answers)
+    results = run_scheduled(VALIDATE, st.session_state.solver.validate_exam_answers,
+                            session.problem_state['solution'], answers, message="Grading your answers...")
+    session.grade_exam(answers, results)
+    complete_problem(session)
+
+def complete_problem(session: TutorSession):
+    """Once every step is done: summarize, ask for feedback and put the problem away for the next one."""
+    if session.status != "complete":
+        return
+    try:
+        summary = run_scheduled(
+            SUMMARY, st.session_state.solver.generate_problem_summary, session.problem_state['solution'],
+            message="Generating problem summary..."
+        )
+        session.finish(summary)
+    finally:
+        closed = session.close()
+        st.session_state.completed_problem = {
+            "original_problem": closed['original_problem'],
+            "final_answer": closed['final_answer'],
+        }
+        st.session_state.show_feedback_form = True
+
+def flush_sheet_log():
+    """Send the Sheets rows logged during this script run in one request; called once the page is drawn."""
+    rows = st.session_state.get('sheet_rows')
+    if rows:
+        st.session_state.sheet_rows = []
+        append_rows_to_sheet([json.dumps(row) for row in rows])
+
+@st.fragment
+def input_panel():
+    """
+    The input box and calculator keys. Typing and key presses rerun only this fragment; the
+    Submit button is drawn outside it, see submit_form.
+    """
     if st.session_state.reset_input_box:
         st.session_state.input_box = ''
         st.session_state.reset_input_box = False
 
     # Render the input box outside the form
     main_input_box()
+    calculator_keypad()
 
-    with st.container():
-        with st.form(key='problem_form'):
-            submit_button = st.form_submit_button("Submit")
-
-        if submit_button:
-            st.session_state.user_input_submitted = True
-            st.session_state.user_input = st.session_state.input_box
-            # Update the input buffer when the form is submitted
-            st.session_state.input_buffer = st.session_state.input_box
-
-    if st.session_state.user_input_submitted:
-        st.session_state.user_input_submitted = False
-        user_input = st.session_state.input_box
-        st.session_state.user_input = user_input
-
-        if user_input:
-            if st.session_state.problem_state['steps'] is None:
-                st.session_state.problem_state['original_problem'] = user_input
-                with st.spinner("Processing the problem, this could take a few minutes due to high traffic..."):
-                    try:
-                        solution = st.session_state.solver.get_math_solution(user_input)
-                        st.session_state.problem_state['steps'] = solution.steps
-                        st.session_state.problem_state['final_answer'] = solution.final_answer
-                        st.session_state.problem_state['current_step'] = 0
-                        st.session_state.problem_state['awaiting_answer'] = True
-                        st.session_state.problem_state['solution'] = solution
-
-                        st.session_state.chat_history.append({
-                            "role": "assistant",
-                            "content": f"Let's solve this problem step by step: {user_input}",
-                            "timestamp": time.strftime("%H:%M"),
-                            "requires_input": False
-                        })
-
-                        current_step = st.session_state.problem_state['current_step']
-                        step = st.session_state.problem_state['steps'][current_step]
-                        st.session_state.chat_history.append({
-                            "role": "assistant",
-                            "content": f"**Step {current_step +1}:** {step.instruction}\n\n{step.question}",
-                            "timestamp": time.strftime("%H:%M"),
-                            "requires_input": True,
-                            "step_num": current_step
-                        })
-
-                        st.session_state.user_input = ''
-                        st.session_state.input_buffer = ''
-                        st.session_state.reset_input_box = True
-                        st.session_state.problem_state['awaiting_answer'] = True
-
-                        data = {
-                            "original_problem": user_input,
-                            "current_step": 0,
-                            "user_input": user_input,
-                            "correct_answer": None,
-                            "hint": None,
-                            "final_answer": solution.final_answer,
-                            "problem_summary": None,
-                            "user_feedback": "Started new problem"
-                        }
-                        append_data_to_sheet(json.dumps(data))
-
-                    except Exception as e:
-                        st.error(f"Error processing problem: {str(e)}")
-            else:
-                current_step_index = st.session_state.problem_state['current_step']
-                steps = st.session_state.problem_state['steps']
-                current_step = steps[current_step_index]
-                expected_answer = current_step.answer
-
-                try:
-                    # Add debug logging at the start
-                    logging.debug("Starting handle_user_input")
-                    
-                    is_correct, explanation = st.session_state.solver.validate_step_answer_llm(user_input, expected_answer, current_step.question)
-                    
-                    # Dump the results to a file for inspection
-                    st.session_state.solver.dump_to_file({
-                        "is_correct": is_correct,
-                        "explanation": explanation,
-                        "user_answer": user_input,
-                        "correct_answer": expected_answer,
-                        "step_question": current_step.question
-                    }, "debug_validation.txt")
-                    
-                    # Add debug logging
-                    logging.debug(f"Validation result - is_correct: {is_correct}, explanation: {explanation}")
-                    
-                    if is_correct:
-                        current_step.user_correct = True
-                        st.session_state.chat_history.append({
-                            "role": "assistant",
-                            "content": f"✅ Correct! {explanation}",
-                            "timestamp": time.strftime("%H:%M"),
-                            "requires_input": False,
-                            "step_num": current_step_index
-                        })
-                        st.session_state.problem_state['current_step'] += 1
-                        st.session_state.user_input = ''
-                        st.session_state.input_buffer = ''
-                        st.session_state.reset_input_box = True
-                        if st.session_state.problem_state['current_step'] >= len(steps):
-                            st.session_state.chat_history.append({
-                                "role": "assistant",
-                                "content": f"Great job! The final answer is: {st.session_state.problem_state['final_answer']}",
-                                "timestamp": time.strftime("%H:%M"),
-                                "requires_input": False
-                            })
-
-                            with st.spinner("Generating problem summary..."):
-                                summary = st.session_state.solver.generate_problem_summary(
-                                    st.session_state.problem_state['solution']
-                                )
-                            st.session_state.chat_history.append({
-                                "role": "assistant",
-                                "content": summary,
-                                "timestamp": time.strftime("%H:%M"),
-                                "requires_input": False
-                            })
-
-                            st.session_state.show_feedback_form = True
-
-                            data = {
-                                "original_problem": st.session_state.problem_state['original_problem'],
-                                "current_step": "complete",
-                                "user_input": user_input,
-                                "correct_answer": expected_answer,
-                                "hint": None,
-                                "final_answer": st.session_state.problem_state['final_answer'],
-                                "problem_summary": summary,
-                                "user_feedback": "Problem completed"
-                            }
-                            append_data_to_sheet(json.dumps(data))
-
-                        else:
-                            next_step_num = st.session_state.problem_state['current_step']
-                            next_step = st.session_state.problem_state['steps'][next_step_num]
-                            st.session_state.chat_history.append({
-                                "role": "assistant",
-                                "content": f"**Step {next_step_num +1}:** {next_step.instruction}\n\n{next_step.question}",
-                                "timestamp": time.strftime("%H:%M"),
-                                "requires_input": True,
-                                "step_num": next_step_num
-                            })
-                            st.session_state.problem_state['awaiting_answer'] = True
-
-                        data = {
-                            "original_problem": st.session_state.problem_state['original_problem'],
-                            "current_step": current_step_index + 1,
-                            "user_input": user_input,
-                            "correct_answer": expected_answer,
-                            "hint": current_step.explanation if current_step.hint_count > 0 else None,
-                            "final_answer": st.session_state.problem_state['final_answer'],
-                            "problem_summary": None,
-                            "user_feedback": "Correct answer"
-                        }
-                        append_data_to_sheet(json.dumps(data))
+def submit_form():
+    """
+    The Submit button. It sits outside the input_panel fragment, so a click is one full app
+    run, and its callback queues the answer before that run's process_action applies it.
+    """
+    with st.form(key='problem_form'):
+        st.form_submit_button("Submit", on_click=submit_action)
 
-                    else:
-                        remaining_attempts = 3 - current_step.attempt_count
-                        current_step.attempt_count += 1
-
-                        if current_step.attempt_count >= 3:
-                            st.session_state.chat_history.append({
-                                "role": "assistant",
-                                "content": f"❌ That's not quite right. {explanation}\nThe correct answer is: {expected_answer}",
-                                "timestamp": time.strftime("%H:%M"),
-                                "requires_input": False,
-                                "step_num": current_step_index
-                            })
-                            current_step.user_correct = False
-
-                            st.session_state.problem_state['current_step'] += 1
-                            st.session_state.user_input = ''
-                            st.session_state.input_buffer = ''
-                            st.session_state.reset_input_box = True
-                            if st.session_state.problem_state['current_step'] >= len(steps):
-                                st.session_state.chat_history.append({
-                                    "role": "assistant",
-                                    "content": f"The final answer is: {st.session_state.problem_state['final_answer']}",
-                                    "timestamp": time.strftime("%H:%M"),
-                                    "requires_input": False
-                                })
-
-                                with st.spinner("Generating problem summary..."):
-                                    summary = st.session_state.solver.generate_problem_summary(
-                                        st.session_state.problem_state['solution']
-                                    )
-                                st.session_state.chat_history.append({
-                                    "role": "assistant",
-                                    "content": summary,
-                                    "timestamp": time.strftime("%H:%M"),
-                                    "requires_input": False
-                                })
-
-                                st.session_state.show_feedback_form = True
-
-                                data = {
-                                    "original_problem": st.session_state.problem_state['original_problem'],
-                                    "current_step": "complete",
-                                    "user_input": user_input,
-                                    "correct_answer": expected_answer,
-                                    "hint": None,
-                                    "final_answer": st.session_state.problem_state['final_answer'],
-                                    "problem_summary": summary,
-                                    "user_feedback": "Problem completed"
-                                }
-                                append_data_to_sheet(json.dumps(data))
-
-                            else:
-                                next_step_num = st.session_state.problem_state['current_step']
-                                next_step = st.session_state.problem_state['steps'][next_step_num]
-                                st.session_state.chat_history.append({
-                                    "role": "assistant",
-                                    "content": f"**Step {next_step_num +1}:** {next_step.instruction}\n\n{next_step.question}",
-                                    "timestamp": time.strftime("%H:%M"),
-                                    "requires_input": True,
-                                    "step_num": next_step_num
-                                })
-                                st.session_state.problem_state['awaiting_answer'] = True
-
-                            data = {
-                                "original_problem": st.session_state.problem_state['original_problem'],
-                                "current_step": current_step_index + 1,
-                                "user_input": user_input,
-                                "correct_answer": expected_answer,
-                                "hint": current_step.explanation if current_step.hint_count > 0 else None,
-                                "final_answer": st.session_state.problem_state['final_answer'],
-                                "problem_summary": None,
-                                "user_feedback": f"Incorrect answer (Attempt {current_step.attempt_count})"
-                            }
-                            append_data_to_sheet(json.dumps(data))
-
-                            if current_step.attempt_count >= 3:
-                                data = {
-                                    "original_problem": st.session_state.problem_state['original_problem'],
-                                    "current_step": current_step_index + 1,
-                                    "user_input": user_input,
-                                    "correct_answer": expected_answer,
-                                    "hint": current_step.explanation,
-                                    "final_answer": st.session_state.problem_state['final_answer'],
-                                    "problem_summary": None,
-                                    "user_feedback": "Max attempts reached, showing solution"
-                                }
-                                append_data_to_sheet(json.dumps(data))
-
-                        else:
-                            st.session_state.chat_history.append({
-                                "role": "assistant",
-                                "content": f"❌ That's not quite right. {explanation}\nYou have {remaining_attempts} attempts left.",
-                                "timestamp": time.strftime("%H:%M"),
-                                "requires_input": True,
-                                "step_num": current_step_index
-                            })
-
-                            data = {
-                                "original_problem": st.session_state.problem_state['original_problem'],
-                                "current_step": current_step_index + 1,
-                                "user_input": user_input,
-                                "correct_answer": expected_answer,
-                                "hint": current_step.explanation if current_step.hint_count > 0 else None,
-                                "final_answer": st.session_state.problem_state['final_answer'],
-                                "problem_summary": None,
-                                "user_feedback": f"Incorrect answer (Attempt {current_step.attempt_count})"
-                            }
-                            append_data_to_sheet(json.dumps(data))
-
-                except Exception as e:
-                    # Add error logging
-                    logging.error(f"Error in handle_user_input: {str(e)}")
-                    st.error(f"An error occurred: {str(e)}")
+def submit_action():
+    queue_action("submit", text=st.session_state.input_box)
+    # Update the input buffer when the form is submitted
+    st.session_state.input_buffer = st.session_state.input_box
 
+def display_exam_form():
+    """
+    Exam mode: show every step of the current problem on one form. Submitting it grades all
+    answers with a single validation call, see grade_exam.
+    """
+    problem_state = st.session_state.problem_state
+    exam = problem_state.get('exam')
+    if not exam or exam['submitted'] or problem_state['steps'] is None:
+        return
+
+    with st.form(key='exam_form'):
+        for i, step in enumerate(problem_state['steps']):
+            st.markdown(f"**Step {i + 1}:** {step.instruction}\n\n{step.question}")
+            st.text_input("Your answer", key=f"exam_answer_{i}")
+        st.form_submit_button("Submit exam", on_click=queue_action, args=("exam",))
+
+def start_problem(problem: str, solution):
+    """Make a solved problem the current one and post its first step (or the exam form)."""
+    session = tutor_session()
+    session.start(problem, solution, exam=bool(st.session_state.get('exam_mode')))
+    apply_session(session)
+
+def queue_problem(problem: str) -> bool:
+    """
+    Start solving a problem in the background on the shared scheduler. The job handle is kept
+    in session state; returns False if the problem could not be queued.
+    """
+    jobs = st.session_state.setdefault('solve_jobs', [])
+    if len(jobs) >= MAX_QUEUED_PROBLEMS:
+        st.warning(f"You can line up at most {MAX_QUEUED_PROBLEMS} problems at a time.")
+        return False
+    try:
+        ticket = get_scheduler().submit(SOLVE, st.session_state.solver.get_math_solution, problem)
+    except Overloaded as e:
+        st.warning(str(e))
+        return False
+    jobs.append({"problem": problem, "ticket": ticket})
+    return True
+
+def display_solve_queue():
+    """
+    Show the problems being solved in the background and, while one is in progress, a form
+    to line up the next. Polling happens in a fragment so it never blocks the chat.
+    """
+    if st.session_state.problem_state['steps'] is not None:
+        with st.expander("Queue up another problem"):
+            with st.form(key='next_problem_form', clear_on_submit=True):
+                next_problem = st.text_input("Next problem", key="next_problem_input")
+                queue_submitted = st.form_submit_button("Add to queue")
+            if queue_submitted and next_problem.strip():
+                queue_problem(next_problem.strip())
+
+    if st.session_state.get('solve_jobs'):
+        poll_solve_jobs()
+
+@st.fragment(run_every=SOLVE_POLL_SECONDS)
+def poll_solve_jobs():
+    jobs = st.session_state.get('solve_jobs') or []
+    if jobs and jobs[0]["ticket"].done() and st.session_state.problem_state['steps'] is None:
+        job = jobs.pop(0)
+        try:
+            start_problem(job["problem"], job["ticket"].result())
+        except Exception as e:
+            logging.error(f"Error in poll_solve_jobs: {str(e)}")
+            tutor_session().solve_failed(job["problem"], str(e))
+        # The one full run that shows the new problem
         st.rerun()
 
+    for i, job in enumerate(jobs):
+        ticket = job["ticket"]
+        label = "Up next" if i == 0 and st.session_state.problem_state['steps'] is not None else "Solving"
+        if ticket.done():
+            st.caption(f"✅ Ready: {job['problem']}")
+        elif ticket.position() > 0:
+            st.caption(f"⏳ {label}: {job['problem']} (number {ticket.position()} in line, "
+                       f"about {format_wait(ticket.estimated_wait())} to go)")
+        else:
+            st.caption(f"🔄 {label}: {job['problem']} ({format_wait(time.monotonic() - ticket.started_at)} so far)")
+
 def main_input_box():
     """
     Shows the text input box where user can add or remove characters.
@@ -309,7 +282,7 @@ def main_input_box():
 def display_chat_history(chat_container):
     with chat_container:
         for idx, message in enumerate(st.session_state.chat_history):
-            with st.chat_message(message["role"]):
+            with render_profiler.message(idx, message.get("event", message["role"])), st.chat_message(message["role"]):
                 st.markdown(f"<div class='step-indicator'>{message['timestamp']}</div>", unsafe_allow_html=True)
 
                 if message["role"] == "user":
@@ -350,110 +323,30 @@ def display_chat_history(chat_container):
                                     if step.graph_image:
                                         st.image(step.graph_image, caption="Graph for this step")
 
-                if message.get("requires_input"):
-                    with st.container():
-                        col1, col2 = st.columns([7, 3])
+        display_step_controls()
 
-                        step_num = message.get("step_num")
-                        current_step = None
-                        if step_num is not None:
-                            if st.session_state.problem_state['steps'] and step_num < len(st.session_state.problem_state['steps']):
-                                current_step = st.session_state.problem_state['steps'][step_num]
-                        else:
-                            st.write("Error: Could not determine current step.")
-                            continue
-
-                        step_key = f"show_question_input_{step_num}"
-                        if step_key not in st.session_state:
-                            st.session_state[step_key] = False
-
-                        with col1:
-                            if st.button("Show Hint", key=f"hint_{idx}"):
-                                # Add check for completed problem
-                                if st.session_state.problem_state['steps'] is None or step_num >= len(st.session_state.problem_state['steps']):
-                                    st.warning("Cannot show hints for a completed problem.")
-                                else:    
-                                    remaining_hints = max(0, 3 - current_step.hint_count)
-                                    if remaining_hints > 0:
-                                        hint = current_step.explanation
-                                        current_step.hint_count += 1
-
-                                        hint_parts = hint.split("$")
-                                        for i, part in enumerate(hint_parts):
-                                            if i % 2 == 0:
-                                                if part.strip():
-                                                    st.write(part.strip())
-                                            else:
-                                                if part.strip():
-                                                    st.latex(part.strip())
-                                    else:
-                                        st.warning("You've reached the maximum number of hints for this step.")
-
-                        with col2:
-                            if st.button("Ask Custom Question", key=f"custom_{idx}"):
-                                st.session_state[step_key] = not st.session_state[step_key]
-
-                            if st.session_state[step_key]:
-                                with st.form(key=f"ask_custom_form_{idx}"):
-                                    user_question = st.text_input(
-                                        "",  # Label hidden
-                                        key=f"hint_input_{idx}",
-                                        placeholder="Need clarification? Ask Raze..."
-                                    )
-                                    ask_submitted = st.form_submit_button("Ask")
-
-                                if ask_submitted:
-                                    previous_attempts = [
-                                        msg["content"]
-                                        for msg in st.session_state.chat_history
-                                        if msg["role"] == "user" and msg.get("step_num") == step_num
-                                    ]
-
-                                    remaining_hints = max(0, 3 - current_step.hint_count)
-                                    if remaining_hints > 0:
-                                        hint = st.session_state.solver.generate_custom_hint(
-                                            current_step,
-                                            user_question,
-                                            previous_attempts
-                                        )
-                                        current_step.hint_count += 1
-
-                                        hint_parts = hint.split("$")
-                                        for i, part in enumerate(hint_parts):
-                                            if i % 2 == 0:
-                                                if part.strip():
-                                                    st.write(part.strip())
-                                            else:
-                                                if part.strip():
-                                                    st.latex(part.strip())
-                                    else:
-                                        st.warning("You've reached the maximum number of hints for this step.")
-
-                        if current_step:
-                            remaining_hints = max(0, 3 - current_step.hint_count)
-                            st.caption(f"Remaining hints: {remaining_hints}")
-
-    if st.session_state.problem_state['steps'] is not None and st.session_state.problem_state['awaiting_answer']:
-        if not any(msg.get('requires_input') for msg in st.session_state.chat_history[-1:]):
-            current_step_index = st.session_state.problem_state['current_step']
-            if current_step_index < len(st.session_state.problem_state['steps']):
-                step = st.session_state.problem_state['steps'][current_step_index]
-                st.session_state.chat_history.append({
-                    "role": "assistant",
-                    "content": f"**Step {current_step_index +1}:** {step.instruction}\n\n{step.question}",
-                    "timestamp": time.strftime("%H:%M"),
-                    "requires_input": True,
-                    "step_num": current_step_index
-                })
-                st.rerun()
-            else:
-                st.session_state.problem_state = {
-                    'original_problem': None,
-                    'steps': None,
-                    'current_step': 0,
-                    'expected_answer': None,
-                    'variables': set(),
-                    'awaiting_answer': False,
-                    'final_answer': None,
-                    'solution': None
-                } 
\ No newline at end of file
+def display_step_controls():
+    """
+    Hint and question controls for the step waiting for an answer. They only record the
+    action, process_action applies it at the start of the run they trigger.
+    """
+    session = tutor_session()
+    step = session.current_step
+    if step is None:
+        return
+    step_num = session.problem_state['current_step']
+    col1, col2 = st.columns([7, 3])
+    with col1:
+        st.button("Show Hint", key=f"hint_{step_num}", on_click=queue_action, args=("hint",))
+    with col2:
+        # Opens in the browser, no script run until the question is sent
+        with st.popover("Ask Custom Question"):
+            with st.form(key=f"ask_custom_form_{step_num}", clear_on_submit=True):
+                st.text_input(
+                    "Your question",
+                    key=f"hint_question_{step_num}",
+                    placeholder="Need clarification? Ask Raze...",
+                    label_visibility="collapsed"
+                )
+                st.form_submit_button("Ask", on_click=queue_custom_hint, args=(step_num,))
+    st.caption(f"Remaining hints: {max(0, MAX_HINTS - step.hint_count)}")
@@ -1,39 +1,36 @@
 import streamlit as st
-from sheets import append_data_to_sheet
-import json
 
 def display_feedback_form():
+    if st.session_state.pop('feedback_sent', False):
+        st.success("Thank you for your feedback!")
+    if not st.session_state.show_feedback_form:
+        return
+
     st.markdown("---")
     st.markdown("### We'd love your feedback!")
     with st.form(key='feedback_form'):
-        name = st.text_input("Name")
-        email = st.text_input("Email")
-        feedback = st.text_area("Share your experience and thoughts using RazeMath!")
-        submit_feedback = st.form_submit_button("Submit Feedback")
-
-        if submit_feedback and name and email and feedback:
-            feedback_data = {
-                "original_problem": st.session_state.problem_state['original_problem'],
-                "current_step": "feedback",
-                "user_input": None,
-                "correct_answer": None,
-                "hint": None,
-                "final_answer": st.session_state.problem_state['final_answer'],
-                "problem_summary": None,
-                "user_feedback": f"Name: {name}, Email: {email}, Feedback: {feedback}"
-            }
-            append_data_to_sheet(json.dumps(feedback_data))
+        st.text_input("Name", key="feedback_name")
+        st.text_input("Email", key="feedback_email")
+        st.text_area("Share your experience and thoughts using RazeMath!", key="feedback_text")
+        st.form_submit_button("Submit Feedback", on_click=submit_feedback)
 
-            st.session_state.show_feedback_form = False
-            st.session_state.problem_state = {
-                'original_problem': None,
-                'steps': None,
-                'current_step': 0,
-                'expected_answer': None,
-                'variables': set(),
-                'awaiting_answer': False,
-                'final_answer': None,
-                'solution': None
-            }
-            st.success("Thank you for your feedback!")
-            st.rerun() 
\ No newline at end of file
+def submit_feedback():
+    """Form callback: log the feedback with the rows flushed at the end of the run and hide the form."""
+    name = st.session_state.get("feedback_name")
+    email = st.session_state.get("feedback_email")
+    feedback = st.session_state.get("feedback_text")
+    if not (name and email and feedback):
+        return
+    problem = st.session_state.get('completed_problem') or {}
+    st.session_state.setdefault('sheet_rows', []).append({
+        "original_problem": problem.get('original_problem'),
+        "current_step": "feedback",
+        "user_input": None,
+        "correct_answer": None,
+        "hint": None,
+        "final_answer": problem.get('final_answer'),
+        "problem_summary": None,
+        "user_feedback": f"Name: {name}, Email: {email}, Feedback: {feedback}"
+    })
+    st.session_state.show_feedback_form = False
+    st.session_state.feedback_sent = True
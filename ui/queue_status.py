@@ -0,0 +1,28 @@
+import streamlit as st
+from scheduler import get_scheduler
+
+def run_scheduled(kind, fn, *args, message="Working on it...", **kwargs):
+    """
+    Run fn through the shared scheduler and wait for it, showing the student their place in
+    line while the job is queued. Raises scheduler.Overloaded when the job is not admitted.
+    """
+    ticket = get_scheduler().submit(kind, fn, *args, **kwargs)
+    # Most jobs start right away; don't flash a status line for those
+    if ticket.wait(0.05):
+        return ticket.result()
+
+    status = st.empty()
+    with st.spinner(message):
+        while not ticket.wait(0.5):
+            position = ticket.position()
+            if position > 1:
+                status.caption(f"You're number {position} in line, about {format_wait(ticket.estimated_wait())} to go.")
+            else:
+                status.empty()
+    status.empty()
+    return ticket.result()
+
+def format_wait(seconds: float) -> str:
+    if seconds < 60:
+        return f"{max(1, round(seconds))}s"
+    return f"{round(seconds / 60)} min"
@@ -1,57 +1,32 @@
 import streamlit as st
+from resilience import health
+from tutor import new_problem_state
+
+# What students notice while a dependency's circuit breaker is open
+DEGRADED_MESSAGES = {
+    "openai": "The tutor is having trouble reaching its AI service, responses may fail.",
+    "openrouter": "Solving new problems is temporarily unavailable.",
+    "wolfram": "Graphs are temporarily unavailable.",
+}
 
 def create_calculator_sidebar():
-    """Create the calculator sidebar with all buttons"""
-    st.sidebar.header("Advanced Calculator")
+    """
+    Create the sidebar controls. The calculator keys live next to the input box, see
+    ui.calculator, so pressing one doesn't rerun the sidebar or the chat.
+    """
+    st.sidebar.header("Math Tutor")
+    for name, status in health().items():
+        if status["state"] == "open" and name in DEGRADED_MESSAGES:
+            st.sidebar.warning(DEGRADED_MESSAGES[name])
     st.sidebar.markdown("---")
 
-    if st.sidebar.button("Reset Problem", key="reset_button", use_container_width=True):
-        reset_problem()
-
-    st.sidebar.markdown("---")
-    st.sidebar.subheader("Advanced Operations")
-    cols = st.sidebar.columns(4)
-    advanced_ops = [
-        ("d/dx", r"\frac{d}{dx}"),
-        ("∫", r"\int"),
-        ("∫_a^b", r"\int_{a}^{b}"),
-        ("lim", r"\lim_{x \to }"),
-        ("Σ", r"\sum_{i=1}^{n}")
-    ]
-    for i, (op, latex) in enumerate(advanced_ops):
-        with cols[i % 4]:
-            st.latex(latex)
-            if st.button(op, key=f"adv_{op}", use_container_width=True):
-                if op == "∫":
-                    st.session_state.input_buffer += "∫() dx "
-                elif op == "∫_a^b":
-                    st.session_state.input_buffer += "∫_a^b () dx "
-                elif op == "lim":
-                    st.session_state.input_buffer += "lim_{x→} () "
-                elif op == "Σ":
-                    st.session_state.input_buffer += "Σ_{i=1}^n () "
-                else:
-                    st.session_state.input_buffer += f" {op} "
-                st.session_state.input_box = st.session_state.input_buffer
+    # A callback, so the reset is in place before anything below is drawn
+    st.sidebar.button("Reset Problem", key="reset_button", use_container_width=True, on_click=reset_problem)
+    if st.session_state.pop('problem_reset', False):
+        st.sidebar.success("Problem has been reset.")
 
-    st.sidebar.markdown("---")
-    st.sidebar.subheader("Functions")
-    cols = st.sidebar.columns(3)
-    functions = ["sin", "cos", "tan", "log", "e^x"]
-    for i, func in enumerate(functions):
-        with cols[i % 3]:
-            st.latex(func)
-            if st.button(func, key=f"func_{func}", use_container_width=True):
-                if func == "e^x":
-                    st.session_state.input_buffer += "e^("
-                else:
-                    st.session_state.input_buffer += f"{func}("
-                    st.session_state.input_box = st.session_state.input_buffer
-
-    st.sidebar.markdown("---")
-    if st.sidebar.button("Clear", key="clear_expr", use_container_width=True):
-        st.session_state.input_buffer = ""
-        st.session_state.input_box = ""
+    st.sidebar.toggle("Exam mode", key="exam_mode",
+                      help="Answer every step of the next problem at once and get them graded together")
 
     st.sidebar.markdown("---")
     with st.sidebar.expander("Keyboard Shortcuts"):
@@ -63,23 +38,15 @@ def create_calculator_sidebar():
         """)
 
 def reset_problem():
+    # Problems still being solved for the old session would otherwise start in the new one
+    for job in st.session_state.get('solve_jobs') or []:
+        job["ticket"].cancel()
+    st.session_state.solve_jobs = []
     st.session_state.chat_history = []
-    st.session_state.problem_state = {
-        'original_problem': None,
-        'steps': None,
-        'current_step': 0,
-        'expected_answer': None,
-        'variables': set(),
-        'awaiting_answer': False,
-        'final_answer': None,
-        'solution': None
-    }
+    st.session_state.problem_state = new_problem_state()
     st.session_state.input_buffer = ''
     st.session_state.input_box = ''
-    st.session_state.user_input_submitted = False
     st.session_state.reset_input_box = False
     st.session_state.show_feedback_form = False
     st.session_state.user_input = ''
-    st.success("Problem has been reset.")
-    st.rerun()
-
+    st.session_state.problem_reset = True
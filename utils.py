@@ -1,6 +1,4 @@
-import os
-from dotenv import load_dotenv
+from settings import get_settings
 
 def load_environment_variables():
-    load_dotenv()
-    return os.getenv("OPENAI_API_KEY") 
\ No newline at end of file
+    return get_settings().openai_api_key